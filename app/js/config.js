@@ -4,6 +4,9 @@ export let THREADS = savedThreads ? parseInt(savedThreads) : 16;
 
 export const TEST_DURATION = 12000; 
 
+// Transport testu przepustowości: 'http' (workery + wiele żądań) lub 'ws' (jedno połączenie WebSocket)
+export let TRANSPORT = localStorage.getItem('ls_transport') || 'http';
+
 // Funkcja do zmiany liczby wątków
 export function setThreads(n) {
     THREADS = n;
@@ -11,6 +14,11 @@ export function setThreads(n) {
     localStorage.setItem('ls_threads', n);
 }
 
+export function setTransport(t) {
+    TRANSPORT = t;
+    localStorage.setItem('ls_transport', t);
+}
+
 export const translations = {
     pl: { 
         start: "START", 
@@ -49,6 +57,8 @@ export const translations = {
         mode_multi: "Wiele",
         msg_mode_single: "Tryb połączenia: Pojedyncze",
         msg_mode_multi: "Tryb połączenia: Wiele",
+        mode_ws: "WebSocket",
+        msg_mode_ws: "Tryb połączenia: WebSocket",
 
         log_start: "Start testu", 
         log_end: "Koniec testu", 
@@ -102,6 +112,7 @@ export const translations = {
         btn_connect_account: "POŁĄCZ KONTO",
         btn_disconnect_account: "ODŁĄCZ KONTO",
         btn_backup_now: "WYŚLIJ TERAZ",
+        btn_restore_gdrive: "PRZYWRÓĆ Z DRIVE",
         help_gdrive_config: "Jak skonfigurować Client ID/Secret?",
         
         lbl_last_backup: "Ostatni backup:",
@@ -167,6 +178,8 @@ export const translations = {
         mode_multi: "Multi",
         msg_mode_single: "Connection mode: Single",
         msg_mode_multi: "Connection mode: Multi",
+        mode_ws: "WebSocket",
+        msg_mode_ws: "Connection mode: WebSocket",
 
         log_start: "Starting test", 
         log_end: "Test finished.", 
@@ -220,6 +233,7 @@ export const translations = {
         btn_connect_account: "CONNECT ACCOUNT",
         btn_disconnect_account: "DISCONNECT ACCOUNT",
         btn_backup_now: "BACKUP NOW",
+        btn_restore_gdrive: "RESTORE FROM DRIVE",
         help_gdrive_config: "How to configure Client ID/Secret?",
         
         lbl_last_backup: "Last backup:",
@@ -5,7 +5,8 @@ import { initCharts } from './charts.js';
 
 export async function loadSettings() {
     try {
-        const res = await fetch('/api/settings', { cache: "no-store" });
+        // no-cache: przeglądarka wysyła If-None-Match i przy 304 używa swojej kopii
+        const res = await fetch('/api/settings', { cache: "no-cache" });
         if (!res.ok) throw new Error("API Error");
         
         const data = await res.json();
@@ -116,13 +117,16 @@ export async function saveResult(ping, down, up, mode, jitter, pingDl, pingUl) {
     }
 }
 
-export async function fetchHistory(page, limit, sortBy, order) {
+export async function fetchHistory(page, limit, sortBy, order, after = null) {
     try {
-        const res = await fetch(`/api/history?page=${page}&limit=${limit}&sort_by=${sortBy}&order=${order}`);
+        // after = kursor "next" z poprzedniej strony (paginacja po indeksie zamiast OFFSET)
+        const cursorParam = after ? `&after=${encodeURIComponent(after)}` : '';
+        const res = await fetch(`/api/history?page=${page}&limit=${limit}&sort_by=${sortBy}&order=${order}${cursorParam}`);
+        if (!res.ok) throw new Error("API Error");
         return await res.json();
     } catch(e) { 
         console.error("History fetch error", e); 
-        return { total: 0, page: 1, limit: limit, data: [] };
+        return { total: 0, page: 1, limit: limit, next: null, data: [] };
     }
 }
 
@@ -7,6 +7,9 @@ let itemsPerPage = 10;
 let totalItems = 0;
 let sortBy = 'date';
 let sortOrder = 'desc';
+// Kursory stron: pageCursors[p - 1] to "after" dla strony p (strona 1 = null)
+let pageCursors = [null];
+let nextCursor = null;
 
 let selectedIds = new Set();
 let currentData = []; 
@@ -42,6 +45,10 @@ function renderHistoryTable(data) {
             modeIcon = 'device_hub';
             modeKey = 'mode_single';
             modeTitle = translations[lang]['mode_single'] || 'Single';
+        } else if (rowMode === 'WS') {
+            modeIcon = 'swap_vert';
+            modeKey = 'mode_ws';
+            modeTitle = translations[lang]['mode_ws'] || 'WebSocket';
         }
 
         // --- FORMATOWANIE PINGU (Idle | DL | UL) ---
@@ -216,7 +223,7 @@ function updatePaginationControls() {
     const displayTotal = totalItems > 0 ? totalPages : 1;
     el('page-info').innerText = `${displayPage} / ${displayTotal}`;
     el('prev-page').disabled = currentPage <= 1;
-    el('next-page').disabled = currentPage >= totalPages;
+    el('next-page').disabled = currentPage >= totalPages || !nextCursor;
 }
 
 function updateSortIcons() {
@@ -234,14 +241,22 @@ function updateSortIcons() {
 }
 
 export async function loadHistory(page = currentPage, sort_by = sortBy, order = sortOrder) {
+    if (sort_by !== sortBy || order !== sortOrder || page === 1) {
+        pageCursors = [null];
+    }
+    // Kursory znamy tylko dla stron odwiedzonych po kolei
+    if (page > pageCursors.length) page = pageCursors.length;
     currentPage = page;
     sortBy = sort_by;
     sortOrder = order;
 
-    const responseData = await fetchHistory(currentPage, itemsPerPage, sortBy, sortOrder);
+    const responseData = await fetchHistory(currentPage, itemsPerPage, sortBy, sortOrder, pageCursors[currentPage - 1]);
     
     const data = responseData.data; 
     totalItems = responseData.total;
+    nextCursor = responseData.next || null;
+    pageCursors.length = currentPage;
+    if (nextCursor) pageCursors.push(nextCursor);
     
     renderHistoryTable(data);
     updatePaginationControls();
@@ -13,7 +13,7 @@ import {
     formatSpeed,
     timeout 
 } from '/js/utils.js';
-import { translations, TEST_DURATION, THREADS, setThreads } from '/js/config.js';
+import { translations, TEST_DURATION, THREADS, TRANSPORT, setThreads, setTransport } from '/js/config.js';
 import { initGauge, reloadGauge, resetGauge, getGaugeInstance } from '/js/gauge.js';
 import { initCharts, resetCharts } from '/js/charts.js';
 import { loadSettings, saveSettings, saveResult } from '/js/data_sync.js';
@@ -106,7 +106,7 @@ async function startTest() {
         await new Promise(r => setTimeout(r, 1600)); 
 
         // 4. SAVE
-        const currentMode = (THREADS > 1) ? "Multi" : "Single";
+        const currentMode = (TRANSPORT === 'ws') ? "WS" : ((THREADS > 1) ? "Multi" : "Single");
         await saveResult(
             pingResults.ping, 
             downResult.speed, 
@@ -308,7 +308,14 @@ window.onload = () => {
     const updateModeUI = () => {
         if (!modeToggle || !modeText) return;
         
-        if (THREADS > 1) {
+        if (TRANSPORT === 'ws') {
+            const key = 'mode_ws';
+            const txt = (translations[lang] && translations[lang][key]) ? translations[lang][key] : "WebSocket";
+            
+            modeText.innerText = txt;
+            modeText.setAttribute('data-key', key);
+            modeToggle.querySelector('.material-icons').innerText = "swap_vert";
+        } else if (THREADS > 1) {
             const key = 'mode_multi';
             const txt = (translations[lang] && translations[lang][key]) ? translations[lang][key] : "Multi";
             
@@ -328,14 +335,20 @@ window.onload = () => {
     updateModeUI();
     
     if(modeToggle) {
+        // Cykl trybów: Multi -> Single -> WebSocket -> Multi
         modeToggle.onclick = () => {
-            if (THREADS > 1) {
+            if (TRANSPORT === 'ws') {
+                setTransport('http');
+                setThreads(16);
+                const msg = translations[lang]['msg_mode_multi'] || "Tryb: Wiele połączeń";
+                log(msg);
+            } else if (THREADS > 1) {
                 setThreads(1);
                 const msg = translations[lang]['msg_mode_single'] || "Tryb: Pojedyncze połączenie";
                 log(msg);
             } else {
-                setThreads(16);
-                const msg = translations[lang]['msg_mode_multi'] || "Tryb: Wiele połączeń";
+                setTransport('ws');
+                const msg = translations[lang]['msg_mode_ws'] || "Tryb: WebSocket";
                 log(msg);
             }
             updateModeUI();
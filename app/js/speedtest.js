@@ -1,5 +1,5 @@
 import { el, formatSpeed, currentUnit, setLastResultDown, setLastResultUp } from '/js/utils.js';
-import { THREADS, TEST_DURATION } from '/js/config.js';
+import { THREADS, TEST_DURATION, TRANSPORT } from '/js/config.js';
 import { checkGaugeRange, setGaugeValue } from '/js/gauge.js';
 import { updateChart } from '/js/charts.js';
 
@@ -18,6 +18,17 @@ const sendLogToDocker = (text) => {
     }).catch(() => {});
 };
 
+// Sesja testu po stronie serwera - sumuje bajty ze wszystkich workerów uvicorna
+const createTestSession = async () => {
+    try {
+        const res = await fetch('/api/test', { method: 'POST' });
+        if (!res.ok) return null;
+        return (await res.json()).id;
+    } catch(e) {
+        return null;
+    }
+};
+
 // --- WORKER CODE (INLINE BLOB) ---
 const workerScript = `
 self.onmessage = function(e) {
@@ -143,81 +154,49 @@ function runUpload(url, maxBufferSize, minBufferSize) {
 `;
 
 // --- PING HELPER ---
-function calculateJitter(pings) {
-    if (pings.length < 2) return 0;
-    let differences = 0;
-    for (let i = 1; i < pings.length; i++) {
-        differences += Math.abs(pings[i] - pings[i-1]);
-    }
-    return differences / (pings.length - 1);
-}
+// Pomiar opóźnień prowadzi serwer (/api/ws/latency): wysyła binarne sondy
+// ze znacznikiem czasu, a przeglądarka tylko je odbija. Statystyki
+// (min/średnia/p50/p90/p99/jitter) liczone są po stronie serwera.
+const latencyUrl = (params) => {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    return `${protocol}//${window.location.host}/api/ws/latency?${params}`;
+};
 
 // --- PHASE 1: IDLE PING & JITTER ---
 export function runPing() {
     return new Promise((resolve, reject) => {
         sendLogToDocker(`[Phase 1] Starting WebSocket Ping (Idle)...`);
         
-        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const host = window.location.host;
-        const wsUrl = `${protocol}//${host}/api/ws/ping`;
-
-        let ws = new WebSocket(wsUrl);
-        
         const SAMPLES = 20; 
         const WARMUP = 5;   
+
+        let ws = new WebSocket(latencyUrl(`interval=100&count=${SAMPLES}&warmup=${WARMUP}&phase=idle`));
+        ws.binaryType = 'arraybuffer';
         
-        let pings = [];
-        let count = 0;
-        let startTime = 0;
         let isDone = false;
 
-        ws.onopen = () => {
-            // POPRAWKA: Małe opóźnienie dla iOS/Safari po adresie IP
-            setTimeout(sendPing, 100);
-        };
-
-        const sendPing = () => {
-            if(isDone || ws.readyState !== WebSocket.OPEN) return;
-            startTime = performance.now();
-            
-            // POPRAWKA: Bezpieczne wysyłanie (try/catch)
-            try {
-                ws.send(startTime.toString());
-            } catch(e) {
-                console.warn("WS send error, retrying...", e);
-                setTimeout(sendPing, 100);
-            }
-        };
-
         ws.onmessage = (event) => {
             if(isDone) return;
-            const now = performance.now();
-            const latency = now - startTime;
             
-            if (count < WARMUP) {
-                count++;
-                setTimeout(sendPing, 100); 
-            } else if (count < WARMUP + SAMPLES) {
-                pings.push(latency);
-                count++;
-                setTimeout(sendPing, 100);
-            } else {
-                finishPing();
+            // Sonda binarna - odsyłamy natychmiast bez zmian
+            if (typeof event.data !== 'string') {
+                try { ws.send(event.data); } catch(e) {}
+                return;
             }
+
+            let msg = null;
+            try { msg = JSON.parse(event.data); } catch(e) {}
+            if (msg && msg.type === 'stats') finishPing(msg.phases.idle);
         };
         
-        const finishPing = () => {
+        const finishPing = (stats) => {
             if(isDone) return;
             isDone = true;
             
-            if (pings.length > 0) {
-                const minPing = Math.min(...pings);
-                const avgPing = pings.reduce((a,b) => a+b, 0) / pings.length;
-                const jitter = calculateJitter(pings);
-                
-                sendLogToDocker(`[Phase 1] Result: Min=${minPing.toFixed(2)}, Avg=${avgPing.toFixed(2)}, Jitter=${jitter.toFixed(2)}`);
+            if (stats && stats.count > 0) {
+                sendLogToDocker(`[Phase 1] Result: Min=${stats.min.toFixed(2)}, Avg=${stats.mean.toFixed(2)}, P90=${stats.p90.toFixed(2)}, Jitter=${stats.jitter.toFixed(2)}`);
                 ws.close();
-                resolve({ ping: minPing, jitter: jitter });
+                resolve({ ping: stats.min, jitter: stats.jitter });
             } else {
                 ws.close();
                 resolve({ ping: 0, jitter: 0 });
@@ -225,7 +204,7 @@ export function runPing() {
         };
 
         ws.onclose = () => {
-            if(!isDone) finishPing();
+            if(!isDone) finishPing(null);
         };
 
         ws.onerror = (err) => {
@@ -241,57 +220,58 @@ export function runPing() {
 
 // --- LOADED PING RUNNER ---
 export class LoadedPingRunner {
-    constructor(onUpdate) {
-        this.pings = [];
+    constructor(onUpdate, phase) {
         this.isRunning = false;
         this.ws = null;
         this.onUpdate = onUpdate;
-        this.startTime = 0;
+        this.phase = phase || 'download';
+        this.statsResolve = null;
     }
 
     start() {
         this.isRunning = true;
-        this.pings = [];
         
-        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const host = window.location.host;
-        const wsUrl = `${protocol}//${host}/api/ws/ping`;
-        
-        this.ws = new WebSocket(wsUrl);
-
-        this.ws.onopen = () => {
-            setTimeout(() => this.sendPing(), 50);
-        };
-
-        this.ws.onmessage = () => {
+        this.ws = new WebSocket(latencyUrl(`interval=500&phase=${this.phase}`));
+        this.ws.binaryType = 'arraybuffer';
+
+        this.ws.onmessage = (event) => {
+            if (typeof event.data === 'string') {
+                let msg = null;
+                try { msg = JSON.parse(event.data); } catch(e) {}
+                if (msg && msg.type === 'stats' && this.statsResolve) this.statsResolve(msg.phases[this.phase]);
+                return;
+            }
             if (!this.isRunning) return;
-            const now = performance.now();
-            const latency = now - this.startTime;
-            this.pings.push(latency);
-            if (this.onUpdate) this.onUpdate(latency);
-            setTimeout(() => this.sendPing(), 1000);
+            try { this.ws.send(event.data); } catch(e) {}
+
+            // Bajty 4-7 sondy: RTT poprzedniej sondy zmierzony przez serwer (us)
+            const lastRttUs = new DataView(event.data).getUint32(4, true);
+            if (lastRttUs > 0 && this.onUpdate) this.onUpdate(lastRttUs / 1000);
         };
 
         this.ws.onerror = () => {};
     }
 
-    sendPing() {
-        if (!this.isRunning || !this.ws || this.ws.readyState !== WebSocket.OPEN) return;
-        this.startTime = performance.now();
-        try {
-            this.ws.send("ping");
-        } catch(e) {}
-    }
-
+    // Zwraca średni ping pod obciążeniem (ms) wyliczony przez serwer
     stop() {
         this.isRunning = false;
-        if (this.ws) {
-            this.ws.close();
-            this.ws = null;
+        const ws = this.ws;
+        this.ws = null;
+        if (!ws || ws.readyState !== WebSocket.OPEN) {
+            if (ws) ws.close();
+            return Promise.resolve(0);
         }
-        if (this.pings.length === 0) return 0;
-        const avg = this.pings.reduce((a,b) => a+b, 0) / this.pings.length;
-        return avg;
+
+        return new Promise((resolve) => {
+            const done = (stats) => {
+                this.statsResolve = null;
+                ws.close();
+                resolve(stats && stats.count > 0 ? stats.mean : 0);
+            };
+            this.statsResolve = done;
+            setTimeout(() => { if (this.statsResolve) done(null); }, 1000);
+            try { ws.send(JSON.stringify({ cmd: 'stats' })); } catch(e) { done(null); }
+        });
     }
 }
 
@@ -319,6 +299,8 @@ class SpeedTestEngine {
         this.startThreads = 2; 
         this.monitorInterval = 400; 
         this.minGrowth = 0.02; 
+        // Identyfikator testu - serwer buduje na jego podstawie własną oś czasu Uploadu
+        this.testId = Math.random().toString(36).slice(2, 12);
         
         if (this.maxThreads === 1) {
             this.startThreads = 1;
@@ -363,8 +345,11 @@ class SpeedTestEngine {
             maxBuf = 4 * 1024 * 1024; 
         }
 
-        const downloadUrl = '/api/download?size=100'; 
-        const uploadUrl = '/api/upload';
+        const sessionParam = this.sessionId ? `&session=${this.sessionId}` : '';
+        // Jeden strumień na cały test (chunked, serwer kończy po czasie) - bez ponownego slow-startu co 100 MB
+        const streamSeconds = Math.ceil(TEST_DURATION / 1000) + 2;
+        const downloadUrl = `/api/download?duration=${streamSeconds}s${sessionParam}`; 
+        const uploadUrl = `/api/upload?test_id=${this.testId}${sessionParam}`;
 
         const config = {
             command: this.type,
@@ -394,7 +379,8 @@ class SpeedTestEngine {
         }
     }
 
-    start(onUpdate, onFinish) {
+    async start(onUpdate, onFinish) {
+        this.sessionId = await createTestSession();
         this.startTime = performance.now();
         this.lastTime = this.startTime;
         this.uiSpeed = 0;
@@ -543,6 +529,118 @@ class SpeedTestEngine {
         this.activeWorkers = [];
         this.workerResults.clear(); 
         if (this.blobUrl) URL.revokeObjectURL(this.blobUrl);
+
+        if (this.sessionId) {
+            const key = this.type;
+            fetch(`/api/test/${this.sessionId}/finish`, { method: 'POST' })
+                .then(res => res.ok ? res.json() : null)
+                .then(s => {
+                    if (s && s[key]) sendLogToDocker(`[Engine] Server-side ${key.toUpperCase()} (all workers): ${s[key].mbps.toFixed(2)} Mbps, ${s[key].workers} process(es)`);
+                })
+                .catch(() => {});
+        }
+
+        if (this.type === 'upload') {
+            fetch(`/api/upload/timeline/${this.testId}`, { cache: "no-store" })
+                .then(res => res.ok ? res.json() : null)
+                .then(t => {
+                    if (t) sendLogToDocker(`[Engine] Server-side UL: ${t.mbps.toFixed(2)} Mbps (${t.buckets.length} x ${t.slot_ms} ms)`);
+                })
+                .catch(() => {});
+        }
+    }
+}
+
+// --- WEBSOCKET ENGINE (tryb "WS") ---
+// Jedno długotrwałe połączenie WebSocket zamiast wielu żądań HTTP.
+// Download: liczymy bajty odebranych ramek. Upload: serwer co 200 ms
+// raportuje bajty faktycznie odebrane, a na końcu przesyła wynik.
+class WsThroughputEngine {
+    constructor(type) {
+        this.type = type;
+        this.ws = null;
+        this.timer = null;
+        this.pump = null;
+        this.bytes = 0;
+        this.uiSpeed = 0;
+        this.startTime = null;
+        this.finished = false;
+        this.frameKb = isMobileDevice() ? 256 : 1024;
+    }
+
+    start(onUpdate, onFinish) {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const params = `direction=${this.type}&duration=${TEST_DURATION / 1000}&frame=${this.frameKb}`;
+        this.ws = new WebSocket(`${protocol}//${window.location.host}/api/ws/throughput?${params}`);
+        this.ws.binaryType = 'arraybuffer';
+
+        sendLogToDocker(`[Engine] Starting ${this.type.toUpperCase()} test over WebSocket. Frame: ${this.frameKb} KB`);
+        if(el('thread-badge')) el('thread-badge').style.opacity = '1';
+
+        const finish = (serverResult) => {
+            if (this.finished) return;
+            this.finished = true;
+            const duration = this.startTime ? (performance.now() - this.startTime) / 1000 : 0;
+            let finalSpeed = (duration > 0) ? (this.bytes * 8) / duration / 1e6 : 0;
+            // Upload: wynik serwera jest miarodajny (bufor bufferedAmount zawyża stronę klienta)
+            if (serverResult && this.type === 'upload') finalSpeed = serverResult.mbps;
+            if (serverResult) {
+                sendLogToDocker(`[Engine] Server-side ${this.type.toUpperCase()} (WS): ${serverResult.mbps.toFixed(2)} Mbps, frames: ${serverResult.frames}, send wait: ${serverResult.send_wait}s`);
+            }
+            this.stop();
+            onFinish(finalSpeed);
+        };
+
+        this.ws.onopen = () => {
+            this.startTime = performance.now();
+
+            if (this.type === 'upload') {
+                const frame = new Uint8Array(this.frameKb * 1024);
+                // Utrzymujemy kilka ramek w buforze gniazda - kontrola przepływu po stronie przeglądarki
+                this.pump = setInterval(() => {
+                    while (this.ws && this.ws.readyState === WebSocket.OPEN && this.ws.bufferedAmount < frame.length * 4) {
+                        this.ws.send(frame);
+                    }
+                }, 5);
+            }
+
+            this.timer = setInterval(() => {
+                const duration = (performance.now() - this.startTime) / 1000;
+                const avgSpeed = (duration > 0.1) ? (this.bytes * 8) / duration / 1e6 : 0;
+                const alpha = (avgSpeed > this.uiSpeed) ? 0.24 : 0.12;
+                this.uiSpeed = (avgSpeed * alpha) + (this.uiSpeed * (1 - alpha));
+                onUpdate(this.uiSpeed, avgSpeed, duration, 1);
+
+                // Zabezpieczenie na wypadek braku wyniku od serwera
+                if (duration * 1000 >= TEST_DURATION + 2000) finish(null);
+            }, 50);
+        };
+
+        this.ws.onmessage = (event) => {
+            if (typeof event.data !== 'string') {
+                this.bytes += event.data.byteLength;
+                return;
+            }
+            let msg = null;
+            try { msg = JSON.parse(event.data); } catch(e) {}
+            if (!msg) return;
+            if (msg.type === 'progress') this.bytes = msg.bytes;
+            else if (msg.type === 'result') finish(msg);
+        };
+
+        this.ws.onerror = () => {};
+        this.ws.onclose = () => finish(null);
+    }
+
+    stop() {
+        clearInterval(this.timer);
+        clearInterval(this.pump);
+        if(el('thread-badge')) el('thread-badge').style.opacity = '0.5';
+        if (this.ws) {
+            const ws = this.ws;
+            this.ws = null;
+            ws.close();
+        }
     }
 }
 
@@ -550,11 +648,11 @@ export function runDownload() {
     return new Promise((resolve) => {
         let maxT = (THREADS === 1) ? 1 : THREADS;
         if (THREADS > 1 && isMobileDevice()) maxT = Math.min(maxT, 8); 
-        const engine = new SpeedTestEngine('download', maxT);
+        const engine = (TRANSPORT === 'ws') ? new WsThroughputEngine('download') : new SpeedTestEngine('download', maxT);
 
         const pingRunner = new LoadedPingRunner((latency) => {
             el('ping-dl-val').innerText = latency.toFixed(0);
-        });
+        }, 'download');
         pingRunner.start();
 
         engine.start(
@@ -569,8 +667,8 @@ export function runDownload() {
                 el('down-val').textContent = formatSpeed(speed); 
                 updateChart('down', speed);
             },
-            (finalSpeed) => {
-                const avgLoadedPing = pingRunner.stop(); 
+            async (finalSpeed) => {
+                const avgLoadedPing = await pingRunner.stop(); 
                 setLastResultDown(finalSpeed);
                 resolve({ speed: finalSpeed, ping: avgLoadedPing });
             }
@@ -584,11 +682,11 @@ export function runUpload() {
         if (THREADS > 1) {
             maxT = isMobileDevice() ? Math.min(maxT, 8) : Math.min(maxT, 16);
         }
-        const engine = new SpeedTestEngine('upload', maxT);
+        const engine = (TRANSPORT === 'ws') ? new WsThroughputEngine('upload') : new SpeedTestEngine('upload', maxT);
 
         const pingRunner = new LoadedPingRunner((latency) => {
             el('ping-ul-val').innerText = latency.toFixed(0);
-        });
+        }, 'upload');
         pingRunner.start();
 
         engine.start(
@@ -603,8 +701,8 @@ export function runUpload() {
                 el('up-val').textContent = formatSpeed(speed);
                 updateChart('up', speed);
             },
-            (finalSpeed) => {
-                const avgLoadedPing = pingRunner.stop();
+            async (finalSpeed) => {
+                const avgLoadedPing = await pingRunner.stop();
                 setLastResultUp(finalSpeed);
                 resolve({ speed: finalSpeed, ping: avgLoadedPing });
             }
@@ -1,15 +1,15 @@
 import os
 import secrets
-import httpx
+import logging
 import jwt # PyJWT
-from jwt import PyJWKClient
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi import APIRouter, HTTPException, status, Request, Response
 from fastapi.responses import JSONResponse, RedirectResponse
-from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from .database import get_db, Settings
+from .settings_cache import settings_cache
+from .oidc_cache import oidc_cache, get_http_client
 
 router = APIRouter()
+logger = logging.getLogger("Auth")
 
 APP_USER = os.getenv("APP_USER", "admin")
 APP_PASSWORD = os.getenv("APP_PASSWORD", "admin")
@@ -24,8 +24,8 @@ class LoginData(BaseModel):
 
 # --- Helpers ---
 
-def get_oidc_settings(db: Session):
-    settings = db.query(Settings).filter(Settings.id == 1).first()
+def get_oidc_settings():
+    settings = settings_cache.get()
     if not settings or not settings.oidc_enabled:
         return None
     return settings
@@ -33,12 +33,12 @@ def get_oidc_settings(db: Session):
 # --- Endpointy standardowe ---
 
 @router.get("/api/auth/status")
-async def auth_status(db: Session = Depends(get_db)):
+async def auth_status():
     """
     Publiczny endpoint informujący frontend o stanie autoryzacji.
     Zwraca: czy OIDC jest włączone ORAZ czy logowanie w ogóle jest włączone.
     """
-    s = db.query(Settings).filter(Settings.id == 1).first()
+    s = settings_cache.get()
     return {
         "oidc_enabled": s.oidc_enabled if s else False,
         "auth_enabled": AUTH_ENABLED
@@ -71,15 +71,15 @@ async def logout(request: Request, response: Response):
     request.session.clear()
     return response
 
-# --- OIDC Logic (Manual implementation using httpx & PyJWT) ---
+# --- OIDC Logic (Manual implementation using httpx & PyJWT, cache w oidc_cache) ---
 
 @router.get("/api/auth/oidc/login")
-async def oidc_login(request: Request, db: Session = Depends(get_db)):
+async def oidc_login(request: Request):
     """1. Przekierowanie do dostawcy tożsamości."""
     if not AUTH_ENABLED:
         return RedirectResponse("/")
 
-    settings = get_oidc_settings(db)
+    settings = get_oidc_settings()
     if not settings:
         raise HTTPException(status_code=400, detail="OIDC disabled or not configured")
 
@@ -88,13 +88,10 @@ async def oidc_login(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Discovery URL missing")
 
     try:
-        # Pobieramy konfigurację OIDC (.well-known)
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(discovery_url)
-            resp.raise_for_status()
-            config = resp.json()
+        # Konfiguracja OIDC (.well-known) - z cache, wspólny klient HTTP
+        config = await oidc_cache.discovery(discovery_url)
     except Exception as e:
-        print(f"Discovery Error: {e}")
+        logger.error(f"Discovery Error: {e}")
         return RedirectResponse("/login.html?error=oidc_discovery_failed")
 
     auth_endpoint = config.get("authorization_endpoint")
@@ -105,10 +102,10 @@ async def oidc_login(request: Request, db: Session = Depends(get_db)):
     state = secrets.token_urlsafe(16)
     nonce = secrets.token_urlsafe(16)
     
-    # Zapisujemy w sesji (cookie session middleware)
+    # Zapisujemy w sesji (cookie session middleware) - tylko stan i nonce,
+    # konfigurację callback weźmie z cache
     request.session["oidc_state"] = state
     request.session["oidc_nonce"] = nonce
-    request.session["oidc_config"] = config # Cache config for callback
 
     redirect_uri = str(request.url_for('oidc_callback'))
     
@@ -132,7 +129,7 @@ async def oidc_login(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/api/auth/oidc/callback")
-async def oidc_callback(request: Request, code: str = None, state: str = None, error: str = None, db: Session = Depends(get_db)):
+async def oidc_callback(request: Request, code: str = None, state: str = None, error: str = None):
     """2. Powrót z kodem, wymiana na token i weryfikacja."""
     if not AUTH_ENABLED:
         return RedirectResponse("/")
@@ -148,17 +145,15 @@ async def oidc_callback(request: Request, code: str = None, state: str = None, e
     if not saved_state or state != saved_state:
         return RedirectResponse("/login.html?error=oidc_invalid_state")
 
-    settings = get_oidc_settings(db)
+    settings = get_oidc_settings()
     if not settings:
         return RedirectResponse("/login.html?error=oidc_disabled")
 
-    # Odtwarzamy konfigurację z sesji lub pobieramy ponownie
-    config = request.session.get("oidc_config")
-    if not config:
-        # Fallback: fetch again (uproszczone, normalnie byśmy pobrali z URL z bazy)
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(settings.oidc_discovery_url)
-            config = resp.json()
+    try:
+        config = await oidc_cache.discovery(settings.oidc_discovery_url.strip())
+    except Exception as e:
+        logger.error(f"Discovery Error: {e}")
+        return RedirectResponse("/login.html?error=oidc_discovery_failed")
 
     token_endpoint = config.get("token_endpoint")
     jwks_uri = config.get("jwks_uri")
@@ -177,18 +172,16 @@ async def oidc_callback(request: Request, code: str = None, state: str = None, e
     }
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            token_resp = await client.post(token_endpoint, data=payload)
-            token_resp.raise_for_status()
-            token_data = token_resp.json()
+        token_resp = await get_http_client().post(token_endpoint, data=payload)
+        token_resp.raise_for_status()
+        token_data = token_resp.json()
             
         id_token = token_data.get("id_token")
         if not id_token:
              return RedirectResponse("/login.html?error=oidc_no_id_token")
 
-        # WERYFIKACJA TOKENU JWT (PyJWT + PyJWKClient)
-        jwks_client = PyJWKClient(jwks_uri)
-        signing_key = jwks_client.get_signing_key_from_jwt(id_token)
+        # WERYFIKACJA TOKENU JWT (PyJWT + klucze JWKS z cache)
+        signing_key = await oidc_cache.signing_key(jwks_uri, id_token)
 
         # Dekodujemy i weryfikujemy podpis
         data = jwt.decode(
@@ -219,5 +212,5 @@ async def oidc_callback(request: Request, code: str = None, state: str = None, e
         return response
 
     except Exception as e:
-        print(f"OIDC Verification Error: {e}")
+        logger.error(f"OIDC Verification Error: {e}")
         return RedirectResponse(f"/login.html?error=oidc_verification_failed")
\ No newline at end of file
@@ -1,102 +1,105 @@
 import os
-import io
+import shutil
+import asyncio
 import datetime
+import tempfile
 import logging
+from typing import List
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse, RedirectResponse, JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from .database import get_db, Settings, SpeedResult
+from .database import get_db, Settings
 
 # Biblioteki Google
 from google_auth_oauthlib.flow import Flow
-from .backup_service import perform_backup_logic, generate_sql_dump
+from .backup_service import start_backup, backup_enabled, prepare_remote_restore, sql_dump_stream
+from .settings_cache import settings_cache
+from .restore import start_restore
+from .jobs import read_status
+from .destinations import BACKUP_DESTINATION
 
 logger = logging.getLogger("BackupAPI")
 router = APIRouter()
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
+RESTORE_COPY_CHUNK = 1024 * 1024
+JOB_BUSY = {"error": "Another backup or restore is already running"}
 
 # --- LOKALNA KOPIA ZAPASOWA ---
 
 @router.get("/api/backup/download")
-async def download_backup(db: Session = Depends(get_db)):
+async def download_backup(compress: bool = False):
     """
-    Pobiera backup danych. 
-    W wersji MariaDB generujemy plik SQL z instrukcjami INSERT.
+    Pobiera backup danych jako plik SQL z instrukcjami INSERT (compress=true: .sql.gz).
+    Zrzut jest generowany strumieniowo - pamięć nie rośnie z liczbą wyników.
     """
-    try:
-        # Generujemy zawartość SQL w pamięci
-        sql_content = generate_sql_dump(db)
-        
-        # Tworzymy strumień pliku
-        stream = io.StringIO(sql_content)
-        
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
-        filename = f"localspeed_backup_{timestamp}.sql"
-        
-        # StreamingResponse oczekuje generatora lub iteratora bajtów/stringów
-        return StreamingResponse(
-            iter([sql_content]),
-            media_type='application/sql',
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Cache-Control": "no-store"
-            }
-        )
-    except Exception as e:
-        logger.error(f"Błąd generowania backupu: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
+    filename = f"localspeed_backup_{timestamp}.sql" + (".gz" if compress else "")
+
+    return StreamingResponse(
+        sql_dump_stream(compress),
+        media_type='application/gzip' if compress else 'application/sql',
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-store"
+        }
+    )
 
 @router.post("/api/backup/restore")
-async def restore_backup(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def restore_backup(file: List[UploadFile] = File(...)):
     """
-    Przywraca dane z pliku SQL.
-    UWAGA: To jest prosta implementacja parsująca plik linia po linii.
+    Przywraca dane z pliku SQL (.sql lub .sql.gz) w tle - zwraca id zadania,
+    postęp odczytuje GET /api/jobs/{id}. Kilka plików to łańcuch backupu
+    (pełna kopia + przyrostowe) - wczytujemy je w kolejności nazw (nazwy zawierają datę).
     """
+    # Kopie plików na dysk - formularz (i jego pliki tymczasowe) zamykany jest po odpowiedzi
+    files = []
     try:
-        content = await file.read()
-        sql_script = content.decode('utf-8')
-        
-        # Rozbijamy na instrukcje po średniku
-        statements = sql_script.split(';')
-        
-        try:
-            # Czyścimy obecne tabele przed importem
-            db.execute(text("DELETE FROM results"))
-            # Nie usuwamy settings całkowicie, żeby nie stracić konfiguracji DB, 
-            # ale w tym przypadku nadpiszemy je danymi z backupu jeśli tam są.
-            # Dla bezpieczeństwa:
-            db.execute(text("DELETE FROM settings"))
-            
-            count = 0
-            for stmt in statements:
-                stmt = stmt.strip()
-                if stmt:
-                    # Wykonujemy INSERTY
-                    db.execute(text(stmt))
-                    count += 1
-            
-            db.commit()
-            logger.info(f"Przywrócono bazę danych ({count} instrukcji).")
-            return {"status": "success", "message": f"Database restored ({count} instructions)"}
-            
-        except Exception as db_err:
-            db.rollback()
-            raise db_err
-            
+        for upload in sorted(file, key=lambda f: f.filename or ""):
+            fh = tempfile.TemporaryFile()
+            files.append(fh)
+            await asyncio.to_thread(copy_upload, upload.file, fh)
     except Exception as e:
-        logger.error(f"Błąd przywracania bazy: {e}")
+        for fh in files:
+            fh.close()
+        logger.error(f"Błąd odbioru pliku backupu: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    job_id = start_restore(lambda progress: files)
+    if job_id is None:
+        for fh in files:
+            fh.close()
+        return JSONResponse(status_code=409, content=JOB_BUSY)
+    logger.info(f"Rozpoczęto przywracanie bazy danych (zadanie {job_id}, plików: {len(files)}).")
+    return JSONResponse(status_code=202, content={"status": "running", "state": "running", "id": job_id})
+
+
+def copy_upload(src, dst):
+    shutil.copyfileobj(src, dst, RESTORE_COPY_CHUNK)
+    dst.seek(0)
+
+
+# --- ZADANIA W TLE ---
+
+@router.get("/api/jobs/{job_id}")
+@router.get("/api/backup/restore/{job_id}")  # dawny adres stanu przywracania
+async def job_status(job_id: str, response: Response):
+    """Stan zadania w tle (backup / przywracanie): etap, postęp, wynik lub błąd."""
+    status = read_status(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job"})
+    response.headers["Cache-Control"] = "no-store"
+    return status
+
+
 
 # --- GOOGLE DRIVE OAUTH FLOW ---
 
 @router.get("/api/backup/google/auth")
-async def google_auth_start(request: Request, db: Session = Depends(get_db)):
-    settings = db.query(Settings).filter(Settings.id == 1).first()
+async def google_auth_start(request: Request):
+    settings = settings_cache.get()
     
-    if not settings.gdrive_client_id or not settings.gdrive_client_secret:
+    if not settings or not settings.gdrive_client_id or not settings.gdrive_client_secret:
         return RedirectResponse("/settings.html?error=missing_gdrive_config")
 
     client_config = {
@@ -171,6 +174,7 @@ async def google_auth_callback(request: Request, code: str = None, error: str =
         settings.gdrive_status = "Połączono pomyślnie"
         settings.gdrive_enabled = True 
         db.commit()
+        settings_cache.invalidate()
         
         return RedirectResponse("/settings.html?gdrive_auth=success")
         
@@ -188,29 +192,61 @@ async def google_disconnect(db: Session = Depends(get_db)):
         settings.gdrive_enabled = False
         db.add(settings)
         db.commit()
-        db.refresh(settings)
+        settings_cache.invalidate()
     return {"status": "disconnected"}
 
 
 @router.post("/api/backup/google/test")
-async def test_google_backup(db: Session = Depends(get_db)):
+async def test_google_backup():
+    """Backup teraz (do BACKUP_DESTINATION) - w tle, postęp i wynik pod GET /api/jobs/{id}."""
+    settings = settings_cache.get()
+    if not settings or not backup_enabled(settings):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "GDrive disabled or token missing"})
+
+    job_id = start_backup()
+    if job_id is None:
+        return JSONResponse(status_code=409, content={"status": "error", "message": JOB_BUSY["error"]})
+    logger.info(f"Rozpoczęto backup na Google Drive (zadanie {job_id}).")
+    return JSONResponse(status_code=202, content={"status": "running", "state": "running", "id": job_id})
+
+
+@router.post("/api/backup/google/restore")
+@router.post("/api/backup/remote/restore")
+async def restore_google_backup(segment: str = None):
+    """
+    Przywraca łańcuch backupu (pełna kopia + przyrostowe) z miejsca docelowego
+    (BACKUP_DESTINATION: Google Drive, katalog lokalny, S3) w tle.
+    segment: id pliku segmentu z manifestu - przywracamy stan do tego segmentu
+    włącznie (domyślnie najnowszy łańcuch w całości).
+    """
     try:
-        result = perform_backup_logic(db)
-        if result['status'] == 'skipped':
-             return JSONResponse(status_code=400, content={"status": "error", "message": result['message']})
-        
-        return result
+        dest, fetch = await asyncio.to_thread(prepare_remote_restore, segment)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
-        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+        logger.error(f"Błąd odczytu manifestu backupu: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    try:
+        job_id = start_restore(fetch, phase="download")
+    except Exception:
+        dest.close()
+        raise
+    if job_id is None:
+        # fetch się nie wykona - połączenie z miejscem docelowym zamykamy tutaj
+        dest.close()
+        return JSONResponse(status_code=409, content=JOB_BUSY)
+    logger.info(f"Rozpoczęto przywracanie z Google Drive (zadanie {job_id}).")
+    return JSONResponse(status_code=202, content={"status": "running", "state": "running", "id": job_id})
 
 
 @router.get("/api/backup/status")
-async def get_backup_status(response: Response, db: Session = Depends(get_db)):
+async def get_backup_status(response: Response):
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
 
-    settings = db.query(Settings).filter(Settings.id == 1).first()
+    settings = settings_cache.get()
     if not settings: return {}
     
     has_token = settings.gdrive_token_json is not None and len(settings.gdrive_token_json) > 10
@@ -218,7 +254,7 @@ async def get_backup_status(response: Response, db: Session = Depends(get_db)):
     
     # --- OBLICZANIE DATY NASTĘPNEGO BACKUPU ---
     next_backup_str = None
-    if connected and settings.gdrive_backup_time:
+    if backup_enabled(settings) and settings.gdrive_backup_time:
         try:
             freq = settings.gdrive_backup_frequency or 1
             hour, minute = map(int, settings.gdrive_backup_time.split(':'))
@@ -260,5 +296,6 @@ async def get_backup_status(response: Response, db: Session = Depends(get_db)):
         "next_backup_freq": settings.gdrive_backup_frequency,
         # ZMIANA: Wysyłamy obliczoną pełną datę
         "next_backup_full_date": next_backup_str, 
-        "connected": connected
+        "connected": connected,
+        "destination": BACKUP_DESTINATION
     }
\ No newline at end of file
@@ -1,102 +1,299 @@
+import io
+import os
 import json
+import math
+import zlib
 import logging
 import datetime
+import tempfile
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google.auth.exceptions import RefreshError
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from .database import Settings, SpeedResult
-import io
+from .database import SessionLocal, Settings, SpeedResult, iter_in_batches
+from .settings_cache import settings_cache
+from .jobs import start_job
+from .destinations import (
+    BACKUP_DESTINATION, BACKUP_LOCAL_DIR, DriveDestination, LocalDestination, s3_destination,
+)
 
 logger = logging.getLogger("BackupService")
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
-def generate_sql_dump(db: Session) -> str:
+DUMP_BATCH = 500                # wyników w jednej instrukcji INSERT
+GZIP_LEVEL = 6
+
+MANIFEST_NAME = "localspeed_manifest.json"
+MANIFEST_VERSION = 1
+# Po ilu backupach przyrostowych robimy nową pełną kopię (rebase łańcucha)
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "7"))
+
+SETTINGS_DUMP_COLUMNS = (
+    "id", "lang", "theme", "unit", "primary_color",
+    "oidc_enabled", "oidc_discovery_url", "oidc_client_id", "oidc_client_secret",
+    "gdrive_enabled", "gdrive_client_id", "gdrive_client_secret", "gdrive_folder_name",
+    "gdrive_backup_frequency", "gdrive_backup_time", "gdrive_retention_days", "gdrive_token_json"
+)
+# Wszystkie kolumny wyników (nowe kolumny trafiają do zrzutu automatycznie)
+RESULT_DUMP_COLUMNS = tuple(SpeedResult.__table__.columns)
+
+
+def sql_literal(val) -> str:
+    if val is None: return "NULL"
+    if isinstance(val, bool): return "1" if val else "0"
+    if isinstance(val, int): return str(val)
+    if isinstance(val, float): return repr(val) if math.isfinite(val) else "NULL"
+    if isinstance(val, datetime.datetime):
+        # Format, w którym SQLAlchemy zapisuje DATETIME w SQLite (MySQL też go przyjmuje)
+        return f"'{val.isoformat(sep=' ', timespec='microseconds')}'"
+    safe_str = str(val).replace("'", "''")
+    return f"'{safe_str}'"
+
+
+def iter_sql_dump(after_id: int = 0, upto_id: int = None):
     """
-    Generuje prosty zrzut SQL (INSERTY) dla tabel settings i results.
+    Zrzut SQL strumieniowo, jako fragmenty tekstu: nagłówek, ustawienia i wyniki
+    w wielowierszowych INSERT-ach po DUMP_BATCH. Wyniki czytamy partiami po id
+    (database.iter_in_batches), więc pamięć nie zależy od wielkości historii.
+    after_id / upto_id ograniczają wyniki do id z (after_id, upto_id] - segment
+    przyrostowy. Ustawienia są w każdym segmencie (restore bierze ostatnie).
     """
-    lines = []
-    lines.append("-- LocalSpeed Pro SQL Dump")
-    lines.append(f"-- Created: {datetime.datetime.now()}")
-    lines.append("")
-    
-    # 1. Settings
-    settings = db.query(Settings).filter(Settings.id == 1).first()
-    if settings:
-        def fmt(val):
-            if val is None: return "NULL"
-            if isinstance(val, bool): return "1" if val else "0"
-            if isinstance(val, (int, float)): return str(val)
-            safe_str = str(val).replace("'", "''")
-            return f"'{safe_str}'"
-
-        cols = [
-            "id", "lang", "theme", "unit", "primary_color", 
-            "oidc_enabled", "oidc_discovery_url", "oidc_client_id", "oidc_client_secret",
-            "gdrive_enabled", "gdrive_client_id", "gdrive_client_secret", "gdrive_folder_name",
-            "gdrive_backup_frequency", "gdrive_backup_time", "gdrive_retention_days", "gdrive_token_json"
-        ]
-        
-        vals = []
-        for col in cols:
-            vals.append(fmt(getattr(settings, col)))
-            
-        cols_str = ", ".join(cols)
-        vals_str = ", ".join(vals)
-        
-        lines.append(f"INSERT INTO settings ({cols_str}) VALUES ({vals_str});")
-    
-    lines.append("")
-    
-    # 2. Results
-    results = db.query(SpeedResult).all()
-    for res in results:
-        # id, date, ping, download, upload, lang, theme, mode
-        date_safe = str(res.date).replace("'", "''")
-        lang_safe = str(res.lang).replace("'", "''")
-        theme_safe = str(res.theme).replace("'", "''")
-        mode_safe = str(res.mode or 'Multi').replace("'", "''")
-        
-        lines.append(
-            f"INSERT INTO results (id, date, ping, download, upload, lang, theme, mode) "
-            f"VALUES ({res.id}, '{date_safe}', {res.ping}, {res.download}, {res.upload}, '{lang_safe}', '{theme_safe}', '{mode_safe}');"
-        )
-        
-    return "\n".join(lines)
+    yield "-- LocalSpeed Pro SQL Dump\n"
+    yield f"-- Created: {datetime.datetime.now()}\n"
+    if after_id or upto_id is not None:
+        yield f"-- Segment: results.id > {after_id}" + (f" AND results.id <= {upto_id}" if upto_id is not None else "") + "\n"
+    yield "\n"
+
+    db = SessionLocal()
+    try:
+        settings = db.query(Settings).filter(Settings.id == 1).first()
+        if settings:
+            cols_str = ", ".join(SETTINGS_DUMP_COLUMNS)
+            vals_str = ", ".join(sql_literal(getattr(settings, col)) for col in SETTINGS_DUMP_COLUMNS)
+            yield f"INSERT INTO settings ({cols_str}) VALUES ({vals_str});\n"
+    finally:
+        db.close()
+    yield "\n"
+
+    filters = [SpeedResult.id > after_id]
+    if upto_id is not None:
+        filters.append(SpeedResult.id <= upto_id)
+    insert = f"INSERT INTO results ({', '.join(col.name for col in RESULT_DUMP_COLUMNS)}) VALUES\n"
+    batch = []
+    for row in iter_in_batches(RESULT_DUMP_COLUMNS, (SpeedResult.id,), filters, batch_size=DUMP_BATCH):
+        batch.append("(" + ", ".join(sql_literal(val) for val in row) + ")")
+        if len(batch) >= DUMP_BATCH:
+            yield insert + ",\n".join(batch) + ";\n"
+            batch = []
+    if batch:
+        yield insert + ",\n".join(batch) + ";\n"
+
+
+def gzip_stream(chunks, level: int = GZIP_LEVEL):
+    """Kompresja gzip w locie (strumień tekstu -> fragmenty bajtów pliku .gz)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def sql_dump_stream(compress: bool = False, after_id: int = 0, upto_id: int = None):
+    """Bajty zrzutu SQL (opcjonalnie .gz) - dla odpowiedzi HTTP i wysyłki na Google Drive."""
+    try:
+        if compress:
+            yield from gzip_stream(iter_sql_dump(after_id, upto_id))
+        else:
+            for chunk in iter_sql_dump(after_id, upto_id):
+                yield chunk.encode("utf-8")
+    except Exception as e:
+        # Po wysłaniu nagłówków odpowiedzi nie zmienimy już statusu - błąd tylko logujemy
+        logger.error(f"Błąd generowania zrzutu SQL: {e}")
+        raise
+
+
+def spool_sql_dump(compress: bool = True, after_id: int = 0, upto_id: int = None):
+    """Zrzut do pliku tymczasowego (przewinięty) - wysyłka częściami wymaga pliku z seek()."""
+    fh = tempfile.TemporaryFile()
+    try:
+        for data in sql_dump_stream(compress, after_id, upto_id):
+            fh.write(data)
+        fh.seek(0)
+    except Exception:
+        fh.close()
+        raise
+    return fh
+
+# --- MANIFEST (ŁAŃCUCH BACKUPÓW) ---
+#
+# W miejscu docelowym (destinations.py) obok plików backupu leży MANIFEST_NAME:
+#   {"version": 1, "chains": [[segment, ...], ...]}
+# Łańcuch to pełna kopia i kolejne segmenty przyrostowe (wyniki o id > upto_id
+# poprzedniego segmentu), ostatni łańcuch jest bieżący. Segment:
+#   type (full / incremental), file_id, name, after_id, upto_id,
+#   rows (wyników w segmencie), total (wyników o id <= upto_id w chwili backupu),
+#   size (bajty .sql.gz), created (UTC, ISO).
+# Wyniki tylko przybywają, więc segment przyrostowy to nowe id. Nową pełną kopię
+# (rebase) robimy co BACKUP_FULL_EVERY przyrostów, gdy przyrosty urosły ponad
+# pełną kopię, albo gdy wyniki o starszych id zniknęły lub się zmieniły (usunięcie,
+# restore) - wtedy licznik total się nie zgadza.
+
+def empty_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "chains": []}
+
+
+def load_manifest(dest, files) -> tuple:
+    """Zwraca (file_id manifestu lub None, manifest)."""
+    file_id = next((f['id'] for f in files if f['name'] == MANIFEST_NAME), None)
+    if file_id is None:
+        return None, empty_manifest()
+    try:
+        manifest = json.loads(dest.read(file_id))
+        if manifest.get("version") == MANIFEST_VERSION:
+            return file_id, manifest
+        logger.warning("Manifest backupu w nieznanej wersji - zaczynam nowy łańcuch.")
+    except ValueError as e:
+        logger.warning(f"Uszkodzony manifest backupu ({e}) - zaczynam nowy łańcuch.")
+    return file_id, empty_manifest()
+
+
+def save_manifest(dest, file_id, manifest: dict):
+    dest.write(MANIFEST_NAME, json.dumps(manifest, indent=1).encode("utf-8"), file_id)
+
+
+def plan_segment(db: Session, chain: list, existing_ids: set) -> tuple:
+    """
+    Decyduje o rodzaju backupu. Zwraca (typ, after_id, upto_id, powód pełnej kopii).
+    upto_id to bieżące maksymalne id - wyniki dopisane w trakcie trafią do następnego segmentu.
+    """
+    upto_id = db.query(func.max(SpeedResult.id)).scalar() or 0
+
+    def full(reason):
+        return "full", 0, upto_id, reason
+
+    if not chain:
+        return full("brak łańcucha")
+    if any(segment["file_id"] not in existing_ids for segment in chain):
+        return full("brak pliku segmentu w miejscu docelowym")
+    increments = chain[1:]
+    if len(increments) >= BACKUP_FULL_EVERY:
+        return full(f"{len(increments)} przyrostów")
+    if sum(segment["size"] for segment in increments) >= chain[0]["size"]:
+        return full("przyrosty większe niż pełna kopia")
+    last = chain[-1]
+    if upto_id < last["upto_id"] or db.query(func.count(SpeedResult.id)).filter(SpeedResult.id <= last["upto_id"]).scalar() != last["total"]:
+        return full("zmienione lub usunięte wyniki")
+    return "incremental", last["upto_id"], upto_id, None
+
+
+def parse_drive_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
 
-def cleanup_old_backups(service, folder_id, retention_days):
+def cleanup_old_backups(dest, files, manifest: dict, retention_days):
+    """
+    Retencja świadoma łańcuchów: bieżący łańcuch zostaje w całości (przyrosty bez
+    pełnej kopii są bezużyteczne), starszy łańcuch usuwamy dopiero, gdy jego
+    najnowszy segment jest starszy niż retencja. Pliki spoza manifestu (np. pełne
+    kopie sprzed wersji z łańcuchami) - jak dotąd, po dacie utworzenia.
+    Usunięte łańcuchy znikają z manifestu (zapis manifestu po stronie wołającego).
+    """
     if not retention_days or retention_days <= 0:
         return 0
 
-    deleted_count = 0
-    try:
-        cutoff_date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
-        cutoff_str = cutoff_date.isoformat()
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+    logger.info(f"Retencja: Sprawdzanie plików starszych niż {cutoff.isoformat()} (dni: {retention_days})")
 
-        logger.info(f"Retencja: Sprawdzanie plików starszych niż {cutoff_str} (dni: {retention_days})")
+    chains = manifest["chains"]
+    expired = [chain for chain in chains[:-1] if parse_drive_time(chain[-1]["created"]) < cutoff]
+    manifest["chains"] = [chain for chain in chains if not any(chain is old for old in expired)]
+    protected = {segment["file_id"] for chain in manifest["chains"] for segment in chain}
+    chained = {segment["file_id"] for chain in chains for segment in chain}
 
-        q = f"'{folder_id}' in parents and trashed = false and createdTime < '{cutoff_str}'"
-        results = service.files().list(q=q, spaces='drive', fields='files(id, name, createdTime)').execute()
-        files = results.get('files', [])
+    deleted_count = 0
+    for f in files:
+        if f['name'] == MANIFEST_NAME or f['id'] in protected:
+            continue
+        if f['id'] not in chained and parse_drive_time(f['createdTime']) >= cutoff:
+            continue
+        logger.info(f"Retencja: Usuwanie starego pliku: {f['name']} (ID: {f['id']}, Data: {f['createdTime']})")
+        try:
+            dest.delete(f['id'])
+            deleted_count += 1
+        except Exception as e_del:
+            logger.error(f"Nie udało się usunąć pliku {f['id']}: {e_del}")
 
-        for f in files:
-            logger.info(f"Retencja: Usuwanie starego pliku: {f['name']} (ID: {f['id']}, Data: {f['createdTime']})")
-            try:
-                service.files().delete(fileId=f['id']).execute()
-                deleted_count += 1
-            except Exception as e_del:
-                logger.error(f"Nie udało się usunąć pliku {f['id']}: {e_del}")
-            
-    except Exception as e:
-        logger.warning(f"Błąd procesu retencji (nie krytyczny): {e}")
-    
     if deleted_count > 0:
         logger.info(f"Retencja: Usunięto łącznie {deleted_count} starych plików.")
-    
+
     return deleted_count
 
+def chain_segments(manifest: dict, segment_id: str = None) -> list:
+    """
+    Segmenty do przywrócenia, od pełnej kopii: najnowszy łańcuch w całości albo
+    łańcuch zawierający segment `segment_id` - do tego segmentu włącznie.
+    """
+    if segment_id is None:
+        return manifest["chains"][-1] if manifest["chains"] else []
+    for chain in manifest["chains"]:
+        for i, segment in enumerate(chain):
+            if segment["file_id"] == segment_id:
+                return chain[:i + 1]
+    return []
+
+
+def prepare_remote_restore(segment_id: str = None):
+    """
+    Odczytuje manifest z miejsca docelowego backupu i zwraca (dest, fetch):
+    fetch(progress) dla restore.start_restore pobiera segmenty łańcucha do plików
+    tymczasowych i zamyka dest. Gdy zadanie nie wystartuje, dest zamyka wołający.
+    ValueError, gdy nie ma czego przywracać.
+    """
+    db = SessionLocal()
+    try:
+        settings = db.query(Settings).filter(Settings.id == 1).first()
+        if BACKUP_DESTINATION == "gdrive" and (not settings or not settings.gdrive_token_json):
+            raise ValueError("Google Drive not connected")
+        dest = open_destination(db, settings, create=False)
+    finally:
+        db.close()
+
+    try:
+        _, manifest = load_manifest(dest, dest.list_files())
+    except Exception:
+        dest.close()
+        raise
+    segments = chain_segments(manifest, segment_id)
+    if not segments:
+        dest.close()
+        raise ValueError("Backup segment not found" if segment_id else "No backup chain found")
+
+    def fetch(progress) -> list:
+        total = sum(segment["size"] for segment in segments)
+        done = 0
+        downloaded = []
+        try:
+            for segment in segments:
+                fh = tempfile.TemporaryFile()
+                downloaded.append(fh)
+                dest.download(segment["file_id"], fh, lambda received: progress.update(bytes_read=done + received, bytes_total=total))
+                done += fh.tell()
+                fh.seek(0)
+        except Exception:
+            for fh in downloaded:
+                fh.close()
+            raise
+        finally:
+            dest.close()
+        logger.info(f"Pobrano łańcuch backupu ({dest.label}, {len(segments)} plików, {done} B).")
+        return downloaded
+
+    return dest, fetch
+
+
 def translate_error(error_msg: str) -> str:
     """Tłumaczy techniczne komunikaty błędów Google na język polski."""
     if "invalid_grant" in error_msg or "Token has been expired" in error_msg:
@@ -109,82 +306,140 @@ def translate_error(error_msg: str) -> str:
         return "Przekroczono dzienny limit zapytań API"
     return error_msg
 
-def perform_backup_logic(db: Session):
+def get_drive_service(db: Session, settings):
+    """Klient Google Drive z tokena z ustawień (wygasły token odświeżamy i zapisujemy)."""
+    # 1. Wczytanie credentials
+    creds_data = json.loads(settings.gdrive_token_json)
+    creds = Credentials.from_authorized_user_info(creds_data, SCOPES)
+
+    # 2. Aktywne odświeżenie tokena jeśli jest wygasły
+    # To pozwala wyłapać błąd 'invalid_grant' ZANIM spróbujemy wysłać plik
+    try:
+        if creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+            # Zapisujemy odświeżony token do bazy, aby nie odświeżać go przy każdym zapytaniu
+            settings.gdrive_token_json = creds.to_json()
+            db.commit()
+            settings_cache.invalidate()
+            logger.info("Token Google Drive został pomyślnie odświeżony.")
+    except RefreshError as refresh_err:
+        logger.error(f"Błąd odświeżania tokena: {refresh_err}")
+        # Jeśli nie udało się odświeżyć (np. invalid_grant), rzucamy wyjątek, który obsłuży wołający
+        raise Exception(f"invalid_grant: {str(refresh_err)}")
+
+    # 3. Budowanie serwisu
+    return build('drive', 'v3', credentials=creds)
+
+
+def find_backup_folder(service, settings, create: bool = True):
+    folder_name = settings.gdrive_folder_name or "LocalSpeed_Backup"
+
+    # Sprawdzanie folderu
+    q = f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and trashed=false"
+    results = service.files().list(q=q, spaces='drive', fields='files(id, name)').execute()
+    items = results.get('files', [])
+
+    if items:
+        return items[0]['id']
+    if not create:
+        return None
+    file_metadata = { 'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder' }
+    file = service.files().create(body=file_metadata, fields='id').execute()
+    return file.get('id')
+
+
+def backup_enabled(settings) -> bool:
+    """Czy backup ma cel: Google Drive (połączone konto) albo katalog / S3 z konfiguracji."""
+    if BACKUP_DESTINATION == "gdrive":
+        return bool(settings.gdrive_enabled and settings.gdrive_token_json)
+    return True
+
+
+def open_destination(db: Session, settings, create: bool = True):
+    """Miejsce docelowe backupu wg BACKUP_DESTINATION."""
+    if BACKUP_DESTINATION == "local":
+        return LocalDestination(BACKUP_LOCAL_DIR)
+    if BACKUP_DESTINATION == "s3":
+        return s3_destination()
+    if BACKUP_DESTINATION != "gdrive":
+        raise ValueError(f"Unknown BACKUP_DESTINATION: {BACKUP_DESTINATION}")
+    service = get_drive_service(db, settings)
+    return DriveDestination(service, find_backup_folder(service, settings, create))
+
+
+def perform_backup_logic(db: Session, progress=None):
+    """Backup do miejsca docelowego (synchroniczny - w tle uruchamia go start_backup)."""
+    def report(**changes):
+        if progress is not None:
+            progress.update(**changes)
+
     settings = db.query(Settings).filter(Settings.id == 1).first()
     
     if not settings:
         return {"status": "error", "message": "Settings not found"}
 
-    if not settings.gdrive_token_json or not settings.gdrive_enabled:
+    if not backup_enabled(settings):
         return {"status": "skipped", "message": "GDrive disabled or token missing"}
 
+    dest = None
     try:
-        # 1. Wczytanie credentials
-        creds_data = json.loads(settings.gdrive_token_json)
-        creds = Credentials.from_authorized_user_info(creds_data, SCOPES)
-        
-        # 2. Aktywne odświeżenie tokena jeśli jest wygasły
-        # To pozwala wyłapać błąd 'invalid_grant' ZANIM spróbujemy wysłać plik
-        try:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                # Zapisujemy odświeżony token do bazy, aby nie odświeżać go przy każdym zapytaniu
-                settings.gdrive_token_json = creds.to_json()
-                db.commit()
-                logger.info("Token Google Drive został pomyślnie odświeżony.")
-        except RefreshError as refresh_err:
-            logger.error(f"Błąd odświeżania tokena: {refresh_err}")
-            # Jeśli nie udało się odświeżyć (np. invalid_grant), rzucamy wyjątek, który obsłuży główny blok except
-            raise Exception(f"invalid_grant: {str(refresh_err)}")
-
-        # 3. Budowanie serwisu
-        service = build('drive', 'v3', credentials=creds)
-        
-        folder_id = None
-        folder_name = settings.gdrive_folder_name or "LocalSpeed_Backup"
-        
-        # Sprawdzanie folderu
-        q = f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and trashed=false"
-        results = service.files().list(q=q, spaces='drive', fields='files(id, name)').execute()
-        items = results.get('files', [])
+        report(force=True, phase="prepare")
+        dest = open_destination(db, settings)
+
+        # Manifest łańcucha decyduje: pełna kopia czy tylko nowe wyniki
+        files = dest.list_files()
+        manifest_id, manifest = load_manifest(dest, files)
+        chain = manifest["chains"][-1] if manifest["chains"] else []
+        kind, after_id, upto_id, reason = plan_segment(db, chain, {f['id'] for f in files})
+        if reason:
+            logger.info(f"Backup: pełna kopia ({reason}).")
+        rows = db.query(func.count(SpeedResult.id)).filter(SpeedResult.id > after_id, SpeedResult.id <= upto_id).scalar()
+        total = db.query(func.count(SpeedResult.id)).filter(SpeedResult.id <= upto_id).scalar()
+        db.commit()  # koniec transakcji odczytu - zrzut i wysyłka trwają długo
+
+        # Z sekundami - w katalogu / S3 ta sama nazwa nadpisałaby poprzedni plik
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        file_name = f"localspeed_backup_{timestamp}" + ("_inc" if kind == "incremental" else "") + ".sql.gz"
         
-        if not items:
-            file_metadata = { 'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder' }
-            file = service.files().create(body=file_metadata, fields='id').execute()
-            folder_id = file.get('id')
+        # Zrzut SQL (gzip) strumieniowo do pliku tymczasowego, wysyłka częściami z ponawianiem
+        report(force=True, phase="dump", type=kind, rows=rows)
+        with spool_sql_dump(True, after_id, upto_id) as fh:
+            size = fh.seek(0, io.SEEK_END)
+            fh.seek(0)
+            
+            # Upload
+            report(force=True, phase="upload", destination=dest.label, bytes_sent=0, bytes_total=size)
+            uploaded_file = dest.upload(file_name, fh, size, lambda sent: report(bytes_sent=sent))
+            report(bytes_sent=size)
+
+        segment = {
+            "type": kind, "file_id": uploaded_file.get('id'), "name": file_name,
+            "after_id": after_id, "upto_id": upto_id, "rows": rows, "total": total,
+            "size": size, "created": uploaded_file.get('createdTime'),
+        }
+        if kind == "full":
+            manifest["chains"].append([segment])
         else:
-            folder_id = items[0]['id']
+            manifest["chains"][-1].append(segment)
 
-        # Generowanie SQL
-        sql_content = generate_sql_dump(db)
-        
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
-        file_name = f"localspeed_backup_{timestamp}.sql"
-        
-        fh = io.BytesIO(sql_content.encode('utf-8'))
-        media = MediaIoBaseUpload(fh, mimetype='application/sql', resumable=True)
-        
-        file_metadata = { 'name': file_name, 'parents': [folder_id] }
-        
-        # Upload
-        uploaded_file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id'
-        ).execute()
-
-        # Retencja
+        # Retencja (po łańcuchach), potem zapis manifestu
+        report(force=True, phase="retention")
         retention_days = settings.gdrive_retention_days
         if retention_days and retention_days > 0:
-            cleanup_old_backups(service, folder_id, retention_days)
+            try:
+                cleanup_old_backups(dest, files, manifest, retention_days)
+            except Exception as e:
+                logger.warning(f"Błąd procesu retencji (nie krytyczny): {e}")
+        save_manifest(dest, manifest_id, manifest)
 
         now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         settings.gdrive_last_backup = now_str
         settings.gdrive_status = "Sukces" # Prosty status sukcesu
         db.commit()
+        settings_cache.invalidate()
         
-        logger.info(f"Backup auto-run success: {file_name}")
-        return {"status": "success", "file_id": uploaded_file.get('id'), "timestamp": now_str}
+        logger.info(f"Backup auto-run success: {file_name} ({dest.label}, {kind}, wyników: {rows}, {size} B)")
+        return {"status": "success", "file_id": uploaded_file.get('id'), "timestamp": now_str, "type": kind, "rows": rows}
 
     except Exception as e:
         error_msg = str(e)
@@ -203,4 +458,21 @@ def perform_backup_logic(db: Session):
             settings.gdrive_status = f"Błąd: {translated_msg[:100]}"
             
         db.commit()
-        raise e
\ No newline at end of file
+        settings_cache.invalidate()
+        raise e
+    finally:
+        if dest is not None:
+            dest.close()
+
+
+def run_backup(progress) -> dict:
+    db = SessionLocal()
+    try:
+        return perform_backup_logic(db, progress)
+    finally:
+        db.close()
+
+
+def start_backup() -> str:
+    """Backup jako zadanie w tle. Zwraca id zadania lub None, gdy trwa inne zadanie."""
+    return start_job("backup", run_backup, phase="prepare")
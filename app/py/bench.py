@@ -0,0 +1,384 @@
+# Benchmark ścieżek zarządzania danymi (historia, eksport CSV, backup, restore).
+#
+#   python -m py.bench --sizes 10k,100k,1m --baseline bench_baseline.json
+#   python -m py.bench --sizes 10k --save-baseline bench_baseline.json
+#
+# Baza SQLite z wygenerowanymi wynikami (SpeedResult) powstaje w katalogu
+# tymczasowym (DB_SQLITE_PATH), a endpointy wywołujemy w procesie, bezpośrednio
+# przez aplikację ASGI (bez sieci i uvicorna). Odpowiedź jest tylko zliczana,
+# nie buforowana - szczyt pamięci (tracemalloc) dotyczy samego endpointu.
+# Rozmiary testujemy rosnąco na jednej bazie, dosiewając brakujące wiersze.
+#
+# Z --baseline porównujemy medianę czasu i szczyt pamięci z poprzednim
+# przebiegiem. Przekroczenie progu (--threshold) kończy program kodem 1.
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import datetime
+import platform
+import statistics
+import tracemalloc
+
+SIZE_SUFFIXES = {"k": 1000, "m": 1000000}
+SEED_BATCH = 10000
+SEED_START = datetime.datetime(2020, 1, 1)
+MULTIPART_BOUNDARY = "localspeed-bench-boundary"
+INGEST_ROWS = 1000
+INGEST_START = datetime.datetime(2035, 1, 1)  # poza zakresem seedowanych danych - łatwo posprzątać
+
+
+def parse_sizes(value: str):
+    sizes = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        factor = SIZE_SUFFIXES.get(item[-1], 1)
+        number = item[:-1] if item[-1] in SIZE_SUFFIXES else item
+        sizes.append((item, int(float(number) * factor)))
+    return sorted(sizes, key=lambda s: s[1])
+
+
+# --- WYWOŁANIE ASGI W PROCESIE ---
+
+async def call_asgi(app, method: str, path: str, body: bytes = b"", headers=None, collect: bool = False) -> dict:
+    """
+    Minimalny klient ASGI: zwraca status i liczbę bajtów odpowiedzi.
+    Treść odpowiedzi zachowujemy tylko z collect=True (np. zrzut SQL do testu restore).
+    """
+    path, _, query = path.partition("?")
+    raw_headers = [(b"host", b"bench")]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), value.encode()))
+    if body:
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "headers": raw_headers,
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    done = asyncio.Event()
+    sent_body = False
+    result = {"status": 0, "bytes": 0}
+    chunks = []
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            result["bytes"] += len(chunk)
+            if collect:
+                chunks.append(chunk.encode() if isinstance(chunk, str) else bytes(chunk))
+            if not message.get("more_body", False):
+                done.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    if collect:
+        result["body"] = b"".join(chunks)
+    return result
+
+
+def multipart_file(field: str, filename: str, content: bytes):
+    head = (
+        f"--{MULTIPART_BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    body = head + content + f"\r\n--{MULTIPART_BOUNDARY}--\r\n".encode()
+    return body, {"content-type": f"multipart/form-data; boundary={MULTIPART_BOUNDARY}"}
+
+
+# --- DANE ---
+
+def seed_results(engine, target: int, seed: int = 42) -> int:
+    """Dosiewa tabelę results do `target` wierszy (deterministycznie). Zwraca liczbę dodanych."""
+    from sqlalchemy import text
+    from .migrations import backfill_created_at
+    from . import rollups
+
+    with engine.connect() as conn:
+        current = conn.execute(text("SELECT COUNT(*) FROM results")).scalar()
+        if current >= target:
+            return 0
+        rng = random.Random(seed + current)
+        insert = text(
+            "INSERT INTO results (date, ping, download, upload, jitter, ping_download, ping_upload, lang, theme, mode) "
+            "VALUES (:date, :ping, :download, :upload, :jitter, :ping_download, :ping_upload, :lang, :theme, :mode)"
+        )
+        for start in range(current, target, SEED_BATCH):
+            rows = []
+            for i in range(start, min(start + SEED_BATCH, target)):
+                # Jeden pomiar co ~5 minut, jak przy częstych testach z harmonogramu
+                date = SEED_START + datetime.timedelta(seconds=i * 300 + rng.randrange(60))
+                rows.append({
+                    "date": date.strftime("%Y-%m-%d %H:%M:%S"),
+                    "ping": round(rng.uniform(0.2, 40), 3),
+                    "download": round(rng.uniform(10, 2500), 3),
+                    "upload": round(rng.uniform(5, 1000), 3),
+                    "jitter": round(rng.uniform(0, 5), 3),
+                    "ping_download": round(rng.uniform(1, 80), 3),
+                    "ping_upload": round(rng.uniform(1, 80), 3),
+                    "lang": rng.choice(("pl", "en")),
+                    "theme": rng.choice(("dark", "light")),
+                    "mode": rng.choice(("Multi", "Single", "WS")),
+                })
+            conn.execute(insert, rows)
+        backfill_created_at(conn)
+        rollups.rebuild(conn)
+        conn.commit()
+    from .database import results_version
+    results_version.bump()
+    return target - current
+
+
+def ingest_body(batch: int) -> bytes:
+    """Partia INGEST_ROWS wyników dla POST /api/history/batch (każda partia w innym miejscu osi czasu)."""
+    rng = random.Random(batch)
+    start = INGEST_START + datetime.timedelta(days=batch)
+    return json.dumps([{
+        "created_at": (start + datetime.timedelta(seconds=i * 60)).isoformat(),
+        "ping": round(rng.uniform(0.2, 40), 3),
+        "download": round(rng.uniform(10, 2500), 3),
+        "upload": round(rng.uniform(5, 1000), 3),
+        "jitter": round(rng.uniform(0, 5), 3),
+        "mode": rng.choice(("Multi", "Single", "WS")),
+    } for i in range(INGEST_ROWS)]).encode()
+
+
+def cleanup_ingest():
+    from sqlalchemy import text
+    from . import rollups
+    from .database import engine, results_version
+
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM results WHERE source_node = 'bench'"))
+        conn.execute(text("DELETE FROM ingest_batches WHERE source_node = 'bench'"))
+        rollups.rebuild(conn, INGEST_START, INGEST_START + datetime.timedelta(days=365))
+        conn.commit()
+    results_version.bump()
+
+
+# --- POMIARY ---
+
+class Benchmark:
+    def __init__(self, app, repeat: int, quiet: bool):
+        self.app = app
+        self.repeat = repeat
+        self.quiet = quiet
+
+    async def measure(self, name: str, make_request, repeat: int = None, follow=None) -> dict:
+        """
+        Kilka przebiegów na czas + jeden z tracemalloc na szczyt pamięci.
+        `follow(result)` czeka na zakończenie zadania w tle (np. restore) - wliczane do czasu.
+        """
+        times = []
+        status, size = 0, 0
+        for _ in range(repeat or self.repeat):
+            method, path, body, headers = make_request()
+            started = time.perf_counter()
+            result = await call_asgi(self.app, method, path, body, headers, collect=follow is not None)
+            if follow:
+                await follow(result)
+            times.append(time.perf_counter() - started)
+            status, size = result["status"], result["bytes"]
+
+        method, path, body, headers = make_request()
+        tracemalloc.start()
+        try:
+            result = await call_asgi(self.app, method, path, body, headers, collect=follow is not None)
+            if follow:
+                await follow(result)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        stats = {
+            "median": round(statistics.median(times), 6),
+            "min": round(min(times), 6),
+            "max": round(max(times), 6),
+            "runs": len(times),
+            "peak_kb": round(peak / 1024, 1),
+            "status": status,
+            "bytes": size,
+        }
+        if not self.quiet:
+            print(f"  {name:<22} {stats['median'] * 1000:10.1f} ms  (min {stats['min'] * 1000:.1f})  "
+                  f"peak {stats['peak_kb'] / 1024:8.1f} MB  HTTP {status}  {size / 1024:10.1f} KB", flush=True)
+        return stats
+
+    async def run_size(self, rows: int) -> dict:
+        from .database import results_version
+        get = lambda path: (lambda: ("GET", path, b"", None))
+
+        def cold(path):
+            def make_request():
+                results_version.bump()
+                return "GET", path, b"", None
+            return make_request
+
+        results = {}
+        results["history_page"] = await self.measure("history_page", get("/api/history?page=1&limit=10"))
+        deep_page = max(1, rows // 10 // 2)
+        results["history_deep_page"] = await self.measure("history_deep_page", get(f"/api/history?page={deep_page}&limit=10"))
+        # Ta sama strona przez kursor (after = "next" ze strony wcześniej)
+        previous = await call_asgi(self.app, "GET", f"/api/history?page={max(1, deep_page - 1)}&limit=10", collect=True)
+        cursor = json.loads(previous["body"])["next"] or ""
+        results["history_deep_cursor"] = await self.measure("history_deep_cursor", get(f"/api/history?limit=10&after={cursor}"))
+        results["history_sort_download"] = await self.measure("history_sort_download", get("/api/history?page=1&limit=10&sort_by=download"))
+        # Statystyki bez cache odpowiedzi (bump wersji przed każdym żądaniem)
+        results["history_stats_day"] = await self.measure("history_stats_day", cold("/api/history/stats?bucket=day&from=2020-06-01&to=2020-07-01"))
+        results["history_stats_hour"] = await self.measure("history_stats_hour", cold("/api/history/stats?bucket=hour&from=2020-01-01&to=2020-01-08"))
+        results["history_stats_year"] = await self.measure("history_stats_year", cold("/api/history/stats?bucket=day&from=2020-01-01&to=2021-01-01"))
+        # Seria do wykresu (LTTB do 500 punktów) - miesiąc i cała historia
+        results["history_series_month"] = await self.measure("history_series_month", cold("/api/history/series?metric=download&from=2020-06-01&to=2020-07-01"))
+        results["history_series_all"] = await self.measure("history_series_all", cold("/api/history/series?metric=download"))
+        results["export_csv"] = await self.measure("export_csv", get("/api/history/export"))
+        results["export_ndjson"] = await self.measure("export_ndjson", get("/api/history/export?format=ndjson"))
+        # Partia wyników jednym żądaniem (executemany + rollupy), potem sprzątanie
+        batches = iter(range(1000000))
+
+        def ingest():
+            batch = next(batches)
+            return "POST", "/api/history/batch", ingest_body(batch), {
+                "content-type": "application/json", "x-source-node": "bench", "idempotency-key": f"bench-{batch}",
+            }
+        results["ingest_batch"] = await self.measure("ingest_batch", ingest)
+        cleanup_ingest()
+        results["backup_dump"] = await self.measure("backup_dump", get("/api/backup/download"))
+        results["backup_dump_gzip"] = await self.measure("backup_dump_gzip", get("/api/backup/download?compress=true"))
+
+        # Restore odtwarza ten sam stan bazy, więc kolejne rozmiary mają poprawne dane
+        dump = (await call_asgi(self.app, "GET", "/api/backup/download", collect=True))["body"]
+        body, headers = multipart_file("file", "bench.sql", dump)
+        results["restore"] = await self.measure("restore", lambda: ("POST", "/api/backup/restore", body, headers),
+                                                repeat=1, follow=self.wait_restore)
+        return results
+
+    async def wait_restore(self, result: dict):
+        """Przywracanie działa w wątku - odpytujemy o stan jak przeglądarka."""
+        job_id = json.loads(result["body"])["id"]
+        while True:
+            await asyncio.sleep(0.05)
+            status = json.loads((await call_asgi(self.app, "GET", f"/api/jobs/{job_id}", collect=True))["body"])
+            if status["state"] != "running":
+                break
+        if status["state"] != "done":
+            raise RuntimeError(f"Restore failed: {status['error']}")
+
+
+# --- PORÓWNANIE Z BASELINE ---
+
+def compare(current: dict, baseline: dict, threshold: float, min_delta: float) -> list:
+    """Zwraca listę regresji (czas mediany lub szczyt pamięci powyżej progu)."""
+    regressions = []
+    for size, benches in current["results"].items():
+        base_benches = baseline.get("results", {}).get(size, {})
+        for name, stats in benches.items():
+            base = base_benches.get(name)
+            if not base:
+                continue
+            if stats["median"] - base["median"] > min_delta and stats["median"] > base["median"] * (1 + threshold):
+                regressions.append(f"{size}/{name}: time {base['median'] * 1000:.1f} ms -> {stats['median'] * 1000:.1f} ms")
+            if stats["peak_kb"] - base["peak_kb"] > 1024 and stats["peak_kb"] > base["peak_kb"] * (1 + threshold):
+                regressions.append(f"{size}/{name}: peak {base['peak_kb'] / 1024:.1f} MB -> {stats['peak_kb'] / 1024:.1f} MB")
+    return regressions
+
+
+async def run(args) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="localspeed_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "bench.db")
+    if not args.keep_db and os.path.exists(db_path):
+        os.remove(db_path)
+
+    # Konfiguracja musi być ustawiona przed importem aplikacji (database.py czyta ją przy imporcie)
+    os.environ["DB_TYPE"] = "sqlite"
+    os.environ["DB_SQLITE_PATH"] = db_path
+    os.environ["AUTH_ENABLED"] = "false"
+
+    from .main import app
+    from .database import engine
+    from .migrations import run_migrations
+    logging.getLogger().setLevel(logging.WARNING)
+    # startup_event nie jest wołany przy bezpośrednim wywołaniu ASGI
+    run_migrations()
+
+    bench = Benchmark(app, args.repeat, args.quiet)
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+
+    for label, rows in parse_sizes(args.sizes):
+        started = time.perf_counter()
+        added = seed_results(engine, rows)
+        if not args.quiet:
+            print(f"[{label}] {rows} rows (seeded {added} in {time.perf_counter() - started:.1f}s)", flush=True)
+        report["results"][label] = await bench.run_size(rows)
+
+    engine.dispose()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m py.bench", description="LocalSpeed PRO - benchmark historii, eksportu i backupu")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="Liczby wierszy, np. 10k,100k,1m")
+    parser.add_argument("--repeat", type=int, default=3, help="Liczba przebiegów na pomiar czasu")
+    parser.add_argument("--workdir", help="Katalog na bazę testową (domyślnie tymczasowy)")
+    parser.add_argument("--keep-db", action="store_true", help="Użyj istniejącej bazy z --workdir (bez ponownego seedowania)")
+    parser.add_argument("--output", help="Zapisz wynik (JSON) do pliku")
+    parser.add_argument("--baseline", help="Plik JSON z poprzednim wynikiem do porównania")
+    parser.add_argument("--save-baseline", help="Zapisz wynik jako nowy baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Dopuszczalny wzrost względny (0.25 = 25%%)")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="Ignoruj różnice czasu mniejsze niż N sekund")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print("REGRESJA (próg {:.0%}):".format(args.threshold))
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Brak regresji względem baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
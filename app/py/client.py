@@ -0,0 +1,765 @@
+# Klient wiersza poleceń LocalSpeed PRO (test bez przeglądarki).
+#
+#   python -m py.client http://192.168.1.10:8002 --user admin --password admin --save
+#
+# Odpowiednik silnika z app/js/speedtest.js: ping/jitter (WebSocket), Download
+# i Upload na N równoległych strumieniach z tą samą logiką rozpędzania
+# (warmup -> scaling -> sustain) oraz ping pod obciążeniem.
+# Klient używa wyłącznie biblioteki standardowej, aby działał na serwerach
+# i routerach bez dodatkowych pakietów. Żeby nie był wąskim gardłem:
+#   - odczyt przez asyncio.BufferedProtocol do jednego bufora na połączenie (bez alokacji),
+#   - upload z jednego współdzielonego bufora (wycinki memoryview),
+#   - połączenia keep-alive z puli, ponownie używane przez kolejne żądania.
+
+import os
+import ssl
+import sys
+import json
+import time
+import base64
+import struct
+import asyncio
+import argparse
+import urllib.request
+import urllib.error
+from urllib.parse import urlsplit
+
+# --- KONFIGURACJA (zgodna z silnikiem przeglądarki) ---
+TEST_DURATION = 12.0
+START_STREAMS = 2
+WARMUP_TIME = 0.8
+MONITOR_INTERVAL = 0.4
+UPDATE_INTERVAL = 0.05
+MIN_GROWTH = 0.02
+DROP_THRESHOLD = -0.30
+
+READ_BUFFER_SIZE = 1024 * 1024
+WRITE_CHUNK = 256 * 1024
+MIN_UPLOAD_SIZE = 512 * 1024
+MAX_UPLOAD_SIZE = 32 * 1024 * 1024
+
+
+class Target:
+    """Adres serwera, kontekst TLS i ciasteczko sesji."""
+
+    def __init__(self, url: str, insecure: bool = False):
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        self.secure = parts.scheme == "https"
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if self.secure else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.base_url = f"{parts.scheme}://{parts.netloc}{self.base_path}"
+        self.cookie = None
+        self.ssl_context = None
+        if self.secure:
+            self.ssl_context = ssl.create_default_context()
+            if insecure:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    @property
+    def host_header(self) -> str:
+        default = 443 if self.secure else 80
+        return self.host if self.port == default else f"{self.host}:{self.port}"
+
+    def path(self, path: str) -> str:
+        return f"{self.base_path}{path}"
+
+    def extra_headers(self) -> str:
+        return f"Cookie: {self.cookie}\r\n" if self.cookie else ""
+
+
+# --- HTTP (płaszczyzna sterowania: logowanie, sesje, zapis wyniku) ---
+
+def _json_request(target: Target, method: str, path: str, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(target.base_url + path, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if target.cookie:
+        req.add_header("Cookie", target.cookie)
+    with urllib.request.urlopen(req, timeout=10, context=target.ssl_context) as resp:
+        set_cookie = resp.headers.get("Set-Cookie")
+        body = resp.read()
+    return json.loads(body) if body else None, set_cookie
+
+
+async def json_request(target: Target, method: str, path: str, payload=None):
+    return await asyncio.to_thread(_json_request, target, method, path, payload)
+
+
+async def login(target: Target, user: str, password: str):
+    _, set_cookie = await json_request(target, "POST", "/api/login", {"username": user, "password": password})
+    if set_cookie:
+        target.cookie = set_cookie.split(";", 1)[0]
+
+
+# --- HTTP (płaszczyzna danych) ---
+
+class HttpProtocol(asyncio.BufferedProtocol):
+    """
+    Minimalny klient HTTP/1.1 (keep-alive) liczący bajty odpowiedzi bez ich kopiowania.
+    Obsługuje Content-Length, Transfer-Encoding: chunked i odpowiedzi do końca połączenia.
+    """
+    HEADERS, BODY, CHUNK_SIZE, CHUNK_END, TRAILER, UNTIL_EOF, IDLE = range(7)
+
+    def __init__(self):
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.transport = None
+        self.closed = False
+        self.keep_alive = True
+        self.status = 0
+        self._state = self.IDLE
+        self._head = bytearray()
+        self._line = bytearray()
+        self._remaining = 0
+        self._after_body = self.IDLE
+        self._on_body = None
+        self._response = None
+        self._paused = False
+        self._drain_waiter = None
+
+    # --- asyncio.BufferedProtocol ---
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=WRITE_CHUNK)
+
+    def get_buffer(self, sizehint):
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        self._feed(self.view[:nbytes])
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self._state == self.UNTIL_EOF:
+            self._finish()
+        elif self._response is not None and not self._response.done():
+            self._response.set_exception(ConnectionError("Connection lost"))
+        self._wake_drain()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake_drain()
+
+    def _wake_drain(self):
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    async def drain(self):
+        if self.closed:
+            raise ConnectionError("Connection lost")
+        if self._paused:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+            await self._drain_waiter
+
+    # --- Żądanie / odpowiedź ---
+
+    async def request(self, target: Target, method: str, path: str, body=None, on_body=None, on_sent=None) -> int:
+        self._response = asyncio.get_running_loop().create_future()
+        self._on_body = on_body
+        self._state = self.HEADERS
+        self._head.clear()
+
+        length = f"Content-Length: {len(body)}\r\n" if body is not None else ""
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {target.host_header}\r\n"
+            f"User-Agent: LocalSpeed-CLI\r\n"
+            f"Cache-Control: no-store\r\n"
+            f"{length}{target.extra_headers()}\r\n"
+        )
+        self.transport.write(head.encode())
+
+        if body is not None:
+            for offset in range(0, len(body), WRITE_CHUNK):
+                part = body[offset:offset + WRITE_CHUNK]
+                self.transport.write(part)
+                await self.drain()
+                if on_sent is not None:
+                    on_sent(len(part))
+
+        return await self._response
+
+    def close(self):
+        if self._response is not None and not self._response.done():
+            self._response.cancel()
+        if self.transport is not None:
+            self.transport.close()
+        self.closed = True
+
+    def _finish(self):
+        self._state = self.IDLE
+        if self._response is not None and not self._response.done():
+            self._response.set_result(self.status)
+
+    def _parse_head(self, head: bytes):
+        lines = head.decode("latin-1").split("\r\n")
+        self.status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        self.keep_alive = headers.get("connection", "").lower() != "close"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            self._state = self.CHUNK_SIZE
+        elif "content-length" in headers:
+            self._remaining = int(headers["content-length"])
+            self._after_body = self.IDLE
+            self._state = self.BODY if self._remaining else self.IDLE
+            if not self._remaining:
+                self._finish()
+        else:
+            self.keep_alive = False
+            self._state = self.UNTIL_EOF
+
+    def _read_line(self, data):
+        """Dokleja dane do bieżącej linii. Zwraca (linia lub None, reszta danych)."""
+        # Linie rozmiaru chunka są krótkie - szukamy tylko w początku danych
+        head = bytes(data[:64])
+        pos = head.find(b"\n")
+        if pos < 0:
+            self._line += head
+            return None, data[len(head):]
+        line = bytes(self._line) + head[:pos]
+        self._line.clear()
+        return line.rstrip(b"\r"), data[pos + 1:]
+
+    def _feed(self, data):
+        while len(data):
+            state = self._state
+            if state == self.BODY:
+                n = min(len(data), self._remaining)
+                self._remaining -= n
+                if self._on_body is not None:
+                    self._on_body(n)
+                data = data[n:]
+                if self._remaining == 0:
+                    if self._after_body == self.CHUNK_END:
+                        self._state = self.CHUNK_END
+                    else:
+                        self._finish()
+            elif state == self.UNTIL_EOF:
+                if self._on_body is not None:
+                    self._on_body(len(data))
+                return
+            elif state == self.HEADERS:
+                self._head += data
+                idx = self._head.find(b"\r\n\r\n")
+                if idx < 0:
+                    return
+                rest = bytes(self._head[idx + 4:])
+                self._parse_head(bytes(self._head[:idx]))
+                self._head.clear()
+                data = memoryview(rest)
+            elif state in (self.CHUNK_SIZE, self.CHUNK_END, self.TRAILER):
+                line, data = self._read_line(data)
+                if line is None:
+                    return
+                if state == self.CHUNK_SIZE:
+                    size = int(line.split(b";", 1)[0] or b"0", 16)
+                    if size == 0:
+                        self._state = self.TRAILER
+                    else:
+                        self._remaining = size
+                        self._after_body = self.CHUNK_END
+                        self._state = self.BODY
+                elif state == self.CHUNK_END:
+                    self._state = self.CHUNK_SIZE
+                elif not line:
+                    self._finish()
+            else:
+                # Dane poza odpowiedzią - ignorujemy
+                return
+
+
+class ConnectionPool:
+    """Pula połączeń keep-alive - strumień bierze połączenie, oddaje je po odpowiedzi."""
+
+    def __init__(self, target: Target):
+        self.target = target
+        self.idle = []
+
+    async def acquire(self) -> HttpProtocol:
+        while self.idle:
+            proto = self.idle.pop()
+            if not proto.closed:
+                return proto
+        loop = asyncio.get_running_loop()
+        _, proto = await loop.create_connection(
+            HttpProtocol, self.target.host, self.target.port,
+            ssl=self.target.ssl_context,
+            server_hostname=self.target.host if self.target.ssl_context else None,
+        )
+        return proto
+
+    def release(self, proto: HttpProtocol):
+        if proto.keep_alive and not proto.closed and proto._state == HttpProtocol.IDLE:
+            self.idle.append(proto)
+        else:
+            proto.close()
+
+    def close(self):
+        for proto in self.idle:
+            proto.close()
+        self.idle.clear()
+
+
+# --- WEBSOCKET (minimalny klient RFC 6455) ---
+
+OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+class WebSocketClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, target: Target, path: str) -> "WebSocketClient":
+        reader, writer = await asyncio.open_connection(
+            target.host, target.port, ssl=target.ssl_context,
+            server_hostname=target.host if target.ssl_context else None,
+        )
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f"GET {target.path(path)} HTTP/1.1\r\n"
+            f"Host: {target.host_header}\r\n"
+            f"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+            f"{target.extra_headers()}\r\n"
+        ).encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        status = head.split(b" ", 2)[1]
+        if status != b"101":
+            writer.close()
+            raise ConnectionError(f"WebSocket handshake failed ({status.decode()})")
+        return cls(reader, writer)
+
+    def send(self, opcode: int, payload: bytes):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | n)
+        elif n < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, n)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, n)
+        mask = os.urandom(4)
+        if n:
+            key = int.from_bytes((mask * (n // 4 + 1))[:n], "big")
+            payload = (int.from_bytes(payload, "big") ^ key).to_bytes(n, "big")
+        self.writer.write(header + mask + payload)
+
+    def send_text(self, text: str):
+        self.send(OP_TEXT, text.encode())
+
+    async def recv(self):
+        """Zwraca (opcode, payload). Ramki ping obsługuje samodzielnie."""
+        message, message_op = b"", None
+        while True:
+            b0, b1 = await self.reader.readexactly(2)
+            opcode, n = b0 & 0x0F, b1 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            mask = await self.reader.readexactly(4) if b1 & 0x80 else None
+            payload = await self.reader.readexactly(n) if n else b""
+            if mask:
+                key = int.from_bytes((mask * (n // 4 + 1))[:n], "big")
+                payload = (int.from_bytes(payload, "big") ^ key).to_bytes(n, "big")
+
+            if opcode == OP_PING:
+                self.send(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                return OP_CLOSE, payload
+            if opcode != 0:
+                message_op = opcode
+            message += payload
+            if b0 & 0x80:
+                return message_op, message
+
+    async def close(self):
+        try:
+            self.send(OP_CLOSE, struct.pack("!H", 1000))
+            await self.writer.drain()
+        except Exception:
+            pass
+        self.writer.close()
+
+
+class LatencyProbe:
+    """
+    Klient /api/ws/latency: odbija binarne sondy serwera,
+    a statystyki (min/mean/p50/p90/p99/jitter) pobiera od serwera.
+    """
+
+    def __init__(self, target: Target, phase: str, interval_ms: float, count: int = 0, warmup: int = 0):
+        self.target = target
+        self.phase = phase
+        self.query = f"/api/ws/latency?interval={interval_ms}&count={count}&warmup={warmup}&phase={phase}"
+        self.ws = None
+        self.task = None
+        self._stats = None
+        self._closed = None
+
+    async def start(self):
+        self.ws = await WebSocketClient.connect(self.target, self.query)
+        loop = asyncio.get_running_loop()
+        self._stats = loop.create_future()
+        self._closed = loop.create_future()
+        self.task = asyncio.ensure_future(self._loop())
+
+    async def _loop(self):
+        try:
+            while True:
+                opcode, data = await self.ws.recv()
+                if opcode == OP_BINARY:
+                    self.ws.send(OP_BINARY, data)
+                elif opcode == OP_TEXT:
+                    msg = json.loads(data)
+                    if msg.get("type") == "stats" and not self._stats.done():
+                        self._stats.set_result(msg["phases"].get(self.phase))
+                elif opcode == OP_CLOSE:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if not self._stats.done():
+                self._stats.set_result(None)
+
+    async def wait_stats(self, timeout: float):
+        """Czeka, aż serwer sam wyśle statystyki (tryb z parametrem count)."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._stats), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def stats(self, timeout: float = 2.0):
+        if not self._stats.done():
+            try:
+                self.ws.send_text(json.dumps({"cmd": "stats"}))
+            except Exception:
+                return None
+        return await self.wait_stats(timeout)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+
+
+# --- SILNIK PRZEPUSTOWOŚCI ---
+
+class Meter:
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+    def add(self, n: int):
+        self.bytes += n
+
+
+class ThroughputEngine:
+    """Port SpeedTestEngine z speedtest.js: rozpędzanie i redukcja liczby strumieni."""
+
+    def __init__(self, target: Target, kind: str, max_streams: int, session: str = None, upload_buffer=None, ramp: bool = True):
+        self.target = target
+        self.kind = kind
+        self.max_streams = max_streams
+        # ramp=False: od razu wszystkie strumienie (generator obciążenia)
+        self.start_streams = 1 if max_streams == 1 else (START_STREAMS if ramp else max_streams)
+        self.status = "sustain" if max_streams == 1 or not ramp else "warmup"
+        self.session = session
+        self.duration = TEST_DURATION
+        self.upload_view = upload_buffer
+        self.meter = Meter()
+        self.pool = ConnectionPool(target)
+        self.tasks = []
+        self.peak_streams = 0
+        self.prev_speed = 0.0
+        self.stable_count = 0
+        self.instant_speed = 0.0
+
+    def _url(self) -> str:
+        session = f"&session={self.session}" if self.session else ""
+        if self.kind == "download":
+            # Strumień ograniczony czasem - jedno żądanie na cały test
+            seconds = int(self.duration) + 2
+            return self.target.path(f"/api/download?duration={seconds}s{session}")
+        return self.target.path(f"/api/upload?cli=1{session}")
+
+    async def _download_stream(self):
+        path = self._url()
+        while True:
+            proto = await self.pool.acquire()
+            try:
+                await proto.request(self.target, "GET", path, on_body=self.meter.add)
+            except asyncio.CancelledError:
+                proto.close()
+                raise
+            except (ConnectionError, OSError):
+                proto.close()
+                await asyncio.sleep(0.05)
+                continue
+            self.pool.release(proto)
+
+    async def _upload_stream(self):
+        path = self._url()
+        size = MIN_UPLOAD_SIZE
+        while True:
+            proto = await self.pool.acquire()
+            started = time.perf_counter()
+            try:
+                await proto.request(self.target, "POST", path, body=self.upload_view[:size], on_sent=self.meter.add)
+            except asyncio.CancelledError:
+                proto.close()
+                raise
+            except (ConnectionError, OSError):
+                proto.close()
+                await asyncio.sleep(0.05)
+                continue
+            self.pool.release(proto)
+            # Jak w przeglądarce: szybkie żądanie -> podwajamy rozmiar bufora
+            if time.perf_counter() - started < 0.05:
+                size = min(size * 2, MAX_UPLOAD_SIZE)
+
+    def add_stream(self):
+        if len(self.tasks) >= self.max_streams:
+            return
+        worker = self._download_stream if self.kind == "download" else self._upload_stream
+        self.tasks.append(asyncio.ensure_future(worker()))
+        self.peak_streams = max(self.peak_streams, len(self.tasks))
+
+    def remove_last_stream(self):
+        if len(self.tasks) <= self.start_streams:
+            return
+        self.tasks.pop().cancel()
+
+    def evaluate(self):
+        if self.status != "scaling" or self.instant_speed <= 0:
+            return
+        if self.prev_speed == 0:
+            self.prev_speed = self.instant_speed
+            return
+        growth = (self.instant_speed - self.prev_speed) / self.prev_speed
+        is_crash = growth < DROP_THRESHOLD
+        force_scaling = not is_crash and len(self.tasks) < 4 and self.instant_speed > 5
+
+        if growth > MIN_GROWTH or force_scaling:
+            if len(self.tasks) < self.max_streams:
+                self.add_stream()
+                self.stable_count = 0
+            else:
+                self.status = "sustain"
+        elif is_crash:
+            if self.instant_speed > 50:
+                self.remove_last_stream()
+                self.status = "sustain"
+        else:
+            self.stable_count += 1
+            if self.stable_count >= 5:
+                self.status = "sustain"
+        self.prev_speed = self.instant_speed
+
+    async def run(self, duration: float, on_update=None) -> float:
+        self.duration = duration
+        start = time.perf_counter()
+        last_time, last_bytes = start, 0
+        next_monitor = start + MONITOR_INTERVAL
+        alpha = 0.1 if self.kind == "upload" else 0.15
+
+        for _ in range(self.start_streams):
+            self.add_stream()
+
+        try:
+            while True:
+                await asyncio.sleep(UPDATE_INTERVAL)
+                now = time.perf_counter()
+                elapsed = now - start
+                total = self.meter.bytes
+
+                dt = now - last_time
+                if dt > 0:
+                    inst = max(0, total - last_bytes) * 8 / dt / 1e6
+                    self.instant_speed = inst if self.instant_speed == 0 else inst * alpha + self.instant_speed * (1 - alpha)
+                last_time, last_bytes = now, total
+
+                if self.status == "warmup" and elapsed >= WARMUP_TIME:
+                    self.status = "scaling"
+                if self.status == "scaling" and now >= next_monitor:
+                    next_monitor = now + MONITOR_INTERVAL
+                    self.evaluate()
+
+                if on_update is not None:
+                    on_update(total * 8 / elapsed / 1e6, self.instant_speed, elapsed, len(self.tasks))
+                if elapsed >= duration:
+                    return total * 8 / elapsed / 1e6
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks.clear()
+            self.pool.close()
+
+
+# --- PRZEBIEG TESTU ---
+
+def _progress(label: str, quiet: bool):
+    last = [0.0]
+
+    def update(avg, inst, elapsed, streams):
+        if quiet or elapsed - last[0] < 0.5:
+            return
+        last[0] = elapsed
+        sys.stderr.write(f"\r  {label}: {avg:10.2f} Mbps (chwilowo {inst:10.2f})  strumienie: {streams:2d}  t={elapsed:5.1f}s")
+        sys.stderr.flush()
+    return update
+
+
+async def run_phase(target: Target, kind: str, streams: int, duration: float, session, upload_buffer, quiet: bool):
+    probe = LatencyProbe(target, kind, interval_ms=250)
+    try:
+        await probe.start()
+    except (ConnectionError, OSError):
+        probe = None
+
+    engine = ThroughputEngine(target, kind, streams, session, upload_buffer)
+    speed = await engine.run(duration, _progress(kind.capitalize(), quiet))
+    if not quiet:
+        sys.stderr.write("\n")
+
+    loaded = None
+    if probe is not None:
+        loaded = await probe.stats()
+        await probe.close()
+    return speed, loaded, engine.peak_streams
+
+
+async def run_test(args) -> dict:
+    target = Target(args.url, insecure=args.insecure)
+    status, _ = await json_request(target, "GET", "/api/auth/status")
+    if args.user:
+        await login(target, args.user, args.password or "")
+    elif status.get("auth_enabled"):
+        raise PermissionError("Serwer wymaga logowania - podaj --user i --password")
+
+    streams = 1 if args.single else args.streams
+    upload_buffer = memoryview(bytearray(os.urandom(1024 * 1024) * (MAX_UPLOAD_SIZE // (1024 * 1024))))
+
+    # 1. Ping i jitter (idle) - statystyki liczy serwer
+    idle = None
+    try:
+        probe = LatencyProbe(target, "idle", interval_ms=100, count=20, warmup=5)
+        await probe.start()
+        idle = await probe.wait_stats(timeout=10)
+        await probe.close()
+    except (ConnectionError, OSError) as e:
+        print(f"Ping: błąd WebSocket ({e})", file=sys.stderr)
+
+    # Sesja serwerowa - łączna prędkość zmierzona przez serwer (wszystkie workery)
+    session = None
+    try:
+        session = (await json_request(target, "POST", "/api/test"))[0]["id"]
+    except Exception:
+        pass
+
+    down, down_ping, down_streams = 0.0, None, 0
+    up, up_ping, up_streams = 0.0, None, 0
+    if not args.no_download:
+        down, down_ping, down_streams = await run_phase(target, "download", streams, args.duration, session, upload_buffer, args.quiet)
+    if not args.no_upload:
+        up, up_ping, up_streams = await run_phase(target, "upload", streams, args.duration, session, upload_buffer, args.quiet)
+
+    server = None
+    if session:
+        try:
+            server = (await json_request(target, "POST", f"/api/test/{session}/finish"))[0]
+        except Exception:
+            pass
+
+    result = {
+        "ping": idle["min"] if idle else 0.0,
+        "jitter": idle["jitter"] if idle else 0.0,
+        "download": down,
+        "upload": up,
+        "ping_down": down_ping["mean"] if down_ping else 0.0,
+        "ping_up": up_ping["mean"] if up_ping else 0.0,
+        "mode": "Single" if streams == 1 else "Multi",
+        "streams": {"download": down_streams, "upload": up_streams},
+        "latency": {"idle": idle, "download": down_ping, "upload": up_ping},
+        "server": server,
+    }
+
+    if args.save:
+        await json_request(target, "POST", "/api/history", {
+            "ping": result["ping"], "download": down, "upload": up,
+            "jitter": result["jitter"], "ping_down": result["ping_down"], "ping_up": result["ping_up"],
+            "lang": "en", "theme": "dark", "mode": result["mode"],
+        })
+        result["saved"] = True
+
+    return result
+
+
+def print_result(result: dict):
+    print(f"Ping:      {result['ping']:8.2f} ms   Jitter: {result['jitter']:.2f} ms")
+    print(f"Download:  {result['download']:8.2f} Mbps (strumienie: {result['streams']['download']}, ping pod obciążeniem: {result['ping_down']:.2f} ms)")
+    print(f"Upload:    {result['upload']:8.2f} Mbps (strumienie: {result['streams']['upload']}, ping pod obciążeniem: {result['ping_up']:.2f} ms)")
+    server = result.get("server")
+    if server:
+        print(f"Serwer:    DL {server['download']['mbps']:.2f} Mbps, UL {server['upload']['mbps']:.2f} Mbps")
+    if result.get("saved"):
+        print("Wynik zapisany w historii.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m py.client", description="LocalSpeed PRO - test z wiersza poleceń")
+    parser.add_argument("url", help="Adres serwera, np. http://192.168.1.10:8002")
+    parser.add_argument("--streams", type=int, default=16, help="Maksymalna liczba równoległych strumieni (domyślnie 16)")
+    parser.add_argument("--single", action="store_true", help="Tryb pojedynczego połączenia")
+    parser.add_argument("--duration", type=float, default=TEST_DURATION, help="Czas fazy Download/Upload w sekundach")
+    parser.add_argument("--user", help="Login (gdy AUTH_ENABLED=true)")
+    parser.add_argument("--password", help="Hasło")
+    parser.add_argument("--save", action="store_true", help="Zapisz wynik w historii (/api/history)")
+    parser.add_argument("--no-download", action="store_true")
+    parser.add_argument("--no-upload", action="store_true")
+    parser.add_argument("--insecure", action="store_true", help="Nie weryfikuj certyfikatu TLS")
+    parser.add_argument("--json", action="store_true", help="Wynik w formacie JSON")
+    parser.add_argument("--quiet", action="store_true", help="Bez postępu na stderr")
+    args = parser.parse_args(argv)
+
+    try:
+        result = asyncio.run(run_test(args))
+    except urllib.error.HTTPError as e:
+        print(f"Błąd HTTP {e.code}: {e.reason}", file=sys.stderr)
+        return 1
+    except PermissionError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    except (ConnectionError, OSError) as e:
+        print(f"Błąd połączenia: {e}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_result(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,17 +3,20 @@
 import os
 import time
 import logging
-from sqlalchemy import create_engine, Column, Integer, Float, String, Boolean, text
+from sqlalchemy import create_engine, Column, Integer, Float, String, Boolean, DateTime, Text, Index, UniqueConstraint, text, select, or_
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
+from .shared_state import VersionCounter
 
 logger = logging.getLogger("LocalSpeedDB")
 
 # --- KONFIGURACJA ŚCIEŻEK ---
 BASE_DIR = "/app"
 DB_SQLITE_NAME = "speedtest_final.db"
-DB_SQLITE_PATH = os.path.join(BASE_DIR, DB_SQLITE_NAME)
+# Ścieżkę pliku SQLite można nadpisać (np. osobna baza dla benchmarków)
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH", os.path.join(BASE_DIR, DB_SQLITE_NAME))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
 # --- KONFIGURACJA POŁĄCZENIA ---
@@ -53,22 +56,38 @@ except Exception as e:
 class SpeedResult(Base):
     __tablename__ = "results"
     id = Column(Integer, primary_key=True, index=True)
-    date = Column(String(50))
+    date = Column(String(50))                  # Tekst do wyświetlania (czas lokalny)
+    created_at = Column(DateTime)              # Ten sam czas jako DATETIME - sortowanie i zakresy
     
-    # Podstawowe wyniki
-    ping = Column(Float)      # Ping Idle (spoczynkowy)
-    download = Column(Float)
-    upload = Column(Float)
+    # Podstawowe wyniki (NOT NULL - paginacja kursorem nie obsługuje NULL w kolumnach sortowania)
+    ping = Column(Float, nullable=False, default=0.0, server_default="0")      # Ping Idle (spoczynkowy)
+    download = Column(Float, nullable=False, default=0.0, server_default="0")
+    upload = Column(Float, nullable=False, default=0.0, server_default="0")
     
     # Nowe metryki jakości
-    jitter = Column(Float, default=0.0)
+    jitter = Column(Float, nullable=False, default=0.0, server_default="0")
     ping_download = Column(Float, default=0.0) # Ping podczas pobierania
     ping_upload = Column(Float, default=0.0)   # Ping podczas wysyłania
     
     # Metadane
     lang = Column(String(10), default="en") 
     theme = Column(String(20), default="dark")
-    mode = Column(String(10), default="Multi") 
+    mode = Column(String(10), nullable=False, default="Multi", server_default="Multi")
+    source_node = Column(String(64))           # Instancja, z której przyszedł wynik (hub) - NULL = lokalny
+
+    # Indeksy (kolumna, id) pod sortowanie i paginację kursorem w /api/history
+    __table_args__ = (
+        Index("ix_results_created_at_id", "created_at", "id"),
+        Index("ix_results_ping_id", "ping", "id"),
+        Index("ix_results_download_id", "download", "id"),
+        Index("ix_results_upload_id", "upload", "id"),
+        Index("ix_results_jitter_id", "jitter", "id"),
+        Index("ix_results_mode_id", "mode", "id"),
+    )
+
+# Wersja danych tabeli results - zwiększana po każdym zapisie/usunięciu/przywróceniu,
+# unieważnia cache pochodne (np. licznik wierszy historii) we wszystkich workerach
+results_version = VersionCounter("results_version")
 
 class Settings(Base):
     __tablename__ = "settings"
@@ -96,6 +115,60 @@ class Settings(Base):
     gdrive_status = Column(String(255), default="")
     gdrive_token_json = Column(String(4000), default="")
 
+class ResultRollup(Base):
+    """Agregaty wyników w kubełkach czasu (godzina / dzień) dla każdego trybu - patrz rollups.py."""
+    __tablename__ = "results_rollup"
+    id = Column(Integer, primary_key=True)
+    bucket = Column(String(5), nullable=False)        # "hour" / "day"
+    bucket_start = Column(DateTime, nullable=False)
+    mode = Column(String(10), nullable=False)
+    count = Column(Integer, default=0)
+
+    download_min = Column(Float)
+    download_max = Column(Float)
+    download_sum = Column(Float)
+    upload_min = Column(Float)
+    upload_max = Column(Float)
+    upload_sum = Column(Float)
+    ping_min = Column(Float)
+    ping_max = Column(Float)
+    ping_sum = Column(Float)
+    jitter_min = Column(Float)
+    jitter_max = Column(Float)
+    jitter_sum = Column(Float)
+
+    # Histogramy logarytmiczne (histogram.LogHistogram) jako JSON - percentyle
+    sketches = Column(Text().with_variant(MEDIUMTEXT(), "mysql"))
+
+    __table_args__ = (
+        UniqueConstraint("bucket", "bucket_start", "mode", name="uq_results_rollup_bucket"),
+    )
+
+class IngestBatch(Base):
+    """Klucze idempotencji przyjętych partii POST /api/history/batch (ponowienie = ta sama odpowiedź)."""
+    __tablename__ = "ingest_batches"
+    key = Column(String(128), primary_key=True)
+    digest = Column(String(64))                # sha256 treści - ten sam klucz z inną treścią = konflikt
+    source_node = Column(String(64))
+    count = Column(Integer, default=0)
+    created_at = Column(DateTime, index=True)
+
+class HubPushState(Base):
+    """Kursor wysyłki wyników do huba (tryb edge) - patrz hub.py."""
+    __tablename__ = "hub_push_state"
+    hub_url = Column(String(255), primary_key=True)
+    last_id = Column(Integer, default=0)       # Ostatni wysłany (potwierdzony) results.id
+    pending_id = Column(Integer)               # Górna granica partii w drodze - ponowienie wysyła ten sam zakres
+    last_push = Column(String(50), default="")
+    status = Column(String(255), default="")
+
+class SchemaVersion(Base):
+    """Historia migracji schematu (patrz migrations.py)."""
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100))
+    applied_at = Column(String(50))
+
 # --- FUNKCJA OCZEKUJĄCA NA BAZĘ (WAIT-FOR-DB) ---
 def wait_for_db_connection(max_retries=15, wait_seconds=2):
     if DB_TYPE != "mysql":
@@ -134,6 +207,33 @@ else:
     logger.critical("APLIKACJA MOŻE NIE DZIAŁAĆ POPRAWNIE - BRAK POŁĄCZENIA Z BAZĄ")
 
 
+def iter_in_batches(columns, keys, filters=(), descending: bool = False, batch_size: int = 2000):
+    """
+    Czyta wiersze partiami po indeksie (keyset na `keys`: (id,) lub (kolumna, id)),
+    każda partia w osobnym, krótkim połączeniu. Otwarty kursor (yield_per) trzymałby
+    w SQLite blokadę odczytu przez cały eksport - przy wolnym kliencie HTTP zapis
+    wyniku czekałby na nią i kończył się błędem "database is locked".
+    """
+    order = [key.desc() if descending else key.asc() for key in keys]
+    last = None
+    while True:
+        query = select(*columns).where(*filters)
+        if last is not None:
+            first = keys[0]
+            if len(keys) == 1:
+                query = query.where(first < last[0] if descending else first > last[0])
+            elif descending:
+                query = query.where(first <= last[0], or_(first < last[0], keys[1] < last[1]))
+            else:
+                query = query.where(first >= last[0], or_(first > last[0], keys[1] > last[1]))
+        with engine.connect() as conn:
+            rows = conn.execute(query.order_by(*order).limit(batch_size)).all()
+        if not rows:
+            return
+        yield from rows
+        last = tuple(getattr(rows[-1], key.key) for key in keys)
+
+
 def get_db():
     db = SessionLocal()
     try:
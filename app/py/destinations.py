@@ -0,0 +1,418 @@
+# Moduł odpowiedzialny za miejsca docelowe backupu (Google Drive, katalog lokalny, S3).
+#
+# backup_service zna tylko interfejs Destination: lista plików, odczyt / zapis
+# małego pliku (manifest), wysyłka i pobranie dużego pliku (segment .sql.gz),
+# usuwanie. Plik identyfikuje `id` (id pliku na Drive, nazwa w katalogu, klucz
+# w S3), lista zwraca słowniki {id, name, createdTime} jak API Google Drive.
+#
+# Wysyłka dużych plików jest podzielona na części po BACKUP_PART_SIZE i każdą
+# część ponawiamy z wykładniczym opóźnieniem (BACKUP_RETRIES razy), więc zerwane
+# łącze w oknie backupu kosztuje powtórkę jednej części, a nie całego pliku:
+#   S3     - multipart upload, części wysyłane równolegle (BACKUP_UPLOAD_WORKERS);
+#            przy błędzie po wyczerpaniu prób przerywamy upload (AbortMultipartUpload),
+#   Drive  - wysyłka wznawialna; protokół przyjmuje fragmenty tylko po kolei, więc
+#            bez równoległości - po błędzie pytamy o potwierdzony offset i wysyłamy dalej,
+#   lokalny - kopia do pliku tymczasowego i os.replace.
+#
+# S3 podpisujemy sami (AWS Signature V4 przez httpx), adresy w stylu ścieżki
+# (endpoint/bucket/klucz) - działa z AWS, MinIO i innymi zgodnymi serwerami.
+#
+# Zmienne środowiskowe:
+#   BACKUP_DESTINATION     - gdrive (domyślnie), local albo s3,
+#   BACKUP_LOCAL_DIR       - katalog dla "local" (domyślnie /app/backups),
+#   S3_ENDPOINT, S3_BUCKET, S3_PREFIX, S3_REGION, S3_ACCESS_KEY, S3_SECRET_KEY,
+#   BACKUP_PART_SIZE_MB    - wielkość części (domyślnie 16, S3 wymaga min. 5),
+#   BACKUP_UPLOAD_WORKERS  - równoległych części S3 (domyślnie 4),
+#   BACKUP_RETRIES         - prób jednej części po błędzie (domyślnie 5).
+
+import io
+import os
+import hmac
+import time
+import random
+import hashlib
+import logging
+import datetime
+import threading
+import xml.etree.ElementTree as ET
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from .database import BASE_DIR
+
+logger = logging.getLogger("Destinations")
+
+BACKUP_DESTINATION = os.getenv("BACKUP_DESTINATION", "gdrive").lower()
+BACKUP_LOCAL_DIR = os.getenv("BACKUP_LOCAL_DIR", os.path.join(BASE_DIR, "backups"))
+S3_ENDPOINT = os.getenv("S3_ENDPOINT", "https://s3.amazonaws.com").rstrip("/")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "localspeed/")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.getenv("S3_SECRET_KEY", "")
+
+# Drive wymaga fragmentów wznawialnych w wielokrotnościach 256 KB, S3 części min. 5 MB
+BACKUP_PART_SIZE = max(5, int(os.getenv("BACKUP_PART_SIZE_MB", "16"))) * 1024 * 1024
+BACKUP_UPLOAD_WORKERS = max(1, int(os.getenv("BACKUP_UPLOAD_WORKERS", "4")))
+BACKUP_RETRIES = max(0, int(os.getenv("BACKUP_RETRIES", "5")))
+BACKOFF_BASE = 1.0            # s - opóźnienie pierwszej ponownej próby
+BACKOFF_MAX = 60.0
+COPY_CHUNK = 1024 * 1024
+S3_TIMEOUT = 120.0
+
+# Błędy, po których ponawiamy: sieć (httpx, gniazda) i ConnectionError dla HTTP 5xx / 429
+RETRYABLE = (httpx.TransportError, ConnectionError, TimeoutError)
+
+
+def utc_iso(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def backoff(attempt: int, what: str, error) -> None:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    logger.warning(f"{what}: {error} - ponowienie za {delay:.1f} s ({attempt + 1}/{BACKUP_RETRIES})")
+    time.sleep(delay)
+
+
+def with_retries(fn, what: str, retryable=RETRYABLE):
+    for attempt in range(BACKUP_RETRIES + 1):
+        try:
+            return fn()
+        except retryable as e:
+            if attempt == BACKUP_RETRIES:
+                raise
+            backoff(attempt, what, e)
+
+
+class Destination:
+    """
+    Miejsce docelowe backupu. on_progress(bajty) - postęp wysyłki / pobierania.
+    """
+    label = ""
+
+    def list_files(self) -> list:
+        raise NotImplementedError
+
+    def read(self, file_id: str) -> bytes:
+        raise NotImplementedError
+
+    def write(self, name: str, data: bytes, file_id: str = None) -> str:
+        """Zapis małego pliku (manifest) - nowego albo istniejącego `file_id`."""
+        raise NotImplementedError
+
+    def upload(self, name: str, fh, size: int, on_progress) -> dict:
+        """Wysyła plik binarny `fh` (przewinięty). Zwraca {id, createdTime}."""
+        raise NotImplementedError
+
+    def download(self, file_id: str, fh, on_progress):
+        raise NotImplementedError
+
+    def delete(self, file_id: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# --- KATALOG LOKALNY ---
+
+class LocalDestination(Destination):
+    label = "local"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, file_id: str) -> str:
+        # id to sama nazwa pliku - bez ścieżek spoza katalogu
+        if os.path.basename(file_id) != file_id or file_id in ("", ".", ".."):
+            raise ValueError(f"Invalid backup file id: {file_id}")
+        return os.path.join(self.directory, file_id)
+
+    def list_files(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            {"id": entry.name, "name": entry.name, "createdTime": utc_iso(entry.stat().st_mtime)}
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+
+    def read(self, file_id: str) -> bytes:
+        with open(self.path(file_id), "rb") as f:
+            return f.read()
+
+    def replace_with(self, name: str, write):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(name)
+        # Plik tymczasowy + os.replace - przerwany zapis nie zostawi połowy backupu
+        with open(path + ".tmp", "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return path
+
+    def write(self, name: str, data: bytes, file_id: str = None) -> str:
+        self.replace_with(name, lambda f: f.write(data))
+        return name
+
+    def upload(self, name: str, fh, size: int, on_progress) -> dict:
+        def copy(f):
+            sent = 0
+            for data in iter(lambda: fh.read(COPY_CHUNK), b""):
+                f.write(data)
+                sent += len(data)
+                on_progress(sent)
+        path = self.replace_with(name, copy)
+        return {"id": name, "createdTime": utc_iso(os.path.getmtime(path))}
+
+    def download(self, file_id: str, fh, on_progress):
+        with open(self.path(file_id), "rb") as f:
+            for data in iter(lambda: f.read(COPY_CHUNK), b""):
+                fh.write(data)
+                on_progress(fh.tell())
+
+    def delete(self, file_id: str):
+        os.remove(self.path(file_id))
+
+
+# --- S3 ---
+
+class S3Destination(Destination):
+    label = "s3"
+
+    def __init__(self, endpoint: str, bucket: str, prefix: str, region: str, access_key: str, secret_key: str):
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.prefix = prefix
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.host = httpx.URL(endpoint).netloc.decode("ascii")
+        self.client = httpx.Client(timeout=S3_TIMEOUT)
+
+    def sign(self, method: str, path: str, query: str, payload_hash: str) -> dict:
+        """Nagłówki AWS Signature V4 (podpisujemy host i x-amz-*)."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+        headers = {"host": self.host, "x-amz-content-sha256": payload_hash, "x-amz-date": amz_date}
+        signed = ";".join(sorted(headers))
+        canonical = "\n".join((
+            method, path, query,
+            "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed, payload_hash,
+        ))
+        to_sign = "\n".join(("AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()))
+        key = ("AWS4" + self.secret_key).encode()
+        for part in scope.split("/"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed}, Signature={signature}")
+        del headers["host"]
+        return headers
+
+    def request(self, method: str, key: str = "", params: dict = None, body: bytes = b"", stream: bool = False, headers: dict = None):
+        path = "/" + quote(f"{self.bucket}/{key}" if key else self.bucket, safe="/-_.~")
+        query = "&".join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted((params or {}).items()))
+        all_headers = self.sign(method, path, query, hashlib.sha256(body).hexdigest())
+        all_headers.update(headers or {})
+        request = self.client.build_request(method, self.endpoint + path + ("?" + query if query else ""),
+                                            content=body, headers=all_headers)
+        response = self.client.send(request, stream=stream)
+        if response.status_code >= 300:
+            text = response.read().decode("utf-8", "replace")[:300]
+            response.close()
+            message = f"S3 {method} {key or self.bucket}: HTTP {response.status_code} {text}"
+            if response.status_code >= 500 or response.status_code == 429:
+                raise ConnectionError(message)
+            raise RuntimeError(message)
+        return response
+
+    def call(self, method: str, key: str = "", **kwargs) -> httpx.Response:
+        return with_retries(lambda: self.request(method, key, **kwargs), f"S3 {method} {key}")
+
+    def list_files(self) -> list:
+        files, token = [], None
+        while True:
+            params = {"list-type": "2", "prefix": self.prefix}
+            if token:
+                params["continuation-token"] = token
+            root = ET.fromstring(self.call("GET", params=params).content)
+            token = None
+            for node in root:
+                tag = node.tag.rsplit("}", 1)[-1]
+                if tag == "Contents":
+                    item = {child.tag.rsplit("}", 1)[-1]: child.text for child in node}
+                    files.append({"id": item["Key"], "name": item["Key"][len(self.prefix):], "createdTime": item["LastModified"]})
+                elif tag == "NextContinuationToken":
+                    token = node.text
+            if not token:
+                return files
+
+    def read(self, file_id: str) -> bytes:
+        return self.call("GET", file_id).content
+
+    def write(self, name: str, data: bytes, file_id: str = None) -> str:
+        key = file_id or self.prefix + name
+        self.call("PUT", key, body=data)
+        return key
+
+    def upload(self, name: str, fh, size: int, on_progress) -> dict:
+        key = self.prefix + name
+        created = utc_iso(time.time())
+        if size <= BACKUP_PART_SIZE:
+            self.call("PUT", key, body=fh.read())
+            on_progress(size)
+            return {"id": key, "createdTime": created}
+
+        root = ET.fromstring(self.call("POST", key, params={"uploads": ""}).content)
+        upload_id = next(node.text for node in root if node.tag.endswith("UploadId"))
+        read_lock = threading.Lock()
+        progress_lock = threading.Lock()
+        sent = 0
+
+        def send_part(number: int) -> str:
+            nonlocal sent
+            # Część czytamy z pliku dopiero w wątku - w pamięci najwyżej BACKUP_UPLOAD_WORKERS części
+            with read_lock:
+                fh.seek((number - 1) * BACKUP_PART_SIZE)
+                data = fh.read(BACKUP_PART_SIZE)
+            response = self.call("PUT", key, params={"partNumber": number, "uploadId": upload_id}, body=data)
+            with progress_lock:
+                sent += len(data)
+                on_progress(sent)
+            return response.headers["etag"]
+
+        parts = -(-size // BACKUP_PART_SIZE)
+        try:
+            with ThreadPoolExecutor(max_workers=BACKUP_UPLOAD_WORKERS, thread_name_prefix="s3-part") as pool:
+                etags = list(pool.map(send_part, range(1, parts + 1)))
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, 1)
+            ) + "</CompleteMultipartUpload>"
+            response = self.call("POST", key, params={"uploadId": upload_id}, body=body.encode())
+            # Complete potrafi zwrócić 200 z błędem w treści
+            if b"<Error>" in response.content:
+                raise RuntimeError(f"S3 CompleteMultipartUpload {key}: {response.text[:300]}")
+        except Exception:
+            try:
+                self.request("DELETE", key, params={"uploadId": upload_id}).close()
+            except Exception as e:
+                logger.warning(f"Nie udało się przerwać uploadu S3 {key}: {e}")
+            raise
+        logger.info(f"S3: wysłano {key} ({parts} części, {size} B).")
+        return {"id": key, "createdTime": created}
+
+    def download(self, file_id: str, fh, on_progress):
+        start = fh.tell()
+
+        def fetch():
+            # Po zerwaniu połączenia pobieramy tylko brakującą resztę (Range)
+            fh.truncate()
+            offset = fh.tell() - start
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            response = self.request("GET", file_id, stream=True, headers=headers)
+            try:
+                for data in response.iter_bytes(COPY_CHUNK):
+                    fh.write(data)
+                    on_progress(fh.tell() - start)
+            finally:
+                response.close()
+
+        with_retries(fetch, f"S3 GET {file_id}", RETRYABLE + (httpx.StreamError,))
+
+    def delete(self, file_id: str):
+        self.call("DELETE", file_id)
+
+    def close(self):
+        self.client.close()
+
+
+# --- GOOGLE DRIVE ---
+
+def drive_retryable(error) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500 or error.resp.status == 429
+    return isinstance(error, (OSError, TimeoutError))
+
+
+class DriveDestination(Destination):
+    label = "gdrive"
+
+    def __init__(self, service, folder_id: str):
+        self.service = service
+        self.folder_id = folder_id
+
+    def list_files(self) -> list:
+        """Wszystkie pliki folderu backupu (id, name, createdTime) - z paginacją."""
+        if not self.folder_id:
+            return []
+        files, token = [], None
+        while True:
+            result = self.service.files().list(
+                q=f"'{self.folder_id}' in parents and trashed = false", spaces='drive',
+                fields='nextPageToken, files(id, name, createdTime)', pageSize=1000, pageToken=token,
+            ).execute(num_retries=BACKUP_RETRIES)
+            files.extend(result.get('files', []))
+            token = result.get('nextPageToken')
+            if not token:
+                return files
+
+    def read(self, file_id: str) -> bytes:
+        return self.service.files().get_media(fileId=file_id).execute(num_retries=BACKUP_RETRIES)
+
+    def write(self, name: str, data: bytes, file_id: str = None) -> str:
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/json')
+        if file_id:
+            self.service.files().update(fileId=file_id, media_body=media).execute(num_retries=BACKUP_RETRIES)
+            return file_id
+        created = self.service.files().create(
+            body={'name': name, 'parents': [self.folder_id]}, media_body=media, fields='id'
+        ).execute(num_retries=BACKUP_RETRIES)
+        return created.get('id')
+
+    def upload(self, name: str, fh, size: int, on_progress) -> dict:
+        media = MediaIoBaseUpload(fh, mimetype='application/gzip', chunksize=BACKUP_PART_SIZE, resumable=True)
+        request = self.service.files().create(
+            body={'name': name, 'parents': [self.folder_id]},
+            media_body=media,
+            fields='id, createdTime'
+        )
+        response = None
+        attempt = 0
+        while response is None:
+            try:
+                status, response = request.next_chunk()
+            except Exception as e:
+                # Po błędzie next_chunk najpierw pyta Drive o potwierdzony offset - wysyłka wznawia się
+                if not drive_retryable(e) or attempt == BACKUP_RETRIES:
+                    raise
+                backoff(attempt, f"Google Drive upload {name}", e)
+                attempt += 1
+                continue
+            attempt = 0
+            if status:
+                on_progress(status.resumable_progress)
+        on_progress(size)
+        return response
+
+    def download(self, file_id: str, fh, on_progress):
+        downloader = MediaIoBaseDownload(fh, self.service.files().get_media(fileId=file_id), chunksize=BACKUP_PART_SIZE)
+        finished = False
+        while not finished:
+            status, finished = downloader.next_chunk(num_retries=BACKUP_RETRIES)
+            on_progress(status.resumable_progress)
+
+    def delete(self, file_id: str):
+        self.service.files().delete(fileId=file_id).execute(num_retries=BACKUP_RETRIES)
+
+
+def s3_destination() -> S3Destination:
+    if not S3_BUCKET or not S3_ACCESS_KEY or not S3_SECRET_KEY:
+        raise ValueError("S3 backup destination needs S3_BUCKET, S3_ACCESS_KEY and S3_SECRET_KEY")
+    return S3Destination(S3_ENDPOINT, S3_BUCKET, S3_PREFIX, S3_REGION, S3_ACCESS_KEY, S3_SECRET_KEY)
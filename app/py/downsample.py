@@ -0,0 +1,50 @@
+# Moduł pomocniczy: redukcja serii czasowej do zadanej liczby punktów (LTTB).
+#
+# Largest-Triangle-Three-Buckets (S. Steinarsson, 2013): pierwszy i ostatni
+# punkt zostają, środek dzielimy na (threshold - 2) kubełków i z każdego
+# bierzemy punkt tworzący największy trójkąt z punktem wybranym w poprzednim
+# kubełku i średnią kubełka następnego. W przeciwieństwie do uśredniania
+# zachowuje szpilki i spadki - wykres "wygląda" jak oryginał.
+#
+# Średnie kubełków liczymy jednym np.add.reduceat, a pola trójkątów całego
+# kubełka jedną operacją wektorową - pętla w Pythonie ma tylko threshold kroków.
+
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Zwraca indeksy punktów (rosnąco) do pozostawienia z serii (x, y).
+    `x` musi być niemalejące. Przy threshold >= len(x) zwraca wszystkie indeksy.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Granice kubełków środka [edges[i], edges[i+1]) - każdy ma co najmniej jeden punkt
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # Średnie kubełków (bez ostatniego punktu), "następny" dla ostatniego kubełka to ostatni punkt
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], edges[:-1]) / sizes
+    mean_y = np.add.reduceat(y[:n - 1], edges[:-1]) / sizes
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        # Podwojone pole trójkąta (a, punkt, średnia następnego) - stała 1/2 nie zmienia argmax
+        area = np.abs((ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay))
+        a = lo + int(area.argmax())
+        picked[i + 1] = a
+    return picked
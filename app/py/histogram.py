@@ -0,0 +1,127 @@
+# Moduł pomocniczy: kompaktowy histogram logarytmiczny (w stylu HDR Histogram).
+#
+# Wartości całkowite (np. mikrosekundy) trafiają do kubełków o stałej
+# precyzji względnej: poniżej 2^(SUB_BITS+1) każda wartość ma własny kubełek,
+# powyżej - każdy "rząd wielkości" (potęga 2) dzielony jest na 2^SUB_BITS
+# części. Przy SUB_BITS=7 błąd względny percentyli nie przekracza ~0.8%.
+# Liczniki trzymamy rzadko (dict), więc histogram zajmuje kilkaset bajtów.
+
+import math
+
+SUB_BITS = 7
+SUB_COUNT = 1 << SUB_BITS
+LINEAR_LIMIT = SUB_COUNT << 1
+
+
+def bucket_index(value: int) -> int:
+    if value < LINEAR_LIMIT:
+        return value if value > 0 else 0
+    shift = value.bit_length() - (SUB_BITS + 1)
+    return LINEAR_LIMIT + (shift - 1) * SUB_COUNT + ((value >> shift) - SUB_COUNT)
+
+
+def bucket_bounds(index: int):
+    """Zwraca przedział [dolna, górna) wartości dla kubełka."""
+    if index < LINEAR_LIMIT:
+        return index, index + 1
+    shift = (index - LINEAR_LIMIT) // SUB_COUNT + 1
+    mantissa = (index - LINEAR_LIMIT) % SUB_COUNT + SUB_COUNT
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class LogHistogram:
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int, n: int = 1):
+        value = int(value)
+        if value < 0:
+            value = 0
+        idx = bucket_index(value)
+        self.counts[idx] = self.counts.get(idx, 0) + n
+        self.count += n
+        self.total += value * n
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram"):
+        for idx, n in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """Percentyl (0-100). Zwraca środek kubełka, obcięty do [min, max]."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100.0))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                low, high = bucket_bounds(idx)
+                value = (low + high - 1) / 2.0
+                return float(min(max(value, self.min), self.max))
+        return float(self.max)
+
+    def percentiles(self, ps) -> list:
+        """Kilka percentyli w jednym przejściu po kubełkach (ps rosnąco)."""
+        if not self.count:
+            return [0.0] * len(ps)
+        ranks = [max(1, math.ceil(self.count * p / 100.0)) for p in ps]
+        out = []
+        seen = 0
+        target = ranks[0]
+        counts = self.counts
+        for idx in sorted(counts):
+            seen += counts[idx]
+            if seen < target:
+                continue
+            low, high = bucket_bounds(idx)
+            value = float(min(max((low + high - 1) / 2.0, self.min), self.max))
+            while seen >= target:
+                out.append(value)
+                if len(out) == len(ranks):
+                    return out
+                target = ranks[len(out)]
+        out.extend([float(self.max)] * (len(ranks) - len(out)))
+        return out
+
+    # --- Serializacja (np. do kolumny tekstowej w bazie) ---
+
+    def to_dict(self) -> dict:
+        return {
+            "c": {str(k): v for k, v in self.counts.items()},
+            "n": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogHistogram":
+        h = cls()
+        if data:
+            counts = data.get("c", {})
+            h.counts = dict(zip(map(int, counts.keys()), counts.values()))
+            h.count = data.get("n", 0)
+            h.total = data.get("sum", 0)
+            h.min = data.get("min")
+            h.max = data.get("max")
+        return h
@@ -1,48 +1,121 @@
+import time
+import json
+import base64
 import datetime
 import logging
 import csv
 import io
+import itertools
+import math
+import asyncio
+import hashlib
 from typing import List
-from fastapi import APIRouter, Request, Depends, Body
+from collections import OrderedDict
+import numpy as np
+from fastapi import APIRouter, Request, Response, Depends, Body, Query
 from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, asc, text, inspect
-from .database import get_db, SpeedResult, engine
+from sqlalchemy import func, desc, asc, or_, select, cast, text, Integer
+from sqlalchemy.exc import IntegrityError
+from .database import DB_TYPE, get_db, SessionLocal, SpeedResult, ResultRollup, IngestBatch, results_version, iter_in_batches
+from . import rollups, downsample
 
 logger = logging.getLogger("LocalSpeedHistoryAPI")
 router = APIRouter()
 
-# --- MIGRACJA DLA TABELI WYNIKÓW ---
-def ensure_results_columns():
-    """Sprawdza i dodaje brakujące kolumny w tabeli results."""
+# Kolumny sortowania - każda ma indeks (kolumna, id), patrz database.SpeedResult
+SORT_COLUMNS = {
+    'date': SpeedResult.created_at,
+    'ping': SpeedResult.ping,
+    'download': SpeedResult.download,
+    'upload': SpeedResult.upload,
+    'mode': SpeedResult.mode,
+    'jitter': SpeedResult.jitter,
+}
+MAX_LIMIT = 1000
+COUNT_MAX_AGE = 60  # sekundy (zabezpieczenie na zapisy spoza tego hosta)
+
+_count_cache = None  # (wersja results, czas, liczba wierszy)
+
+
+def cached_total(db: Session) -> int:
+    """COUNT(*) z cache - przeliczany tylko po zmianie danych (results_version)."""
+    global _count_cache
+    version = results_version.value
+    entry = _count_cache
+    if entry and entry[0] == version and time.monotonic() - entry[1] < COUNT_MAX_AGE:
+        return entry[2]
+    total = db.query(func.count(SpeedResult.id)).scalar()
+    _count_cache = (version, time.monotonic(), total)
+    return total
+
+
+RELATIVE_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_time(value: str) -> datetime.datetime:
+    """
+    Granica zakresu czasu dla from/to. Akceptuje:
+    ISO 8601 ("2024-05-01", "2024-05-01T12:00:00+02:00"), epoch w sekundach
+    lub milisekundach ("1714557600") i czas względny od teraz ("24h", "7d", "30m", "2w", "now").
+    Zwraca czas lokalny bez strefy - tak jak zapisujemy created_at.
+    """
+    value = value.strip()
+    if value == "now":
+        return datetime.datetime.now()
+    unit = value[-1:].lower()
+    if unit in RELATIVE_UNITS and value[:-1].lstrip("-").isdigit():
+        return datetime.datetime.now() - datetime.timedelta(seconds=abs(int(value[:-1])) * RELATIVE_UNITS[unit])
     try:
-        inspector = inspect(engine)
-        if not inspector.has_table("results"): return
+        epoch = float(value)
+    except ValueError:
+        epoch = None
+    if epoch is not None:
+        if epoch > 1e11:
+            epoch /= 1000.0
+        return datetime.datetime.fromtimestamp(epoch)
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Nieprawidłowy czas: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
 
-        columns_info = inspector.get_columns("results")
-        existing_columns = [col['name'] for col in columns_info]
-        
-        # Helper do dodawania kolumn
-        def add_col(name, type_def):
-            if name not in existing_columns:
-                logger.info(f"Migracja: Dodawanie kolumny '{name}' do tabeli results...")
-                try:
-                    with engine.connect() as connection:
-                        connection.execute(text(f"ALTER TABLE results ADD COLUMN {name} {type_def}"))
-                        connection.commit()
-                except Exception as ex:
-                    logger.error(f"Błąd dodawania kolumny {name}: {ex}")
-
-        add_col("mode", "VARCHAR(10) DEFAULT 'Multi'")
-        add_col("jitter", "FLOAT DEFAULT 0.0")
-        add_col("ping_download", "FLOAT DEFAULT 0.0")
-        add_col("ping_upload", "FLOAT DEFAULT 0.0")
 
-    except Exception as e:
-        logger.error(f"Błąd migracji results: {e}")
+def time_range_filters(time_from: str = None, time_to: str = None) -> list:
+    """Warunki zakresu [from, to) na created_at (przedział w indeksie)."""
+    filters = []
+    if time_from:
+        filters.append(SpeedResult.created_at >= parse_time(time_from))
+    if time_to:
+        filters.append(SpeedResult.created_at < parse_time(time_to))
+    return filters
+
+
+def encode_cursor(sort_by: str, order: str, value, row_id: int) -> str:
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat(sep=" ")
+    raw = json.dumps([sort_by, order, value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str, sort_by: str, order: str):
+    """Zwraca (wartość, id) ostatniego wiersza poprzedniej strony."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        c_sort, c_order, value, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Nieprawidłowy kursor")
+    if c_sort != sort_by or c_order != order or not isinstance(row_id, int):
+        raise ValueError("Kursor nie pasuje do sortowania")
+    if sort_by == 'date':
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError("Nieprawidłowy kursor")
+    return value, row_id
 
-# Wywołujemy migrację przy imporcie modułu
-ensure_results_columns()
 
 @router.get("/api/history")
 def read_history(
@@ -50,61 +123,91 @@ def read_history(
     limit: int = 10, 
     sort_by: str = 'date', 
     order: str = 'desc',
+    after: str = None,
+    time_from: str = Query(None, alias="from"),
+    time_to: str = Query(None, alias="to"),
     db: Session = Depends(get_db)
 ):
-    """Pobiera historię pomiarów z paginacją i sortowaniem."""
-    offset = (page - 1) * limit
-    
-    sort_column = SpeedResult.date 
-    if sort_by == 'ping': sort_column = SpeedResult.ping
-    elif sort_by == 'download': sort_column = SpeedResult.download
-    elif sort_by == 'upload': sort_column = SpeedResult.upload
-    elif sort_by == 'mode': sort_column = SpeedResult.mode
-    elif sort_by == 'jitter': sort_column = SpeedResult.jitter
-    
-    sort_func = desc if order == 'desc' else asc
+    """
+    Pobiera historię pomiarów z paginacją i sortowaniem.
+    Z `after` (kursor `next` z poprzedniej odpowiedzi) strona zaczyna się od
+    wyszukania w indeksie zamiast OFFSET - koszt nie rośnie z numerem strony.
+    `from` / `to` zawężają wynik do okna czasu (np. from=24h), `total` liczy tylko to okno.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    if sort_by not in SORT_COLUMNS: sort_by = 'date'
+    order = 'desc' if order == 'desc' else 'asc'
+    sort_column = SORT_COLUMNS[sort_by]
 
     try:
-        total_count = db.query(func.count(SpeedResult.id)).scalar()
-        
-        results = db.query(SpeedResult)\
-            .order_by(sort_func(sort_column))\
-            .offset(offset)\
-            .limit(limit)\
-            .all()
-            
+        range_filters = time_range_filters(time_from, time_to)
+        query = db.query(SpeedResult).filter(*range_filters)
+        if after:
+            value, row_id = decode_cursor(after, sort_by, order)
+            # Forma z wiodącym zakresem na kolumnie - optymalizatory SQLite i MySQL
+            # używają jej jako przedziału indeksu (kolumna, id)
+            if order == 'desc':
+                query = query.filter(sort_column <= value, or_(sort_column < value, SpeedResult.id < row_id))
+            else:
+                query = query.filter(sort_column >= value, or_(sort_column > value, SpeedResult.id > row_id))
+
+        sort_func = desc if order == 'desc' else asc
+        query = query.order_by(sort_func(sort_column), sort_func(SpeedResult.id))
+        if not after:
+            query = query.offset((max(page, 1) - 1) * limit)
+
+        # Jeden wiersz więcej mówi, czy istnieje następna strona
+        results = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            last = results[-1]
+            next_cursor = encode_cursor(sort_by, order, getattr(last, sort_column.key), last.id)
+
+        if range_filters:
+            total = db.query(func.count(SpeedResult.id)).filter(*range_filters).scalar()
+        else:
+            total = cached_total(db)
+
         return {
-            "total": total_count,
+            "total": total,
             "page": page,
             "limit": limit,
+            "next": next_cursor,
             "data": results
         }
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         logger.error(f"Błąd odczytu historii: {e}")
-        return {"total": 0, "page": 1, "limit": limit, "data": []}
+        return {"total": 0, "page": 1, "limit": limit, "next": None, "data": []}
 
 @router.post("/api/history")
 async def save_result(request: Request, db: Session = Depends(get_db)):
     """Zapisuje nowy wynik testu do bazy danych."""
     try:
         data = await request.json()
-        now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        now = datetime.datetime.now().replace(microsecond=0)
+        now_str = now.strftime("%Y-%m-%d %H:%M:%S")
         
+        # null (np. NaN z JSON.stringify) -> 0 / "Multi", jak w ingest_row -
+        # kolumny sortowania nie mogą mieć NULL (paginacja kursorem)
         new_result = SpeedResult(
-            ping=data.get('ping', 0),
-            download=data.get('download', 0),
-            upload=data.get('upload', 0),
-            jitter=data.get('jitter', 0),           # NOWE
-            ping_download=data.get('ping_down', 0), # NOWE
-            ping_upload=data.get('ping_up', 0),     # NOWE
-            lang=data.get('lang', 'pl'),
-            theme=data.get('theme', 'dark'),
-            mode=data.get('mode', 'Multi'),
-            date=now_str
+            **result_metrics(data),
+            lang=str(data.get('lang') or 'pl')[:10],
+            theme=str(data.get('theme') or 'dark')[:20],
+            mode=str(data.get('mode') or 'Multi')[:10],
+            date=now_str,
+            created_at=now
         )
         db.add(new_result)
+        # Rollupy w tej samej transakcji co wynik
+        rollups.apply_result(db, new_result)
         db.commit()
+        results_version.bump()
         return {"status": "saved"}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         logger.error(f"Błąd zapisu historii: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -113,13 +216,406 @@ async def save_result(request: Request, db: Session = Depends(get_db)):
 async def delete_results(ids: List[int] = Body(...), db: Session = Depends(get_db)):
     try:
         if not ids: return {"status": "no_ids_provided"}
+        days = rollups.affected_days(db, ids)
         db.query(SpeedResult).filter(SpeedResult.id.in_(ids)).delete(synchronize_session=False)
+        rollups.rebuild_days(db, days)
         db.commit()
+        results_version.bump()
         return {"status": "deleted", "count": len(ids)}
     except Exception as e:
         logger.error(f"Błąd usuwania historii: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+INGEST_MAX_ROWS = 10000
+INGEST_METRICS = {
+    "ping": "ping", "download": "download", "upload": "upload", "jitter": "jitter",
+    "ping_download": "ping_download", "ping_upload": "ping_upload",
+    # Nazwy pól z POST /api/history
+    "ping_down": "ping_download", "ping_up": "ping_upload",
+}
+
+
+def parse_ingest_body(raw: bytes, content_type: str):
+    """Treść partii: tablica JSON, obiekt {"source_node", "results"} lub NDJSON. Zwraca (wyniki, źródło)."""
+    if "ndjson" in content_type:
+        return [json.loads(line) for line in raw.splitlines() if line.strip()], None
+    data = json.loads(raw)
+    if isinstance(data, dict):
+        return data.get("results"), data.get("source_node")
+    return data, None
+
+
+def result_metrics(item) -> dict:
+    """Metryki wyniku -> kolumny results (brak / null -> 0, ValueError przy błędnej liczbie)."""
+    if not isinstance(item, dict):
+        raise ValueError("wynik musi być obiektem")
+    row = {column: 0.0 for column in set(INGEST_METRICS.values())}
+    for key, column in INGEST_METRICS.items():
+        if item.get(key) is not None:
+            value = float(item[key])
+            if not math.isfinite(value):
+                raise ValueError(f"{key}: nieprawidłowa liczba")
+            row[column] = value
+    return row
+
+
+def ingest_row(item, source_node: str, now: datetime.datetime) -> dict:
+    """Jeden wynik z partii -> wiersz tabeli results (ValueError przy błędnych danych)."""
+    row = result_metrics(item)
+
+    created = item.get("created_at") or item.get("date")
+    created_at = (parse_time(str(created)) if created else now).replace(microsecond=0)
+    node = item.get("source_node") or source_node
+    row.update(
+        created_at=created_at,
+        date=created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        mode=str(item.get("mode") or "Multi")[:10],
+        lang=str(item.get("lang") or "en")[:10],
+        theme=str(item.get("theme") or "dark")[:20],
+        source_node=str(node)[:64] if node else None,
+    )
+    return row
+
+
+def store_batch(rows: list, key: str, digest: str, source_node: str) -> dict:
+    """
+    Zapis partii w jednej transakcji: klucz idempotencji, executemany INSERT
+    i rollupy zagregowane dla całej partii. Wołane w wątku (asyncio.to_thread).
+    """
+    db = SessionLocal()
+    try:
+        if key:
+            existing = db.get(IngestBatch, key)
+            if existing is not None:
+                return {"duplicate": True, "digest": existing.digest, "count": existing.count}
+        conn = db.connection()
+        if key:
+            # Klucz wstawiamy pierwszy - równoległa partia z tym samym kluczem
+            # zatrzyma się na kluczu głównym, zanim wstawi wyniki
+            conn.execute(IngestBatch.__table__.insert().values(
+                key=key, digest=digest, source_node=source_node, count=len(rows),
+                created_at=datetime.datetime.now().replace(microsecond=0),
+            ))
+        if rows:
+            conn.execute(SpeedResult.__table__.insert(), rows)
+            rollups.apply_batch(conn, rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if not key:
+            raise
+        existing = db.get(IngestBatch, key)
+        if existing is None:
+            raise
+        return {"duplicate": True, "digest": existing.digest, "count": existing.count}
+    finally:
+        db.close()
+    if rows:
+        results_version.bump()
+    return {"duplicate": False, "digest": digest, "count": len(rows)}
+
+
+@router.post("/api/history/batch")
+async def ingest_batch(request: Request):
+    """
+    Przyjmuje partię wyników (np. z innych instancji - tryb hub, patrz hub.py)
+    i zapisuje je w jednej transakcji. Źródło: nagłówek X-Source-Node, pole
+    "source_node" partii lub pojedynczego wyniku. Czas wyniku: created_at (ISO 8601
+    ze strefą lub epoch) albo date; bez nich - czas przyjęcia.
+    Nagłówek Idempotency-Key: ponowienie tej samej partii nie dubluje wyników.
+    """
+    key = (request.headers.get("idempotency-key") or "").strip() or None
+    if key and len(key) > 128:
+        return JSONResponse(status_code=400, content={"error": "Idempotency-Key: maksymalnie 128 znaków"})
+
+    raw = await request.body()
+    try:
+        items, body_node = parse_ingest_body(raw, request.headers.get("content-type", ""))
+        if not isinstance(items, list):
+            raise ValueError("oczekiwano tablicy wyników")
+        if len(items) > INGEST_MAX_ROWS:
+            return JSONResponse(status_code=413, content={"error": f"Maksymalnie {INGEST_MAX_ROWS} wyników w partii"})
+        source_node = request.headers.get("x-source-node") or body_node
+        now = datetime.datetime.now()
+        rows = []
+        for index, item in enumerate(items):
+            try:
+                rows.append(ingest_row(item, source_node, now))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"wynik {index}: {e}")
+    except ValueError as e:
+        # json.JSONDecodeError też jest ValueError
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    digest = hashlib.sha256(raw).hexdigest()
+    try:
+        # Zapis synchroniczny (executemany + rollupy) poza pętlą zdarzeń
+        stored = await asyncio.to_thread(store_batch, rows, key, digest, source_node)
+    except Exception as e:
+        logger.error(f"Błąd zapisu partii wyników: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    if stored["duplicate"]:
+        if stored["digest"] != digest:
+            return JSONResponse(status_code=409, content={"error": "Idempotency-Key użyty dla innej partii"})
+        return {"status": "duplicate", "count": stored["count"]}
+    return {"status": "saved", "count": stored["count"]}
+
+JSON_CACHE_SIZE = 32
+STATS_DEFAULT_FROM = {"hour": "7d"}  # Bez `from` kubełki godzinowe tylko z ostatniego tygodnia
+
+_json_cache = OrderedDict()  # (wersja results, parametry) -> (czas, JSON)
+
+
+def cached_json(params: tuple, compute) -> bytes:
+    """
+    Odpowiedź JSON (stats, series) z cache LRU ważnego do następnej zmiany danych
+    (results_version). Trzymamy gotowe bajty - bez jsonable_encoder przy każdym żądaniu,
+    więc `compute` musi zwracać same typy proste.
+    """
+    key = (results_version.value, *params)
+    entry = _json_cache.get(key)
+    if entry and time.monotonic() - entry[0] < COUNT_MAX_AGE:
+        _json_cache.move_to_end(key)
+        return entry[1]
+    body = json.dumps(compute(), separators=(",", ":")).encode()
+    _json_cache[key] = (time.monotonic(), body)
+    while len(_json_cache) > JSON_CACHE_SIZE:
+        _json_cache.popitem(last=False)
+    return body
+
+
+def stats_bounds(bucket: str, time_from: str, time_to: str):
+    """Granice okna wyrównane do kubełków - stabilny klucz cache także dla from=24h / to=now."""
+    start = end = None
+    if time_from:
+        start = rollups.bucket_start(parse_time(time_from), bucket)
+    if time_to:
+        end = parse_time(time_to)
+        if end != rollups.bucket_start(end, bucket):
+            end = rollups.bucket_start(end, bucket) + datetime.timedelta(hours=1 if bucket == "hour" else 24)
+    return start, end
+
+
+def compute_stats(db: Session, bucket: str, start, end, mode: str) -> dict:
+    query = db.query(ResultRollup).filter(ResultRollup.bucket == bucket)
+    if start is not None:
+        query = query.filter(ResultRollup.bucket_start >= start)
+    if end is not None:
+        query = query.filter(ResultRollup.bucket_start < end)
+    if mode:
+        query = query.filter(ResultRollup.mode == mode)
+
+    entries = [(row, rollups.load_sketches(row.sketches)) for row in query.order_by(ResultRollup.bucket_start).all()]
+    series, parts = [], []
+    for bucket_begin, group in itertools.groupby(entries, key=lambda entry: entry[0].bucket_start):
+        combined = rollups.combine(list(group))
+        parts.append(combined)
+        series.append({"start": bucket_begin.isoformat(), **rollups.describe(combined)})
+
+    summary = rollups.merge_combined(parts) if parts else {"count": 0}
+    return {
+        "bucket": bucket,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "mode": mode,
+        "summary": rollups.describe(summary),
+        "data": series
+    }
+
+
+@router.get("/api/history/stats")
+def history_stats(
+    bucket: str = 'day',
+    time_from: str = Query(None, alias="from"),
+    time_to: str = Query(None, alias="to"),
+    mode: str = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Statystyki (liczba, min, max, średnia, percentyle) dla download, upload, ping
+    i jitter w kubełkach godzinowych lub dziennych - z tabeli rollupów, bez czytania
+    surowych wyników. Granice okna są wyrównywane do pełnych kubełków.
+    Odpowiedź jest cache'owana do następnej zmiany danych (results_version).
+    """
+    if bucket not in rollups.BUCKETS:
+        return JSONResponse(status_code=400, content={"error": f"bucket: {' / '.join(rollups.BUCKETS)}"})
+    try:
+        start, end = stats_bounds(bucket, time_from or STATS_DEFAULT_FROM.get(bucket), time_to)
+        body = cached_json(("stats", bucket, start, end, mode), lambda: compute_stats(db, bucket, start, end, mode))
+        return Response(content=body, media_type="application/json")
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logger.error(f"Błąd statystyk historii: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+SERIES_METRICS = ("download", "upload", "ping", "jitter", "ping_download", "ping_upload")
+SERIES_DEFAULT_POINTS = 500
+SERIES_MAX_POINTS = 5000
+
+
+NAIVE_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def naive_seconds(column):
+    """Sekundy od 1970-01-01 liczone w bazie dla czasu bez strefy (bez parsowania datetime w Pythonie)."""
+    if DB_TYPE == "mysql":
+        return func.timestampdiff(text("SECOND"), NAIVE_EPOCH, column)
+    return cast(func.strftime("%s", column), Integer)
+
+
+def compute_series(db: Session, metric: str, range_filters: list, mode: str, points: int, is_mbs: bool) -> dict:
+    column = getattr(SpeedResult, metric)
+    query = select(naive_seconds(SpeedResult.created_at), column).where(
+        SpeedResult.created_at.isnot(None), column.isnot(None), *range_filters
+    )
+    if mode:
+        query = query.where(SpeedResult.mode == mode)
+    # Surowe krotki przez Core (bez warstwy ORM) - przy całej historii to setki tysięcy wierszy
+    rows = db.connection().execute(query.order_by(SpeedResult.created_at, SpeedResult.id)).all()
+    if not rows:
+        return {"metric": metric, "mode": mode, "total": 0, "t": [], "v": []}
+
+    # fromiter po spłaszczonych krotkach - np.array na obiektach Row jest o rząd wielkości wolniejsze
+    data = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=2 * len(rows))
+    x, y = data[0::2], data[1::2]
+    if is_mbs and metric in ("download", "upload"):
+        y /= 8.0
+    picked = downsample.lttb(x, y, points)
+
+    return {
+        "metric": metric,
+        "mode": mode,
+        "total": len(rows),
+        # Epoch w ms (jak Date w JS) - strefa lokalna doliczana tylko dla wybranych punktów
+        "t": [round((NAIVE_EPOCH + datetime.timedelta(seconds=sec)).timestamp() * 1000) for sec in x[picked].tolist()],
+        "v": np.round(y[picked], 3).tolist(),
+    }
+
+
+@router.get("/api/history/series")
+def history_series(
+    metric: str = 'download',
+    time_from: str = Query(None, alias="from"),
+    time_to: str = Query(None, alias="to"),
+    mode: str = None,
+    points: int = SERIES_DEFAULT_POINTS,
+    unit: str = 'mbps',
+    db: Session = Depends(get_db)
+):
+    """
+    Seria jednej metryki do wykresu w formie kolumnowej: `t` (epoch ms) i `v`
+    (wartości) jako równoległe tablice, zredukowana po stronie serwera do `points`
+    punktów algorytmem LTTB (zachowuje szpilki i spadki).
+    `total` to liczba pomiarów w oknie przed redukcją.
+    """
+    if metric not in SERIES_METRICS:
+        return JSONResponse(status_code=400, content={"error": f"metric: {' / '.join(SERIES_METRICS)}"})
+    points = max(3, min(points, SERIES_MAX_POINTS))
+    is_mbs = (unit == 'mbs')
+    try:
+        range_filters = time_range_filters(time_from, time_to)
+        # Klucz z surowych from/to - okno względne (from=24h) przesuwa się co najwyżej o COUNT_MAX_AGE
+        body = cached_json(
+            ("series", metric, time_from, time_to, mode, points, is_mbs),
+            lambda: compute_series(db, metric, range_filters, mode, points, is_mbs)
+        )
+        return Response(content=body, media_type="application/json")
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logger.error(f"Błąd serii historii: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+EXPORT_BATCH = 2000          # wierszy na partię odczytu
+EXPORT_CHUNK = 64 * 1024     # bajtów na fragment odpowiedzi
+
+EXPORT_COLUMNS = (
+    SpeedResult.id, SpeedResult.date, SpeedResult.created_at, SpeedResult.mode,
+    SpeedResult.ping, SpeedResult.jitter, SpeedResult.ping_download, SpeedResult.ping_upload,
+    SpeedResult.download, SpeedResult.upload,
+)
+
+
+def iter_export_rows(range_filters: list):
+    """
+    Wiersze eksportu strumieniowo, partiami po EXPORT_BATCH w kolejności indeksu
+    (created_at, id) - pamięć nie rośnie z historią, a między partiami nie trzymamy
+    blokady odczytu (database.iter_in_batches).
+    """
+    return iter_in_batches(
+        EXPORT_COLUMNS, (SpeedResult.created_at, SpeedResult.id), [SpeedResult.created_at.isnot(None), *range_filters],
+        descending=True, batch_size=EXPORT_BATCH,
+    )
+
+
+def stream_csv(rows, header: list, is_mbs: bool):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    for row in rows:
+        down_val = row.download / 8.0 if is_mbs else row.download
+        up_val = row.upload / 8.0 if is_mbs else row.upload
+        mode_val = row.mode if row.mode else "Multi"
+
+        # Bezpieczne pobieranie wartości (dla starych rekordów mogą być None/0)
+        jit = row.jitter if row.jitter else 0.0
+        p_dl = row.ping_download if row.ping_download else 0.0
+        p_up = row.ping_upload if row.ping_upload else 0.0
+
+        writer.writerow([
+            row.date, 
+            mode_val,
+            f"{row.ping:.2f}", 
+            f"{jit:.2f}",
+            f"{p_dl:.2f}",
+            f"{p_up:.2f}",
+            f"{down_val:.2f}", 
+            f"{up_val:.2f}"
+        ])
+        if output.tell() >= EXPORT_CHUNK:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def stream_ndjson(rows, is_mbs: bool):
+    chunk = []
+    size = 0
+    scale = 1 / 8.0 if is_mbs else 1.0
+    for row in rows:
+        line = json.dumps({
+            "id": row.id,
+            "date": row.date,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "mode": row.mode or "Multi",
+            "ping": row.ping,
+            "jitter": row.jitter or 0.0,
+            "ping_download": row.ping_download or 0.0,
+            "ping_upload": row.ping_upload or 0.0,
+            "download": round((row.download or 0.0) * scale, 3),
+            "upload": round((row.upload or 0.0) * scale, 3),
+        }, separators=(",", ":"))
+        chunk.append(line)
+        size += len(line) + 1
+        if size >= EXPORT_CHUNK:
+            yield "\n".join(chunk) + "\n"
+            chunk, size = [], 0
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def logged_stream(chunks):
+    # Po wysłaniu nagłówków nie zmienimy już statusu - błąd tylko logujemy (ucięty plik)
+    try:
+        yield from chunks
+    except Exception as e:
+        logger.error(f"Błąd eksportu (w trakcie strumienia): {e}")
+        raise
+
+
 @router.get("/api/history/export")
 def export_history_csv(
     unit: str = 'mbps', 
@@ -131,19 +627,30 @@ def export_history_csv(
     h_ping_up: str = 'Ping UL',
     h_down: str = 'Download', 
     h_up: str = 'Upload', 
-    db: Session = Depends(get_db)
+    format: str = 'csv',
+    time_from: str = Query(None, alias="from"),
+    time_to: str = Query(None, alias="to"),
 ):
+    """
+    Eksport historii (CSV lub NDJSON) strumieniowo - pierwsze bajty wychodzą
+    od razu, a pamięć jest stała niezależnie od liczby wyników.
+    """
     try:
-        results = db.query(SpeedResult).order_by(desc(SpeedResult.date)).all()
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        is_mbs = (unit == 'mbs')
-        unit_label = 'MB/s' if is_mbs else 'Mbps'
-        
-        # Zaktualizowany nagłówek CSV
-        writer.writerow([
+        range_filters = time_range_filters(time_from, time_to)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    is_mbs = (unit == 'mbs')
+    unit_label = 'MB/s' if is_mbs else 'Mbps'
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    rows = iter_export_rows(range_filters)
+
+    if format == 'ndjson':
+        filename = f"localspeed_history_{timestamp}.ndjson"
+        chunks = stream_ndjson(rows, is_mbs)
+        media_type = "application/x-ndjson"
+    else:
+        header = [
             h_date, 
             h_mode, 
             f'{h_ping} (ms)', 
@@ -152,37 +659,11 @@ def export_history_csv(
             f'{h_ping_up} (ms)',
             f'{h_down} ({unit_label})', 
             f'{h_up} ({unit_label})'
-        ])
-        
-        for row in results:
-            down_val = row.download / 8.0 if is_mbs else row.download
-            up_val = row.upload / 8.0 if is_mbs else row.upload
-            mode_val = row.mode if row.mode else "Multi"
-            
-            # Bezpieczne pobieranie wartości (dla starych rekordów mogą być None/0)
-            jit = row.jitter if row.jitter else 0.0
-            p_dl = row.ping_download if row.ping_download else 0.0
-            p_up = row.ping_upload if row.ping_upload else 0.0
-
-            writer.writerow([
-                row.date, 
-                mode_val,
-                f"{row.ping:.2f}", 
-                f"{jit:.2f}",
-                f"{p_dl:.2f}",
-                f"{p_up:.2f}",
-                f"{down_val:.2f}", 
-                f"{up_val:.2f}"
-            ])
-            
-        output.seek(0)
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        ]
         filename = f"localspeed_history_{timestamp}.csv"
-        
-        response = StreamingResponse(iter([output.getvalue()]), media_type="text/csv")
-        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
-        
-    except Exception as e:
-        logger.error(f"Błąd eksportu CSV: {e}")
-        return JSONResponse(status_code=500, content={"error": str(e)})
\ No newline at end of file
+        chunks = stream_csv(rows, header, is_mbs)
+        media_type = "text/csv"
+
+    response = StreamingResponse(logged_stream(chunks), media_type=media_type)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
@@ -0,0 +1,152 @@
+# Moduł odpowiedzialny za tryb hub / edge (zbieranie wyników z wielu instancji).
+#
+# Hub: zwykła instancja przyjmująca partie wyników przez POST /api/history/batch
+# (history_api.ingest_batch). Z włączonym logowaniem instancje edge uwierzytelniają
+# się nagłówkiem "Authorization: Bearer <INGEST_TOKEN>" (patrz middleware.py).
+#
+# Edge: instancja z ustawionym HUB_URL. Scheduler co HUB_PUSH_INTERVAL sekund
+# wysyła nowe wiersze results partiami po HUB_BATCH_SIZE, w kolejności id.
+# Kursor (ostatnie potwierdzone id) trzymamy w tabeli hub_push_state. Przed wysyłką
+# zapisujemy górną granicę partii (pending_id), więc ponowienie po błędzie sieci
+# wysyła dokładnie ten sam zakres z tym samym Idempotency-Key - hub nie zdubluje wierszy,
+# nawet jeśli pierwsza próba doszła, a zgubiła się tylko odpowiedź.
+#
+# Zmienne środowiskowe:
+#   NODE_ID            - nazwa tej instancji w source_node (domyślnie nazwa hosta),
+#   HUB_URL            - adres huba (np. http://hub:8002) - włącza wysyłkę,
+#   HUB_TOKEN          - token wysyłany do huba (INGEST_TOKEN huba),
+#   INGEST_TOKEN       - token akceptowany przez /api/history/batch tej instancji,
+#   HUB_PUSH_INTERVAL  - co ile sekund wysyłać (domyślnie 300),
+#   HUB_BATCH_SIZE     - wierszy w jednej partii (domyślnie 1000).
+
+import os
+import socket
+import datetime
+import logging
+import httpx
+from sqlalchemy import select, delete
+from .database import SessionLocal, SpeedResult, HubPushState, IngestBatch
+
+logger = logging.getLogger("Hub")
+
+NODE_ID = os.getenv("NODE_ID") or socket.gethostname()
+HUB_URL = os.getenv("HUB_URL", "").rstrip("/")
+HUB_TOKEN = os.getenv("HUB_TOKEN", "")
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+HUB_PUSH_INTERVAL = int(os.getenv("HUB_PUSH_INTERVAL", "300"))
+HUB_BATCH_SIZE = int(os.getenv("HUB_BATCH_SIZE", "1000"))
+
+HUB_MAX_BATCHES = 50         # partii na jedno uruchomienie (nadrabianie zaległości bez blokowania schedulera)
+HUB_TIMEOUT = 30.0
+INGEST_KEY_TTL_DAYS = 7      # jak długo hub pamięta klucze idempotencji
+
+PUSH_COLUMNS = (
+    SpeedResult.id, SpeedResult.created_at, SpeedResult.mode, SpeedResult.lang, SpeedResult.theme,
+    SpeedResult.ping, SpeedResult.jitter, SpeedResult.ping_download, SpeedResult.ping_upload,
+    SpeedResult.download, SpeedResult.upload, SpeedResult.source_node,
+)
+
+
+def result_payload(row) -> dict:
+    return {
+        # Czas ze strefą - hub może działać w innej strefie niż edge
+        "created_at": row.created_at.astimezone().isoformat(),
+        "mode": row.mode,
+        "lang": row.lang,
+        "theme": row.theme,
+        "ping": row.ping,
+        "jitter": row.jitter,
+        "ping_download": row.ping_download,
+        "ping_upload": row.ping_upload,
+        "download": row.download,
+        "upload": row.upload,
+        # Wiersze przyjęte od innych instancji zachowują swoje źródło (huby kaskadowo)
+        "source_node": row.source_node or NODE_ID,
+    }
+
+
+def push_to_hub():
+    """Wysyła nowe wyniki do huba (zadanie schedulera, tylko przy ustawionym HUB_URL)."""
+    if not HUB_URL:
+        return
+    db = SessionLocal()
+    state = None
+    try:
+        state = db.get(HubPushState, HUB_URL)
+        if state is None:
+            state = HubPushState(hub_url=HUB_URL, last_id=0)
+            db.add(state)
+            db.commit()
+
+        headers = {"X-Source-Node": NODE_ID}
+        if HUB_TOKEN:
+            headers["Authorization"] = f"Bearer {HUB_TOKEN}"
+
+        sent = 0
+        with httpx.Client(timeout=HUB_TIMEOUT) as client:
+            for _ in range(HUB_MAX_BATCHES):
+                if state.pending_id is None:
+                    ids = db.execute(
+                        select(SpeedResult.id).where(SpeedResult.id > state.last_id)
+                        .order_by(SpeedResult.id).limit(HUB_BATCH_SIZE)
+                    ).scalars().all()
+                    if not ids:
+                        break
+                    state.pending_id = ids[-1]
+                    db.commit()
+
+                rows = db.execute(
+                    select(*PUSH_COLUMNS)
+                    .where(SpeedResult.id > state.last_id, SpeedResult.id <= state.pending_id,
+                           SpeedResult.created_at.isnot(None))
+                    .order_by(SpeedResult.id)
+                ).all()
+                if rows:
+                    resp = client.post(
+                        f"{HUB_URL}/api/history/batch",
+                        json={"source_node": NODE_ID, "results": [result_payload(row) for row in rows]},
+                        headers={**headers, "Idempotency-Key": f"{NODE_ID}:{state.last_id}:{state.pending_id}"},
+                    )
+                    if resp.status_code == 409:
+                        # Ten sam zakres z inną treścią - między próbami usunięto tu wyniki.
+                        # Pierwsza próba doszła, a wyniki się nie zmieniają, więc hub ma nadzbiór
+                        logger.warning(f"Hub ma już partię {state.last_id}-{state.pending_id} (inna treść) - pomijam.")
+                    else:
+                        resp.raise_for_status()
+                        sent += len(rows)
+
+                state.last_id = state.pending_id
+                state.pending_id = None
+                state.last_push = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                state.status = "OK"
+                db.commit()
+
+        if sent:
+            logger.info(f"Wysłano do huba {sent} wyników (ostatnie id: {state.last_id}).")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Błąd wysyłki do huba: {e}")
+        if state is not None:
+            try:
+                state.status = f"Błąd: {e}"[:255]
+                db.commit()
+            except Exception:
+                db.rollback()
+    finally:
+        db.close()
+
+
+def prune_ingest_keys():
+    """Usuwa stare klucze idempotencji (zadanie schedulera)."""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=INGEST_KEY_TTL_DAYS)
+        deleted = db.execute(delete(IngestBatch).where(IngestBatch.created_at < cutoff)).rowcount
+        db.commit()
+        if deleted:
+            logger.info(f"Usunięto {deleted} starych kluczy idempotencji.")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Błąd czyszczenia kluczy idempotencji: {e}")
+    finally:
+        db.close()
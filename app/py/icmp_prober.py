@@ -0,0 +1,239 @@
+# Moduł odpowiedzialny za pomiar ICMP (ping do klienta) bez uruchamiania procesów.
+#
+# Zamiast `ping -c 1` w podprocesie wysyłamy pakiety Echo Request z jednego,
+# współdzielonego gniazda na proces (osobno IPv4 i IPv6):
+#   - SOCK_DGRAM + IPPROTO_ICMP ("ping socket", bez uprawnień root),
+#     o ile pozwala na to net.ipv4.ping_group_range,
+#   - w przeciwnym razie SOCK_RAW (wymaga CAP_NET_RAW - domyślnie w Dockerze).
+# Odpowiedzi odbiera pętla asyncio (loop.add_reader) i dopasowuje je po
+# identyfikatorze i numerze sekwencyjnym, więc wielu klientów może być
+# sondowanych równolegle przez to samo gniazdo.
+
+import os
+import math
+import time
+import errno
+import socket
+import ipaddress
+import struct
+import asyncio
+import logging
+
+logger = logging.getLogger("IcmpProber")
+
+ICMP_HEADER = struct.Struct("!BBHHH")
+ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+PROTOCOL = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+ICMP6_FILTER = 1
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+PAYLOAD = b"LocalSpeedPRO-ICMP".ljust(32, b"\x00")
+
+MAX_COUNT = 20
+MIN_INTERVAL = 0.01
+MAX_INTERVAL = 1.0
+MAX_TIMEOUT = 5.0
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class IcmpSocket:
+    """Jedno gniazdo ICMP danej rodziny adresów z tabelą oczekujących sond."""
+
+    def __init__(self, family: int):
+        self.family = family
+        self.sock = None
+        self.method = None
+        self.ident = os.getpid() & 0xFFFF
+        self.seq = 0
+        self.pending = {}
+
+    def open(self, loop: asyncio.AbstractEventLoop):
+        proto = PROTOCOL[self.family]
+        try:
+            self.sock = socket.socket(self.family, socket.SOCK_DGRAM, proto)
+            self.method = "dgram"
+            # Przy ping socket identyfikator nadaje jądro (lokalny "port")
+            self.sock.bind(("::" if self.family == socket.AF_INET6 else "0.0.0.0", 0))
+            self.ident = self.sock.getsockname()[1]
+        except OSError:
+            self.sock = socket.socket(self.family, socket.SOCK_RAW, proto)
+            self.method = "raw"
+            if self.family == socket.AF_INET6:
+                # Przepuszczamy tylko Echo Reply (reszta ICMPv6 nas nie interesuje)
+                words = [0xFFFFFFFF] * 8
+                reply = ECHO_REPLY[self.family]
+                words[reply >> 5] &= ~(1 << (reply & 31)) & 0xFFFFFFFF
+                try:
+                    self.sock.setsockopt(socket.IPPROTO_ICMPV6, ICMP6_FILTER, struct.pack("=8I", *words))
+                except OSError:
+                    pass
+        self.sock.setblocking(False)
+        loop.add_reader(self.sock.fileno(), self._on_readable)
+        logger.info(f"ICMP socket ({'IPv6' if self.family == socket.AF_INET6 else 'IPv4'}): {self.method}")
+
+    def close(self, loop: asyncio.AbstractEventLoop):
+        if self.sock is not None:
+            loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        for future, _, _ in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+    def _next_seq(self) -> int:
+        for _ in range(0x10000):
+            self.seq = (self.seq + 1) & 0xFFFF
+            if self.seq not in self.pending:
+                return self.seq
+        raise RuntimeError("Too many pending ICMP probes")
+
+    def send(self, ip: IPAddress, future: asyncio.Future) -> int:
+        seq = self._next_seq()
+        packet = ICMP_HEADER.pack(ECHO_REQUEST[self.family], 0, 0, self.ident, seq) + PAYLOAD
+        if self.family == socket.AF_INET:
+            # Dla ICMPv6 sumę kontrolną (z pseudo-nagłówkiem) liczy jądro
+            packet = packet[:2] + struct.pack("!H", checksum(packet)) + packet[4:]
+        self.pending[seq] = (future, time.monotonic_ns(), ip)
+        try:
+            self.sock.sendto(packet, (str(ip), 0))
+        except OSError as e:
+            self.pending.pop(seq, None)
+            future.set_exception(e)
+        return seq
+
+    def forget(self, seq: int):
+        self.pending.pop(seq, None)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    logger.debug(f"ICMP recv error: {e}")
+                return
+            now = time.monotonic_ns()
+
+            offset = 0
+            if self.method == "raw" and self.family == socket.AF_INET:
+                # Surowe gniazdo IPv4 zwraca pakiet razem z nagłówkiem IP
+                offset = (data[0] & 0x0F) * 4
+            if len(data) < offset + ICMP_HEADER.size:
+                continue
+            icmp_type, _, _, ident, seq = ICMP_HEADER.unpack_from(data, offset)
+            if icmp_type != ECHO_REPLY[self.family] or ident != self.ident:
+                continue
+
+            entry = self.pending.get(seq)
+            if entry is None:
+                continue
+            future, sent_ns, ip = entry
+            try:
+                # Porównujemy adresy, nie napisy (IPv6 ma wiele zapisów);
+                # .packed pomija strefę link-local ("%eth0")
+                if ipaddress.ip_address(addr[0]).packed != ip.packed:
+                    continue
+            except ValueError:
+                continue
+            del self.pending[seq]
+            if not future.done():
+                future.set_result((now - sent_ns) / 1e6)
+
+
+class IcmpProber:
+    """Współdzielony (na proces) silnik sond ICMP."""
+
+    def __init__(self):
+        self.sockets = {}
+        self.loop = None
+
+    def _socket(self, family: int) -> IcmpSocket:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Nowa pętla zdarzeń (np. restart workera) - gniazda trzeba założyć od nowa
+            self.sockets = {}
+            self.loop = loop
+        icmp = self.sockets.get(family)
+        if icmp is None:
+            icmp = IcmpSocket(family)
+            icmp.open(loop)
+            self.sockets[family] = icmp
+        return icmp
+
+    def close(self):
+        for icmp in self.sockets.values():
+            icmp.close(self.loop)
+        self.sockets = {}
+
+    async def _probe_one(self, icmp: IcmpSocket, ip: IPAddress, timeout: float):
+        future = asyncio.get_running_loop().create_future()
+        seq = icmp.send(ip, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            icmp.forget(seq)
+
+    async def probe(self, ip: str | IPAddress, count: int = 5, interval: float = 0.05, timeout: float = 1.0) -> dict:
+        """
+        Wysyła serię `count` sond co `interval` s i czeka na odpowiedzi maks. `timeout` s.
+        Zwraca min/avg/max/stddev (ms) oraz procent strat.
+        `ip` - adres (str lub ipaddress); nazwa hosta to ValueError (bez DNS),
+        podobnie NaN/inf w `interval` / `timeout`.
+        """
+        interval, timeout = float(interval), float(timeout)
+        if not (math.isfinite(interval) and math.isfinite(timeout)):
+            raise ValueError("interval/timeout must be finite numbers")
+        count = min(max(int(count), 1), MAX_COUNT)
+        interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+        timeout = min(max(timeout, 0.1), MAX_TIMEOUT)
+
+        ip = ipaddress.ip_address(ip)
+        if ip.version == 6 and ip.ipv4_mapped:
+            # Adres IPv4 zmapowany na IPv6 (serwer nasłuchuje na "::")
+            ip = ip.ipv4_mapped
+        family = socket.AF_INET6 if ip.version == 6 else socket.AF_INET
+        icmp = self._socket(family)
+
+        tasks = []
+        for i in range(count):
+            if i:
+                await asyncio.sleep(interval)
+            tasks.append(asyncio.ensure_future(self._probe_one(icmp, ip, timeout)))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+        samples = [r for r in results if isinstance(r, float)]
+        if errors and not samples:
+            raise errors[0]
+
+        stats = {
+            "sent": count,
+            "received": len(samples),
+            "loss": round((count - len(samples)) * 100.0 / count, 1),
+            "method": icmp.method,
+        }
+        if samples:
+            avg = sum(samples) / len(samples)
+            stats.update({
+                "min": round(min(samples), 3),
+                "avg": round(avg, 3),
+                "max": round(max(samples), 3),
+                "stddev": round((sum((s - avg) ** 2 for s in samples) / len(samples)) ** 0.5, 3),
+            })
+        return stats
+
+
+icmp_prober = IcmpProber()
@@ -0,0 +1,142 @@
+# Moduł odpowiedzialny za zadania w tle (backup, przywracanie).
+#
+# Backup na Google Drive i przywracanie trwają od sekund do minut i są w pełni
+# synchroniczne (HTTP do Google, zapis do bazy). Uruchamiamy je w osobnym wątku,
+# endpoint od razu zwraca id zadania, a pętla zdarzeń workera (i testy prędkości
+# na nim) działa dalej.
+#
+# Naraz działa jedno zadanie we wszystkich workerach - blokada pliku (flock)
+# w katalogu pamięci współdzielonej, trzymana do końca zadania. Bez fcntl
+# (Windows, jeden proces) wystarcza zwykła blokada wątku.
+#
+# Stan (etap, postęp, wynik, błąd) zapisujemy do pliku JSON obok blokady,
+# więc GET /api/jobs/{id} odczyta go w każdym workerze.
+
+import os
+import re
+import json
+import time
+import secrets
+import datetime
+import logging
+import threading
+from .shared_state import SHARED_DIR
+
+logger = logging.getLogger("Jobs")
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+_thread_lock = threading.Lock()  # zamiast blokady pliku, gdy brak fcntl (jeden proces)
+
+PROGRESS_INTERVAL = 0.5       # s - jak często zapisujemy plik stanu
+STATUS_MAX_AGE = 86400        # s - po tym czasie stare pliki stanu są usuwane
+
+LOCK_PATH = os.path.join(SHARED_DIR, "localspeed_jobs.lock")
+STATUS_PREFIX = "localspeed_job_"
+JOB_ID_RE = re.compile(r"[0-9a-f]{16}")
+
+
+def status_path(job_id: str) -> str:
+    return os.path.join(SHARED_DIR, f"{STATUS_PREFIX}{job_id}.json")
+
+
+def read_status(job_id: str):
+    """Stan zadania dla GET /api/jobs/{id} (None - nieznane id)."""
+    if not JOB_ID_RE.fullmatch(job_id):
+        return None
+    try:
+        with open(status_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prune_statuses():
+    now = time.time()
+    for name in os.listdir(SHARED_DIR):
+        if name.startswith(STATUS_PREFIX) and name.endswith(".json"):
+            path = os.path.join(SHARED_DIR, name)
+            try:
+                if now - os.path.getmtime(path) > STATUS_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def now_iso() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class JobProgress:
+    """Stan zadania. `fields` - liczniki postępu właściwe dla rodzaju zadania."""
+
+    def __init__(self, job_id: str, kind: str, phase: str, **fields):
+        self.status = {
+            "id": job_id, "kind": kind, "state": "running", "phase": phase,
+            **fields,
+            "started": now_iso(), "finished": None, "error": None, "result": None,
+        }
+        self._written = 0.0
+
+    def update(self, force: bool = False, **changes):
+        self.status.update(changes)
+        now = time.monotonic()
+        if not force and now - self._written < PROGRESS_INTERVAL:
+            return
+        self._written = now
+        # Zapis przez plik tymczasowy + os.replace - czytelnik nie zobaczy połowy JSON-a
+        path = status_path(self.status["id"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.status, f)
+        os.replace(path + ".tmp", path)
+
+
+def acquire_lock():
+    """Jedno zadanie naraz (we wszystkich workerach). Zwraca funkcję zwalniającą lub None."""
+    if not HAS_FCNTL:
+        return _thread_lock.release if _thread_lock.acquire(blocking=False) else None
+    handle = open(LOCK_PATH, "w")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle.close
+
+
+def run_job(target, progress: JobProgress, release):
+    started = time.perf_counter()
+    kind, job_id = progress.status["kind"], progress.status["id"]
+    try:
+        result = target(progress)
+        logger.info(f"Zadanie {kind} ({job_id}) zakończone w {time.perf_counter() - started:.1f} s.")
+        progress.update(force=True, state="done", phase="done", result=result, finished=now_iso())
+    except Exception as e:
+        logger.error(f"Zadanie {kind} ({job_id}) zakończone błędem: {e}")
+        progress.update(force=True, state="error", error=str(e)[:500], finished=now_iso())
+    finally:
+        release()
+
+
+def start_job(kind: str, target, phase: str = "start", **fields) -> str:
+    """
+    Uruchamia `target(progress)` w wątku w tle; jego wynik (dict) trafia do
+    pola "result" stanu. Zwraca id zadania lub None, gdy inne zadanie trwa.
+    """
+    release = acquire_lock()
+    if release is None:
+        return None
+    try:
+        prune_statuses()
+        job_id = secrets.token_hex(8)
+        progress = JobProgress(job_id, kind, phase, **fields)
+        progress.update(force=True)
+        threading.Thread(target=run_job, args=(target, progress, release), name=f"{kind}-{job_id}", daemon=True).start()
+    except Exception:
+        release()
+        raise
+    return job_id
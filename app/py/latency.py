@@ -0,0 +1,190 @@
+# Moduł odpowiedzialny za pomiar opóźnień (Ping/Jitter) po stronie serwera.
+#
+# Protokół binarny po WebSocket (/api/ws/latency):
+#   - serwer wysyła sondy co 'interval' ms (min. 1 ms), ramka 16 B:
+#       seq (uint32), last_rtt_us (uint32), t_send_ns (uint64, zegar monotoniczny serwera)
+#   - klient odsyła ramkę bez zmian, serwer liczy RTT = teraz - t_send_ns
+#   - komendy tekstowe (JSON) od klienta:
+#       {"cmd": "phase", "phase": "download"} - kolejne próbki trafiają do innej fazy
+#       {"cmd": "interval", "ms": 10}         - zmiana tempa sond (min. 1 ms)
+#       {"cmd": "stats"}                      - serwer odpowiada statystykami (JSON)
+# Tempo sond wyznacza serwer, a czas mierzy zegar monotoniczny w nanosekundach,
+# więc wynik nie zależy od dławionych timerów setTimeout w przeglądarce.
+
+import math
+import time
+import json
+import struct
+import asyncio
+import logging
+from fastapi import WebSocket, WebSocketDisconnect
+from .histogram import LogHistogram
+
+logger = logging.getLogger("Latency")
+
+PROBE = struct.Struct("<IIQ")
+MIN_INTERVAL_MS = 1.0
+MAX_INTERVAL_MS = 10000.0
+DEFAULT_INTERVAL_MS = 100.0
+PHASES = ("idle", "download", "upload")
+
+
+def interval_seconds(ms) -> float:
+    """Odstęp sond w ms -> s, obcięty do zakresu. ValueError dla NaN/inf (json.loads przyjmuje NaN)."""
+    ms = float(ms)
+    if not math.isfinite(ms):
+        raise ValueError(f"Invalid interval: {ms}")
+    return min(max(ms, MIN_INTERVAL_MS), MAX_INTERVAL_MS) / 1000.0
+
+
+class PhaseStats:
+    """Histogram RTT (w mikrosekundach) i jitter dla jednej fazy testu."""
+    __slots__ = ("histogram", "last_rtt", "jitter_sum", "jitter_n")
+
+    def __init__(self):
+        self.histogram = LogHistogram()
+        self.last_rtt = None
+        self.jitter_sum = 0
+        self.jitter_n = 0
+
+    def record(self, rtt_us: int):
+        # Jitter = średnia bezwzględna różnica kolejnych RTT (jak dotychczas w JS)
+        if self.last_rtt is not None:
+            self.jitter_sum += abs(rtt_us - self.last_rtt)
+            self.jitter_n += 1
+        self.last_rtt = rtt_us
+        self.histogram.record(rtt_us)
+
+    def to_dict(self) -> dict:
+        h = self.histogram
+        ms = lambda us: round(us / 1000.0, 3)
+        return {
+            "count": h.count,
+            "min": ms(h.min or 0),
+            "mean": ms(h.mean),
+            "p50": ms(h.percentile(50)),
+            "p90": ms(h.percentile(90)),
+            "p99": ms(h.percentile(99)),
+            "max": ms(h.max or 0),
+            "jitter": ms(self.jitter_sum / self.jitter_n) if self.jitter_n else 0.0,
+        }
+
+
+class LatencySession:
+    def __init__(self, websocket: WebSocket, interval_ms: float, count: int, warmup: int, phase: str):
+        self.websocket = websocket
+        try:
+            self.interval = interval_seconds(interval_ms)
+        except ValueError:
+            self.interval = DEFAULT_INTERVAL_MS / 1000.0
+        self.count = max(0, count)
+        self.warmup = max(0, warmup)
+        self.phase = phase if phase in PHASES else "idle"
+        self.phases = {}
+        self.seq = 0
+        self.received = 0
+        self.last_rtt_us = 0
+        self.start_ns = time.monotonic_ns()
+        self.done = asyncio.Event()
+
+    def stats(self) -> dict:
+        return {
+            "type": "stats",
+            "interval_ms": self.interval * 1000.0,
+            "phases": {name: p.to_dict() for name, p in self.phases.items()},
+        }
+
+    async def run(self):
+        sender = asyncio.ensure_future(self._send_probes())
+        try:
+            await self._receive()
+        finally:
+            sender.cancel()
+
+    async def _send_probes(self):
+        loop = asyncio.get_running_loop()
+        next_t = loop.time()
+        while not self.done.is_set():
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            frame = PROBE.pack(self.seq, min(self.last_rtt_us, 0xFFFFFFFF), time.monotonic_ns())
+            try:
+                await self.websocket.send_bytes(frame)
+            except Exception:
+                # Połączenie zamknięte - pętla odbioru zakończy sesję
+                return
+            next_t += self.interval
+            delay = next_t - loop.time()
+            if delay <= 0:
+                # Nie nadrabiamy zaległych sond - zaczynamy nowy takt
+                next_t = loop.time()
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(delay)
+
+    async def _receive(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            data = message.get("bytes")
+            if data is not None:
+                if len(data) >= PROBE.size:
+                    self._on_echo(data)
+                    if self.count and self.received >= self.warmup + self.count:
+                        self.done.set()
+                        await self.websocket.send_text(json.dumps(self.stats()))
+                        await self.websocket.close()
+                        return
+                continue
+
+            text = message.get("text")
+            if text and self._on_command(text):
+                await self.websocket.send_text(json.dumps(self.stats()))
+
+    def _on_echo(self, data: bytes):
+        now = time.monotonic_ns()
+        _, _, sent_ns = PROBE.unpack_from(data)
+        # Odrzucamy ramki, których znacznik czasu nie pochodzi z tej sesji
+        if sent_ns < self.start_ns or sent_ns > now:
+            return
+        rtt_us = (now - sent_ns) // 1000
+        self.received += 1
+        self.last_rtt_us = rtt_us
+        if self.received <= self.warmup:
+            return
+        stats = self.phases.get(self.phase)
+        if stats is None:
+            stats = self.phases[self.phase] = PhaseStats()
+        stats.record(rtt_us)
+
+    def _on_command(self, text: str) -> bool:
+        """Obsługuje komendę tekstową. Zwraca True, jeśli klient prosi o statystyki."""
+        try:
+            cmd = json.loads(text)
+        except ValueError:
+            return False
+        if not isinstance(cmd, dict):
+            return False
+        if cmd.get("cmd") == "stats":
+            return True
+        if cmd.get("cmd") == "phase" and cmd.get("phase") in PHASES:
+            self.phase = cmd["phase"]
+            self.last_rtt_us = 0
+        elif cmd.get("cmd") == "interval":
+            try:
+                self.interval = interval_seconds(cmd.get("ms"))
+            except (TypeError, ValueError):
+                pass
+        return False
+
+
+async def run_latency_session(websocket: WebSocket, interval: float, count: int, warmup: int, phase: str):
+    await websocket.accept()
+    session = LatencySession(websocket, interval, count, warmup, phase)
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Latency WebSocket Error: {e}")
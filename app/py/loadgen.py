@@ -0,0 +1,355 @@
+# Generator obciążenia płaszczyzny danych (ilu klientów obsłuży jeden kontener?).
+#
+#   python -m py.loadgen http://127.0.0.1:8002 --clients 1,4,8
+#   python -m py.loadgen --spawn-workers 1,2,4 --clients 4,8 --duration 10
+#
+# Symuluje M klientów, z których każdy działa jak przeglądarka w trybie Multi:
+# 16 strumieni /api/download i /api/upload (bez rozpędzania - od razu pełne
+# obciążenie) oraz sondy opóźnienia /api/ws/ping. Dla każdej fazy raportuje:
+#   - łączną przepustowość i rozkład na klientów (indeks sprawiedliwości Jaina),
+#   - zużycie CPU serwera (drzewo procesów uvicorna z /proc) na 1 Gbps,
+#   - wzrost opóźnienia pod obciążeniem względem spoczynku.
+# Klienci rozkładani są na kilka procesów (--procs), żeby generator nie był
+# wąskim gardłem. Z --spawn-workers narzędzie samo uruchamia lokalny uvicorn
+# z różną liczbą workerów (i opcjonalnymi zmiennymi --env).
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import multiprocessing
+
+from .client import (
+    Target, ThroughputEngine, WebSocketClient, login, _json_request,
+    MAX_UPLOAD_SIZE, OP_TEXT, OP_CLOSE,
+)
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+START_DELAY = 1.5
+SERVER_START_TIMEOUT = 60
+
+
+# --- CPU SERWERA (/proc) ---
+
+def _proc_children() -> dict:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Nazwa procesu (w nawiasach) może zawierać spacje - dzielimy za ostatnim ')'
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree_cpu(pid: int) -> float:
+    """Suma czasu CPU (user + system, sekundy) procesu i wszystkich jego potomków."""
+    children = _proc_children()
+    total_ticks = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total_ticks += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+        stack.extend(children.get(current, []))
+    return total_ticks / CLK_TCK
+
+
+# --- KLIENCI (w procesach potomnych) ---
+
+async def ping_probe(target: Target, stop: asyncio.Event, interval: float) -> list:
+    """Sondy RTT po /api/ws/ping (echo tekstu), jak w starszym silniku przeglądarki."""
+    samples = []
+    try:
+        ws = await WebSocketClient.connect(target, "/api/ws/ping")
+    except (ConnectionError, OSError):
+        return samples
+    try:
+        while not stop.is_set():
+            sent = time.perf_counter()
+            ws.send_text(str(sent))
+            while True:
+                opcode, _ = await asyncio.wait_for(ws.recv(), timeout=2.0)
+                if opcode in (OP_TEXT, OP_CLOSE):
+                    break
+            if opcode == OP_CLOSE:
+                break
+            samples.append((time.perf_counter() - sent) * 1000.0)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+        pass
+    finally:
+        await ws.close()
+    return samples
+
+
+async def _run_streams(url: str, cookie: str, insecure: bool, kind: str, clients: int, streams: int,
+                       duration: float, start_at: float) -> list:
+    target = Target(url, insecure=insecure)
+    target.cookie = cookie
+    upload_buffer = memoryview(bytearray(os.urandom(1024 * 1024) * (MAX_UPLOAD_SIZE // (1024 * 1024)))) if kind == "upload" else None
+
+    # Wszystkie procesy startują jednocześnie
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    engines = [ThroughputEngine(target, kind, streams, upload_buffer=upload_buffer, ramp=False) for _ in range(clients)]
+    return list(await asyncio.gather(*(engine.run(duration) for engine in engines)))
+
+
+async def _run_probes(url: str, cookie: str, insecure: bool, clients: int, duration: float,
+                      interval: float, start_at: float) -> list:
+    target = Target(url, insecure=insecure)
+    target.cookie = cookie
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    stop = asyncio.Event()
+    probes = [asyncio.ensure_future(ping_probe(target, stop, interval)) for _ in range(clients)]
+    await asyncio.sleep(duration)
+    stop.set()
+    return list(await asyncio.gather(*probes))
+
+
+def run_group(params: tuple) -> list:
+    """
+    Zadanie procesu generatora. Sondy opóźnienia działają w osobnym procesie
+    (jak wątek główny przeglądarki obok Web Workerów), żeby obciążona pętla
+    zdarzeń generatora nie zawyżała RTT.
+    """
+    role, rest = params[0], params[1:]
+    if role == "probes":
+        return asyncio.run(_run_probes(*rest))
+    return asyncio.run(_run_streams(*rest))
+
+
+# --- STATYSTYKI ---
+
+def jain_index(values: list) -> float:
+    """(Σx)² / (n·Σx²): 1.0 = idealnie równo, 1/n = jeden klient zabiera wszystko."""
+    squares = sum(v * v for v in values)
+    return (sum(values) ** 2) / (len(values) * squares) if squares else 0.0
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+async def idle_latency(target: Target, seconds: float, interval: float) -> list:
+    stop = asyncio.Event()
+    task = asyncio.ensure_future(ping_probe(target, stop, interval))
+    await asyncio.sleep(seconds)
+    stop.set()
+    return await task
+
+
+def run_phase(args, target: Target, kind: str, clients: int, server_pid: int, idle_rtt: list) -> dict:
+    procs = max(1, min(args.procs or os.cpu_count() or 1, clients))
+    groups = [clients // procs + (1 if i < clients % procs else 0) for i in range(procs)]
+    start_at = time.time() + START_DELAY
+    params = [
+        ("streams", target.base_url, target.cookie, args.insecure, kind, n, args.streams, args.duration, start_at)
+        for n in groups if n
+    ]
+    params.append(("probes", target.base_url, target.cookie, args.insecure, clients, args.duration,
+                   args.ping_interval / 1000.0, start_at))
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(len(params)) as pool:
+        pending = pool.map_async(run_group, params)
+        # Pomiar CPU dokładnie w oknie testu
+        time.sleep(max(0.0, start_at - time.time()))
+        cpu_before = process_tree_cpu(server_pid) if server_pid else None
+        wall_before = time.perf_counter()
+        gen_before = process_tree_cpu(os.getpid())
+        *stream_groups, probe_results = pending.get()
+        wall = time.perf_counter() - wall_before
+        cpu_after = process_tree_cpu(server_pid) if server_pid else None
+        gen_after = process_tree_cpu(os.getpid())
+
+    speeds = [speed for group in stream_groups for speed in group]
+    loaded_rtt = [s for samples in probe_results for s in samples]
+    total_gbps = sum(speeds) / 1000.0
+    idle_p50 = statistics.median(idle_rtt) if idle_rtt else 0.0
+    loaded_p50 = statistics.median(loaded_rtt) if loaded_rtt else 0.0
+
+    report = {
+        "direction": kind,
+        "clients": clients,
+        "streams": args.streams,
+        "total_gbps": round(total_gbps, 3),
+        "client_mbps": {
+            "min": round(min(speeds), 2),
+            "median": round(statistics.median(speeds), 2),
+            "max": round(max(speeds), 2),
+        },
+        "jain": round(jain_index(speeds), 4),
+        "latency_ms": {
+            "idle_p50": round(idle_p50, 3),
+            "loaded_p50": round(loaded_p50, 3),
+            "loaded_p95": round(percentile(loaded_rtt, 95), 3),
+            "inflation": round(loaded_p50 / idle_p50, 2) if idle_p50 else None,
+            "samples": len(loaded_rtt),
+        },
+        "loadgen_cores": round((gen_after - gen_before) / wall, 2),
+    }
+    if cpu_before is not None:
+        cores = (cpu_after - cpu_before) / wall
+        report["server_cores"] = round(cores, 2)
+        report["cores_per_gbps"] = round(cores / total_gbps, 3) if total_gbps else None
+    return report
+
+
+# --- LOKALNY SERWER ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """Uruchamia uvicorn (py.main:app) z zadaną liczbą workerów na czas pomiaru."""
+
+    def __init__(self, workers: int, env_overrides: dict):
+        self.workers = workers
+        self.port = free_port()
+        self.env = dict(os.environ, AUTH_ENABLED="false")
+        self.env.update(env_overrides)
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        cmd = [
+            sys.executable, "-m", "uvicorn", "py.main:app",
+            "--host", "127.0.0.1", "--port", str(self.port),
+            "--workers", str(self.workers), "--log-level", "warning",
+            "--ws-per-message-deflate", "false",
+        ]
+        self.process = subprocess.Popen(cmd, cwd=APP_DIR, env=self.env, stdout=subprocess.DEVNULL)
+        deadline = time.time() + SERVER_START_TIMEOUT
+        target = Target(self.url)
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {self.process.returncode}")
+            try:
+                _json_request(target, "GET", "/api/auth/status")
+                # Workery startują niezależnie - dajemy chwilę pozostałym
+                time.sleep(1.0 + 0.25 * self.workers)
+                return self
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.5)
+        self.__exit__(None, None, None)
+        raise RuntimeError("uvicorn did not start in time")
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+# --- PRZEBIEG ---
+
+def print_report(label: str, r: dict):
+    lat = r["latency_ms"]
+    cpu = ""
+    if "server_cores" in r:
+        cpu = f"  CPU {r['server_cores']:.2f} rdz. ({r['cores_per_gbps']} rdz./Gbps)"
+    print(
+        f"{label} {r['direction']:<8} klienci {r['clients']:>3} x {r['streams']:<2} "
+        f"{r['total_gbps']:8.2f} Gbps  klient min/med/max {r['client_mbps']['min']:.0f}/"
+        f"{r['client_mbps']['median']:.0f}/{r['client_mbps']['max']:.0f} Mbps  Jain {r['jain']:.3f}  "
+        f"RTT {lat['idle_p50']:.2f} -> {lat['loaded_p50']:.2f} ms (p95 {lat['loaded_p95']:.2f}, x{lat['inflation']}){cpu}"
+        f"  [generator {r['loadgen_cores']:.2f} rdz.]",
+        flush=True,
+    )
+
+
+def run_against(args, url: str, server_pid: int, label: str) -> list:
+    target = Target(url, insecure=args.insecure)
+    if args.user:
+        asyncio.run(login(target, args.user, args.password or ""))
+
+    idle_rtt = asyncio.run(idle_latency(target, 2.0, args.ping_interval / 1000.0))
+    kinds = ["download", "upload"] if args.direction == "both" else [args.direction]
+    reports = []
+    for clients in args.clients:
+        for kind in kinds:
+            report = run_phase(args, target, kind, clients, server_pid, idle_rtt)
+            report["label"] = label
+            print_report(label, report)
+            reports.append(report)
+    return reports
+
+
+def parse_list(value: str) -> list:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m py.loadgen", description="LocalSpeed PRO - generator obciążenia")
+    parser.add_argument("url", nargs="?", help="Adres działającego serwera (pomijany z --spawn-workers)")
+    parser.add_argument("--clients", type=parse_list, default=[1, 4], help="Liczby klientów, np. 1,4,8")
+    parser.add_argument("--streams", type=int, default=16, help="Strumienie na klienta (jak tryb Multi)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Czas fazy w sekundach")
+    parser.add_argument("--direction", choices=("download", "upload", "both"), default="both")
+    parser.add_argument("--ping-interval", type=float, default=100.0, help="Odstęp sond /api/ws/ping (ms)")
+    parser.add_argument("--procs", type=int, help="Liczba procesów generatora (domyślnie liczba rdzeni)")
+    parser.add_argument("--server-pid", type=int, help="PID głównego procesu serwera (pomiar CPU)")
+    parser.add_argument("--spawn-workers", type=parse_list, help="Uruchom lokalny uvicorn z podaną liczbą workerów, np. 1,2,4")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Zmienne środowiska dla uruchamianego serwera")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--json", help="Zapisz raport (JSON) do pliku")
+    args = parser.parse_args(argv)
+
+    if not args.url and not args.spawn_workers:
+        parser.error("podaj adres serwera albo --spawn-workers")
+
+    env_overrides = dict(item.split("=", 1) for item in args.env)
+    reports = []
+    try:
+        if args.spawn_workers:
+            for workers in args.spawn_workers:
+                with LocalServer(workers, env_overrides) as server:
+                    reports += run_against(args, server.url, server.process.pid, f"[workers={workers}]")
+        else:
+            reports += run_against(args, args.url, args.server_pid, "")
+    except (RuntimeError, urllib.error.URLError, ConnectionError, OSError) as e:
+        print(f"Błąd: {e}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"env": env_overrides, "runs": reports}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
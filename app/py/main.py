@@ -2,7 +2,7 @@ import os
 import sys
 import logging
 from logging.handlers import RotatingFileHandler  # IMPORT: Niezbędny do rotacji
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -13,11 +13,16 @@ from .database import STATIC_DIR
 from .settings_api import router as settings_router
 from .history_api import router as history_router
 from .speedtest_api import router as speedtest_router
-from .auth import router as auth_router, COOKIE_NAME
+from .auth import router as auth_router
 from .backup_api import router as backup_router
 
 # Import Schedulera
 from .scheduler import start_scheduler, stop_scheduler
+from .payload_pool import payload_pool
+from .icmp_prober import icmp_prober
+from .oidc_cache import close_http_client
+from .middleware import AuthMiddleware, DataPlaneBypass
+from .migrations import run_migrations
 
 # --- KONFIGURACJA LOGOWANIA (Rotacja + Konsola + Uvicorn) ---
 BASE_DIR = "/app"
@@ -87,17 +92,34 @@ if not AUTH_ENABLED:
 async def startup_event():
     # Testowy wpis
     logger.info(f"=== SYSTEM LOGOWANIA START (Limit: 5MB, Backupy: 3) ===")
+    # Migracje schematu - raz na wdrożenie, pod blokadą (zanim worker przyjmie ruch).
+    # Błąd przerywa start workera - nie obsługujemy ruchu na niezmigrowanej bazie.
+    try:
+        version = run_migrations()
+        logger.info(f"Schemat bazy danych w wersji {version}.")
+    except Exception as e:
+        logger.critical(f"Błąd migracji bazy danych: {e}")
+        raise
+    # Mapujemy pulę danych testowych przed pierwszym żądaniem /api/download
+    try:
+        payload_pool.open()
+    except Exception as e:
+        logger.error(f"Błąd inicjalizacji puli danych testowych: {e}")
     start_scheduler()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Zatrzymywanie aplikacji...")
     stop_scheduler()
+    icmp_prober.close()
+    await close_http_client()
 
 SECRET_KEY = os.getenv("APP_SECRET", "dev_secret_key_fixed_12345")
 
+# Sesja (OIDC) i CORS nie są potrzebne trasom płaszczyzny danych - patrz middleware.py
 app.add_middleware(
-    SessionMiddleware, 
+    DataPlaneBypass,
+    middleware=SessionMiddleware,
     secret_key=SECRET_KEY, 
     max_age=3600,
     https_only=False, 
@@ -105,46 +127,17 @@ app.add_middleware(
 )
 
 app.add_middleware(
-    CORSMiddleware,
+    DataPlaneBypass,
+    middleware=CORSMiddleware,
+    same_origin_only=True,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# --- MIDDLEWARE AUTORYZACJI ---
-@app.middleware("http")
-async def auth_middleware(request: Request, call_next):
-    if not AUTH_ENABLED:
-        return await call_next(request)
-
-    public_paths = [
-        "/login.html", 
-        "/api/login", 
-        "/api/auth/oidc",
-        "/api/auth/status",
-        "/css", 
-        "/js", 
-        "/favicon.ico"
-    ]
-    path = request.url.path
-    is_public = any(path.startswith(p) for p in public_paths)
-    if is_public:
-        return await call_next(request)
-    
-    token = request.cookies.get(COOKIE_NAME)
-    if token != "authorized":
-        if path.startswith("/api"):
-             from fastapi.responses import JSONResponse
-             return JSONResponse(status_code=401, content={"detail": "Unauthorized"})
-        else:
-             return RedirectResponse("/login.html")
-             
-    response = await call_next(request)
-    
-    if response.status_code == 401:
-        response.delete_cookie(COOKIE_NAME)
-    return response
+# Middleware autoryzacji (czyste ASGI) - dodany jako ostatni, więc działa jako pierwszy
+app.add_middleware(AuthMiddleware)
 
 app.include_router(settings_router)
 app.include_router(history_router)
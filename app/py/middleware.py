@@ -0,0 +1,138 @@
+# Moduł z middleware ASGI aplikacji (autoryzacja i szybka ścieżka płaszczyzny danych).
+#
+# Oba middleware to czyste aplikacje ASGI (bez BaseHTTPMiddleware), więc
+# strumienie odpowiedzi przechodzą bez ponownego opakowywania i kopiowania.
+# Trasy płaszczyzny danych (/api/download, /api/upload, /api/ws/..., /api/ping)
+# nie potrzebują sesji ani nagłówków CORS dla żądań z tej samej domeny -
+# DataPlaneBypass pomija dla nich opakowany middleware (SessionMiddleware
+# nie dekoduje i nie podpisuje ponownie ciasteczka przy każdym żądaniu).
+#
+# ASGI_FAST_PATH=false wyłącza szybką ścieżkę (pełny stos dla każdego żądania),
+# żeby zysk można było zmierzyć, np.:
+#   python -m py.loadgen --spawn-workers 4 --env ASGI_FAST_PATH=false
+
+import os
+import hmac
+from starlette.requests import cookie_parser
+from starlette.responses import JSONResponse, RedirectResponse, Response
+from starlette.datastructures import MutableHeaders
+from .auth import AUTH_ENABLED, COOKIE_NAME
+from .hub import INGEST_TOKEN
+
+FAST_PATH_ENABLED = os.getenv("ASGI_FAST_PATH", "true").lower() == "true"
+
+# --- TABELA TRAS (prekompilowana: krotki dla str.startswith, zbiór dla dokładnych ścieżek) ---
+PUBLIC_PREFIXES = (
+    "/login.html",
+    "/api/login",
+    "/api/auth/oidc",
+    "/api/auth/status",
+    "/css",
+    "/js",
+    "/favicon.ico",
+)
+DATA_PLANE_PREFIXES = ("/api/download", "/api/upload", "/api/ws/")
+DATA_PLANE_PATHS = frozenset(("/api/ping", "/api/ping_icmp"))
+# Trasy dostępne także z tokenem INGEST_TOKEN (instancje edge wysyłające do huba)
+TOKEN_PATHS = frozenset(("/api/history/batch",))
+
+_cookie_cleaner = Response()
+_cookie_cleaner.delete_cookie(COOKIE_NAME)
+DELETE_COOKIE_HEADER = _cookie_cleaner.headers["set-cookie"]
+COOKIE_MARKER = COOKIE_NAME.encode()
+
+
+def is_data_plane(path: str) -> bool:
+    return path in DATA_PLANE_PATHS or path.startswith(DATA_PLANE_PREFIXES)
+
+
+def is_authorized(scope) -> bool:
+    """Sprawdza ciasteczko sesji bezpośrednio w surowych nagłówkach (bez obiektu Request)."""
+    for name, value in scope["headers"]:
+        if name == b"cookie" and COOKIE_MARKER in value:
+            if cookie_parser(value.decode("latin-1")).get(COOKIE_NAME) == "authorized":
+                return True
+    return False
+
+
+def has_ingest_token(scope) -> bool:
+    """Nagłówek "Authorization: Bearer <INGEST_TOKEN>" (porównanie w stałym czasie)."""
+    if not INGEST_TOKEN:
+        return False
+    expected = f"Bearer {INGEST_TOKEN}".encode()
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            return hmac.compare_digest(value, expected)
+    return False
+
+
+def is_same_origin(scope) -> bool:
+    """True, gdy żądanie nie ma nagłówka Origin lub pochodzi z tego samego hosta."""
+    origin = host = None
+    for name, value in scope["headers"]:
+        if name == b"origin":
+            origin = value
+        elif name == b"host":
+            host = value
+    if origin is None:
+        return True
+    return host is not None and origin.partition(b"://")[2] == host
+
+
+class AuthMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not AUTH_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path.startswith(PUBLIC_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        if not is_authorized(scope) and not (path in TOKEN_PATHS and has_ingest_token(scope)):
+            if path.startswith("/api"):
+                response = JSONResponse(status_code=401, content={"detail": "Unauthorized"})
+            else:
+                response = RedirectResponse("/login.html")
+            await response(scope, receive, send)
+            return
+
+        if FAST_PATH_ENABLED and is_data_plane(path):
+            # Trasy danych nie zwracają 401 - bez opakowywania send
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] == 401:
+                MutableHeaders(scope=message).append("set-cookie", DELETE_COOKIE_HEADER)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class DataPlaneBypass:
+    """
+    Opakowuje middleware (np. SessionMiddleware, CORSMiddleware) i pomija go
+    dla tras płaszczyzny danych. Z same_origin_only=True pomija tylko żądania
+    z tej samej domeny (odpowiedzi cross-origin nadal dostają nagłówki CORS).
+    """
+
+    def __init__(self, app, middleware, same_origin_only: bool = False, **options):
+        self.app = app
+        self.wrapped = middleware(app, **options)
+        self.same_origin_only = same_origin_only
+
+    async def __call__(self, scope, receive, send):
+        if (
+            FAST_PATH_ENABLED
+            and scope["type"] in ("http", "websocket")
+            and is_data_plane(scope["path"])
+            and (not self.same_origin_only or is_same_origin(scope))
+        ):
+            await self.app(scope, receive, send)
+            return
+        await self.wrapped(scope, receive, send)
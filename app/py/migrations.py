@@ -0,0 +1,281 @@
+# Moduł odpowiedzialny za wersjonowane migracje schematu bazy danych.
+#
+# Zastępuje sprawdzanie kolumn przy każdym żądaniu (ensure_columns) i przy
+# imporcie modułu w każdym workerze (ensure_results_columns).
+# Migracje to uporządkowana lista kroków (wersja, nazwa, funkcja). Zastosowane
+# wersje zapisujemy w tabeli schema_version, więc każdy krok wykonuje się
+# raz na wdrożenie. run_migrations() wołamy w startup_event - przed przyjęciem
+# ruchu przez workera - pod blokadą międzyprocesową:
+#   - MySQL/MariaDB: GET_LOCK() (działa także między kontenerami),
+#   - SQLite: flock na pliku obok bazy.
+# Pierwszy worker wykonuje migracje, pozostałe czekają i widzą aktualny schemat.
+#
+# Nowy krok = nowa funkcja + wpis na końcu MIGRATIONS (wersje tylko rosną).
+# Kroki powinny być idempotentne (np. add_column sprawdza, czy kolumna istnieje),
+# bo starsze instalacje mogły mieć część zmian sprzed wprowadzenia wersjonowania.
+
+import datetime
+import logging
+from contextlib import contextmanager
+from sqlalchemy import text, inspect, select, bindparam, MetaData, Float
+from sqlalchemy.schema import CreateTable
+from .database import engine, DB_TYPE, DB_SQLITE_PATH, SchemaVersion, SpeedResult, ResultRollup, IngestBatch, HubPushState
+from . import rollups
+
+logger = logging.getLogger("Migrations")
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+LOCK_NAME = "localspeed_migrations"
+LOCK_WAIT_STEP = 30   # s - co tyle logujemy, że czekamy na blokadę (czekamy bez limitu)
+BACKFILL_BATCH = 5000
+# Kolumny sortowania historii - NOT NULL z wartością domyślną (migracja 7)
+RESULT_NOT_NULL = ("ping", "download", "upload", "jitter", "mode")
+
+
+# --- NARZĘDZIA DLA KROKÓW ---
+
+def add_column(conn, table: str, column: str, ddl: str):
+    """Dodaje kolumnę, jeśli jej brakuje (ALTER TABLE działa w MySQL i SQLite)."""
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return
+    existing = {col["name"] for col in inspector.get_columns(table)}
+    if column not in existing:
+        logger.info(f"Migracja: Dodawanie kolumny '{column}' do tabeli {table}...")
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def add_index(conn, table: str, name: str, columns: list):
+    """Tworzy indeks, jeśli go brakuje."""
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return
+    if name not in {idx["name"] for idx in inspector.get_indexes(table)}:
+        logger.info(f"Migracja: Tworzenie indeksu '{name}' na tabeli {table}...")
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+
+
+def drop_index(conn, table: str, name: str):
+    inspector = inspect(conn)
+    if inspector.has_table(table) and name in {idx["name"] for idx in inspector.get_indexes(table)}:
+        logger.info(f"Migracja: Usuwanie indeksu '{name}' z tabeli {table}...")
+        if DB_TYPE == "mysql":
+            conn.execute(text(f"DROP INDEX {name} ON {table}"))
+        else:
+            conn.execute(text(f"DROP INDEX {name}"))
+
+
+def parse_result_date(value):
+    """Tekst z kolumny results.date -> datetime (nieczytelne daty -> początek epoki)."""
+    try:
+        return datetime.datetime.strptime(str(value).strip()[:19], "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return datetime.datetime(1970, 1, 1)
+
+
+def backfill_created_at(conn, batch_size: int = BACKFILL_BATCH) -> int:
+    """
+    Uzupełnia results.created_at na podstawie tekstowej kolumny date, partiami
+    po kluczu głównym (bez wczytywania całej tabeli). Zwraca liczbę wierszy.
+    Używane przez migrację 4 i po przywróceniu backupu (stare zrzuty nie mają created_at).
+    """
+    results = SpeedResult.__table__
+    update = results.update().where(results.c.id == bindparam("row_id")).values(created_at=bindparam("ts"))
+    last_id, total = 0, 0
+    while True:
+        rows = conn.execute(
+            select(results.c.id, results.c.date)
+            .where(results.c.id > last_id, results.c.created_at.is_(None))
+            .order_by(results.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return total
+        conn.execute(update, [{"row_id": row_id, "ts": parse_result_date(date)} for row_id, date in rows])
+        last_id = rows[-1][0]
+        total += len(rows)
+
+
+# --- KROKI MIGRACJI ---
+
+def m001_settings_columns(conn):
+    """Kolumny ustawień dodawane wcześniej przez ensure_columns()."""
+    add_column(conn, "settings", "unit", "VARCHAR(10) DEFAULT 'mbps'")
+    add_column(conn, "settings", "primary_color", "VARCHAR(20) DEFAULT '#6200ea'")
+    add_column(conn, "settings", "oidc_enabled", "BOOLEAN DEFAULT 0")
+    add_column(conn, "settings", "oidc_discovery_url", "VARCHAR(255) DEFAULT ''")
+    add_column(conn, "settings", "oidc_client_id", "VARCHAR(255) DEFAULT ''")
+    add_column(conn, "settings", "oidc_client_secret", "VARCHAR(255) DEFAULT ''")
+    add_column(conn, "settings", "gdrive_enabled", "BOOLEAN DEFAULT 0")
+    add_column(conn, "settings", "gdrive_client_id", "VARCHAR(255) DEFAULT ''")
+    add_column(conn, "settings", "gdrive_client_secret", "VARCHAR(255) DEFAULT ''")
+    add_column(conn, "settings", "gdrive_folder_name", "VARCHAR(255) DEFAULT 'LocalSpeed_Backup'")
+    add_column(conn, "settings", "gdrive_backup_frequency", "INTEGER DEFAULT 1")
+    add_column(conn, "settings", "gdrive_backup_time", "VARCHAR(10) DEFAULT '04:00'")
+    add_column(conn, "settings", "gdrive_retention_days", "INTEGER DEFAULT 7")
+    add_column(conn, "settings", "gdrive_last_backup", "VARCHAR(50) DEFAULT ''")
+    add_column(conn, "settings", "gdrive_status", "VARCHAR(255) DEFAULT ''")
+    add_column(conn, "settings", "gdrive_token_json", "VARCHAR(4000) DEFAULT ''")
+
+
+def m002_results_columns(conn):
+    """Kolumny wyników dodawane wcześniej przez ensure_results_columns()."""
+    add_column(conn, "results", "mode", "VARCHAR(10) DEFAULT 'Multi'")
+    add_column(conn, "results", "jitter", "FLOAT DEFAULT 0.0")
+    add_column(conn, "results", "ping_download", "FLOAT DEFAULT 0.0")
+    add_column(conn, "results", "ping_upload", "FLOAT DEFAULT 0.0")
+
+
+def m003_results_sort_indexes(conn):
+    """Indeksy (kolumna, id) pod sortowanie i paginację kursorem historii."""
+    if not inspect(conn).has_table("results"):
+        return
+    # Paginacja kursorem nie obsługuje NULL w kolumnach sortowania - uzupełniamy stare wiersze
+    conn.execute(text("UPDATE results SET mode = 'Multi' WHERE mode IS NULL"))
+    for column in ("ping", "download", "upload", "jitter"):
+        conn.execute(text(f"UPDATE results SET {column} = 0 WHERE {column} IS NULL"))
+    for column in ("date", "ping", "download", "upload", "jitter", "mode"):
+        add_index(conn, "results", f"ix_results_{column}_id", [column, "id"])
+
+
+def m004_results_created_at(conn):
+    """Natywna kolumna czasu (DATETIME) z indeksem (created_at, id)."""
+    if not inspect(conn).has_table("results"):
+        return
+    add_column(conn, "results", "created_at", "DATETIME")
+    count = backfill_created_at(conn)
+    if count:
+        logger.info(f"Migracja: Uzupełniono created_at dla {count} wierszy.")
+    add_index(conn, "results", "ix_results_created_at_id", ["created_at", "id"])
+    # Sortowanie po dacie korzysta teraz z created_at
+    drop_index(conn, "results", "ix_results_date_id")
+
+
+def m005_results_rollup(conn):
+    """Tabela agregatów godzinowych / dziennych i jej wypełnienie z surowych wyników."""
+    ResultRollup.__table__.create(bind=conn, checkfirst=True)
+    count = rollups.rebuild(conn)
+    logger.info(f"Migracja: Przeliczono rollupy z {count} wyników.")
+
+
+def m006_hub_ingest(conn):
+    """Źródło wyniku (source_node), klucze idempotencji partii i kursor wysyłki do huba."""
+    add_column(conn, "results", "source_node", "VARCHAR(64)")
+    IngestBatch.__table__.create(bind=conn, checkfirst=True)
+    HubPushState.__table__.create(bind=conn, checkfirst=True)
+
+
+def m007_results_not_null(conn):
+    """Kolumny sortowania wyników jako NOT NULL z wartością domyślną (jak w modelu)."""
+    inspector = inspect(conn)
+    if not inspector.has_table("results"):
+        return
+    nullable = [col["name"] for col in inspector.get_columns("results") if col["name"] in RESULT_NOT_NULL and col["nullable"]]
+    if not nullable:
+        return  # baza założona już z aktualnego modelu
+    results = SpeedResult.__table__
+    for name in nullable:
+        column = results.c[name]
+        conn.execute(results.update().where(column.is_(None)).values({name: column.default.arg}))
+
+    logger.info(f"Migracja: NOT NULL dla kolumn {', '.join(nullable)} tabeli results...")
+    if DB_TYPE == "mysql":
+        changes = []
+        for name in nullable:
+            column = results.c[name]
+            default = column.server_default.arg
+            literal = default if isinstance(column.type, Float) else f"'{default}'"
+            changes.append(f"MODIFY {name} {column.type.compile(dialect=conn.dialect)} NOT NULL DEFAULT {literal}")
+        conn.execute(text(f"ALTER TABLE results {', '.join(changes)}"))
+        return
+
+    # SQLite nie zmienia definicji kolumn - przebudowa tabeli według modelu
+    # (indeksy znikają razem ze starą tabelą, zakładamy je od nowa)
+    rebuilt = results.to_metadata(MetaData(), name="results_new")
+    columns = ", ".join(col.name for col in results.columns)
+    conn.execute(CreateTable(rebuilt))
+    conn.execute(text(f"INSERT INTO results_new ({columns}) SELECT {columns} FROM results"))
+    conn.execute(text("DROP TABLE results"))
+    conn.execute(text("ALTER TABLE results_new RENAME TO results"))
+    for index in results.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "settings_columns", m001_settings_columns),
+    (2, "results_columns", m002_results_columns),
+    (3, "results_sort_indexes", m003_results_sort_indexes),
+    (4, "results_created_at", m004_results_created_at),
+    (5, "results_rollup", m005_results_rollup),
+    (6, "hub_ingest", m006_hub_ingest),
+    (7, "results_not_null", m007_results_not_null),
+]
+
+
+# --- BLOKADA MIĘDZYPROCESOWA ---
+
+@contextmanager
+def migration_lock():
+    if DB_TYPE == "mysql":
+        with engine.connect() as lock_conn:
+            # Migracja dużej tabeli (backfill, rollupy) może trwać dłużej niż
+            # dowolny stały limit - czekamy, aż pierwszy worker skończy.
+            waited = 0
+            while True:
+                acquired = lock_conn.execute(text("SELECT GET_LOCK(:name, :timeout)"), {"name": LOCK_NAME, "timeout": LOCK_WAIT_STEP}).scalar()
+                if acquired == 1:
+                    break
+                if acquired is None:
+                    raise RuntimeError("Nie udało się uzyskać blokady migracji (GET_LOCK)")
+                waited += LOCK_WAIT_STEP
+                logger.info(f"Czekam na blokadę migracji (trwa migracja w innym procesie, {waited} s)...")
+            try:
+                yield
+            finally:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+        return
+
+    lock_handle = open(DB_SQLITE_PATH + ".migrate.lock", "w")
+    try:
+        if HAS_FCNTL:
+            fcntl.flock(lock_handle, fcntl.LOCK_EX)
+        yield
+    finally:
+        lock_handle.close()
+
+
+# --- URUCHAMIANIE ---
+
+def current_version(conn) -> int:
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar() or 0
+
+
+def run_migrations() -> int:
+    """Wykonuje brakujące kroki migracji. Zwraca aktualną wersję schematu."""
+    with migration_lock():
+        SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+        with engine.connect() as conn:
+            version = current_version(conn)
+
+        for step_version, name, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+            logger.info(f"Migracja {step_version}: {name}...")
+            # Każdy krok w osobnej transakcji, razem z wpisem do schema_version
+            with engine.begin() as conn:
+                step(conn)
+                conn.execute(
+                    SchemaVersion.__table__.insert().values(
+                        version=step_version,
+                        name=name,
+                        applied_at=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    )
+                )
+            version = step_version
+
+        return version
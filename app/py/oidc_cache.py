@@ -0,0 +1,111 @@
+# Moduł pomocniczy dla logowania OIDC: wspólny klient HTTP i cache dokumentów.
+#
+# Jeden httpx.AsyncClient na proces (pula połączeń keep-alive do dostawcy
+# tożsamości) zamiast nowego klienta i nowego połączenia TLS przy każdym
+# kroku logowania. Dokument discovery (.well-known) i klucze JWKS trzymamy
+# w pamięci z TTL. Nieznany "kid" w tokenie (rotacja kluczy u dostawcy)
+# wymusza ponowne pobranie JWKS - nie częściej niż co JWKS_MIN_REFRESH sekund,
+# żeby tokeny ze śmieciowym kid nie zamieniły nas w generator ruchu.
+
+import time
+import asyncio
+import logging
+import httpx
+import jwt  # PyJWT
+
+logger = logging.getLogger("OidcCache")
+
+HTTP_TIMEOUT = 10.0
+DISCOVERY_TTL = 3600
+JWKS_TTL = 3600
+JWKS_MIN_REFRESH = 60
+
+_http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Wspólny klient HTTP (tworzony leniwie w pętli zdarzeń workera)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=5),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class OidcCache:
+    def __init__(self):
+        self._discovery = {}  # url -> (pobrano, config)
+        self._jwks = {}       # jwks_uri -> (pobrano, PyJWKSet)
+        self._jwks_forced = {}  # jwks_uri -> czas ostatniego wymuszonego odświeżenia
+        self._lock = asyncio.Lock()
+
+    async def _fetch_json(self, url: str) -> dict:
+        resp = await get_http_client().get(url)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def discovery(self, url: str) -> dict:
+        """Dokument .well-known/openid-configuration (z cache)."""
+        entry = self._discovery.get(url)
+        if entry and time.monotonic() - entry[0] < DISCOVERY_TTL:
+            return entry[1]
+        async with self._lock:
+            entry = self._discovery.get(url)
+            if entry and time.monotonic() - entry[0] < DISCOVERY_TTL:
+                return entry[1]
+            config = await self._fetch_json(url)
+            self._discovery[url] = (time.monotonic(), config)
+            logger.info(f"Pobrano konfigurację OIDC: {url}")
+            return config
+
+    async def _load_jwks(self, jwks_uri: str, force: bool = False):
+        async with self._lock:
+            now = time.monotonic()
+            entry = self._jwks.get(jwks_uri)
+            if entry:
+                if force:
+                    if now - self._jwks_forced.get(jwks_uri, -JWKS_MIN_REFRESH) < JWKS_MIN_REFRESH:
+                        return entry[1]
+                    self._jwks_forced[jwks_uri] = now
+                elif now - entry[0] < JWKS_TTL:
+                    return entry[1]
+            keyset = jwt.PyJWKSet.from_dict(await self._fetch_json(jwks_uri))
+            self._jwks[jwks_uri] = (time.monotonic(), keyset)
+            logger.info(f"Pobrano klucze JWKS ({len(keyset.keys)}): {jwks_uri}")
+            return keyset
+
+    async def signing_key(self, jwks_uri: str, id_token: str) -> jwt.PyJWK:
+        """Klucz do weryfikacji podpisu tokenu (po "kid" z nagłówka)."""
+        kid = jwt.get_unverified_header(id_token).get("kid")
+        keyset = await self._load_jwks(jwks_uri)
+        key = find_key(keyset, kid)
+        if key is None:
+            # Nieznany kid - dostawca mógł zrotować klucze
+            keyset = await self._load_jwks(jwks_uri, force=True)
+            key = find_key(keyset, kid)
+        if key is None:
+            raise jwt.PyJWKClientError(f"Nie znaleziono klucza podpisu (kid={kid})")
+        return key
+
+
+def find_key(keyset, kid):
+    if kid is None:
+        # Token bez kid - dopuszczalne tylko przy jednym kluczu podpisu
+        signing = [k for k in keyset.keys if k.public_key_use in (None, "sig")]
+        return signing[0] if len(signing) == 1 else None
+    for key in keyset.keys:
+        if key.key_id == kid:
+            return key
+    return None
+
+
+oidc_cache = OidcCache()
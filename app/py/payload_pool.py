@@ -0,0 +1,250 @@
+# Moduł odpowiedzialny za współdzieloną pulę danych testowych (Download).
+#
+# Zamiast trzymać osobny blok os.urandom() w każdym workerze uvicorna,
+# generujemy jeden plik z losowymi danymi w STATIC_DIR i mapujemy go (mmap)
+# w trybie tylko do odczytu. Strony pamięci są współdzielone przez wszystkie
+# procesy (page cache), a kolejne fragmenty odpowiedzi to wycinki memoryview,
+# więc w Pythonie nie kopiujemy ani jednego bajtu danych testowych.
+
+import os
+import re
+import mmap
+import time
+import random
+import asyncio
+import logging
+from starlette.responses import Response
+from .database import STATIC_DIR
+
+logger = logging.getLogger("PayloadPool")
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# --- KONFIGURACJA PULI ---
+PAYLOAD_FILE = os.path.join(STATIC_DIR, "payload_pool.bin")
+PAYLOAD_SIZE = max(1, int(os.getenv("PAYLOAD_POOL_MB", "64"))) * 1024 * 1024
+
+# Rozmiar pojedynczego fragmentu wysyłanego do serwera (ASGI send)
+DEFAULT_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_KB", "1024")) * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = min(16 * 1024 * 1024, PAYLOAD_SIZE)
+
+# Limity /api/download: rozmiar (tryb "size") i czas strumienia (tryb "duration")
+MAX_DOWNLOAD_SIZE = 1000 * 1024 * 1024
+MIN_STREAM_DURATION = 1.0
+MAX_STREAM_DURATION = 60.0
+
+SIZE_UNITS = {"b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2, "g": 1024 ** 3, "gb": 1024 ** 3}
+SIZE_RE = re.compile(r"^\s*(\d+)\s*([a-z]*)\s*$", re.IGNORECASE)
+DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s)?\s*$", re.IGNORECASE)
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def clamp_chunk_size(chunk_kb: int = None) -> int:
+    """Zwraca rozmiar fragmentu (bajty) ograniczony do bezpiecznego zakresu."""
+    size = chunk_kb * 1024 if chunk_kb else DEFAULT_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(size, MAX_CHUNK_SIZE))
+
+
+def parse_size(value: str) -> int:
+    """
+    Rozmiar odpowiedzi w bajtach. Sama liczba oznacza MB (jak dotychczas),
+    sufiksy: b, k/kb, m/mb, g/gb (np. "1500000b", "512k"). Wynik obcięty do MAX_DOWNLOAD_SIZE.
+    """
+    match = SIZE_RE.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    number, unit = int(match.group(1)), match.group(2).lower()
+    if unit and unit not in SIZE_UNITS:
+        raise ValueError(f"Invalid size unit: {unit}")
+    size = number * SIZE_UNITS[unit] if unit else number * 1024 * 1024
+    return max(1, min(size, MAX_DOWNLOAD_SIZE))
+
+
+def parse_duration(value: str) -> float:
+    """Czas strumienia w sekundach ("12s", "12", "500ms"), obcięty do dozwolonego zakresu."""
+    match = DURATION_RE.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid duration: {value}")
+    seconds = float(match.group(1))
+    if (match.group(2) or "s").lower() == "ms":
+        seconds /= 1000.0
+    return max(MIN_STREAM_DURATION, min(seconds, MAX_STREAM_DURATION))
+
+
+def parse_range(header: str, total_bytes: int):
+    """
+    Nagłówek Range (pojedynczy zakres bajtów) -> (start, end) włącznie.
+    Zwraca None, gdy nagłówek jest nieobsługiwany (odpowiadamy wtedy całością),
+    rzuca ValueError, gdy zakresu nie da się spełnić (416).
+    """
+    match = RANGE_RE.match(header.strip().replace(" ", ""))
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.group(1), match.group(2)
+    if not first:
+        # "bytes=-N" - ostatnie N bajtów
+        length = int(last)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, total_bytes - length), total_bytes - 1
+    start = int(first)
+    end = min(int(last), total_bytes - 1) if last else total_bytes - 1
+    if start >= total_bytes or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+class PayloadPool:
+    """
+    Pula losowych danych zmapowana w pamięci i współdzielona przez workery.
+    Plik tworzony jest jednorazowo (pod blokadą), kolejne procesy tylko go mapują.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._file = None
+        self._mmap = None
+        self._view = None
+
+    @property
+    def view(self) -> memoryview:
+        if self._view is None:
+            self.open()
+        return self._view
+
+    @property
+    def file(self):
+        if self._file is None:
+            self.open()
+        return self._file
+
+    def open(self):
+        if self._view is not None:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        lock_handle = open(self.path + ".lock", "w")
+        try:
+            if HAS_FCNTL:
+                # Blokada wyłączna: tylko pierwszy worker generuje plik, reszta czeka i go mapuje
+                fcntl.flock(lock_handle, fcntl.LOCK_EX)
+            self._ensure_file()
+        finally:
+            lock_handle.close()
+
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        logger.info(f"Pula danych testowych zmapowana: {self.path} ({self.size // (1024 * 1024)} MB)")
+
+    def _ensure_file(self):
+        try:
+            if os.path.getsize(self.path) == self.size:
+                return
+        except OSError:
+            pass
+
+        logger.info(f"Generowanie puli danych testowych ({self.size // (1024 * 1024)} MB)...")
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        block = 1024 * 1024
+        with open(tmp_path, "wb") as f:
+            written = 0
+            while written < self.size:
+                n = min(block, self.size - written)
+                f.write(os.urandom(n))
+                written += n
+        # Atomowa podmiana - żaden proces nie zobaczy niepełnego pliku
+        os.replace(tmp_path, self.path)
+
+    def segments(self, total_bytes, chunk_size: int, offset: int = 0):
+        """
+        Generator par (offset, długość) o łącznej długości total_bytes (None = bez końca).
+        Bajt i odpowiedzi to zawsze bajt (offset + i) % size puli, więc treść
+        jest jednoznaczna i zakresy (Range) do siebie pasują.
+        """
+        chunk_size = min(chunk_size, self.size)
+        offset %= self.size
+        remaining = total_bytes
+        while remaining is None or remaining > 0:
+            n = min(chunk_size, self.size - offset)
+            if remaining is not None:
+                n = min(n, remaining)
+                remaining -= n
+            yield offset, n
+            offset = (offset + n) % self.size
+
+    def slices(self, total_bytes, chunk_size: int, offset: int = 0):
+        """Generator wycinków memoryview - patrz segments()."""
+        view = self.view
+        for start, n in self.segments(total_bytes, chunk_size, offset):
+            yield view[start:start + n]
+
+
+payload_pool = PayloadPool(PAYLOAD_FILE, PAYLOAD_SIZE)
+
+
+class PayloadResponse(Response):
+    """
+    Odpowiedź ASGI wysyłająca dane bezpośrednio z puli (bez generatora w threadpoolu).
+    Tryby: total_bytes (z Content-Length) albo duration - strumień (chunked)
+    wysyłany aż do upływu zadanego czasu.
+    Jeśli serwer obsługuje rozszerzenie 'http.response.zerocopysend',
+    dane idą przez os.sendfile() prosto z pliku puli.
+    """
+    media_type = "application/octet-stream"
+
+    def __init__(self, total_bytes: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE, status_code: int = 200,
+                 headers: dict = None, counter=None, offset: int = None, duration: float = None):
+        self.total_bytes = None if duration is not None else total_bytes
+        self.chunk_size = chunk_size
+        self.counter = counter
+        self.duration = duration
+        # Bez podanego przesunięcia zaczynamy w losowym miejscu puli
+        self.offset = offset if offset is not None else random.randrange(0, payload_pool.size, MIN_CHUNK_SIZE)
+        self.status_code = status_code
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        disconnected = False
+
+        async def watch_disconnect():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    return
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        deadline = time.monotonic() + self.duration if self.duration is not None else None
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") != "HEAD":
+                zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+                # Przy stałym rozmiarze sendfile może wysyłać całą pulę naraz
+                chunk_size = payload_pool.size if zerocopy and deadline is None else self.chunk_size
+                file = payload_pool.file if zerocopy else None
+                view = None if zerocopy else payload_pool.view
+                counter = self.counter
+                for start, n in payload_pool.segments(self.total_bytes, chunk_size, self.offset):
+                    if disconnected or (deadline is not None and time.monotonic() >= deadline):
+                        break
+                    if zerocopy:
+                        await send({"type": "http.response.zerocopysend", "file": file, "offset": start, "count": n, "more_body": True})
+                    else:
+                        await send({"type": "http.response.body", "body": view[start:start + n], "more_body": True})
+                    if counter is not None:
+                        counter.add(n)
+                if disconnected:
+                    return
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            watcher.cancel()
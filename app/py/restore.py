@@ -0,0 +1,273 @@
+# Moduł odpowiedzialny za przywracanie backupu SQL (strumieniowo, w tle).
+#
+# Plik (.sql lub .sql.gz) czytamy fragmentami po READ_CHUNK znaków. Kilka plików
+# (łańcuch: pełna kopia + segmenty przyrostowe) wczytujemy po kolei w tej samej transakcji.
+# split_statements() dzieli tekst na instrukcje po średnikach spoza literałów
+# i komentarzy, parse_insert() rozbiera INSERT na wiersze wartości, a wiersze
+# zapisujemy partiami po RESTORE_BATCH przez executemany. Pamięć zależy od
+# wielkości partii, nie od wielkości pliku.
+#
+# Całość działa jako zadanie w tle (jobs.py), w jednej transakcji: błąd w połowie pliku
+# to rollback i baza zostaje bez zmian. Przyjmujemy tylko INSERT INTO do tabel
+# z RESTORE_TABLES, a kolumny sprawdzamy z modelem, więc plik nie wykona
+# dowolnego SQL.
+#
+# Postęp (etap, wiersze, przeczytane bajty) trafia do stanu zadania -
+# GET /api/jobs/{id} odczyta go w każdym workerze, nie tylko w tym, który przyjął plik.
+
+import os
+import io
+import re
+import gzip
+import time
+import logging
+import functools
+from sqlalchemy import delete, Integer, Boolean
+from .database import DB_TYPE, engine, Settings, SpeedResult, results_version
+from .settings_cache import settings_cache
+from .jobs import JobProgress, start_job
+from .migrations import backfill_created_at
+from . import rollups
+
+logger = logging.getLogger("Restore")
+
+READ_CHUNK = 1024 * 1024      # znaków czytanych naraz
+RESTORE_BATCH = 5000          # wierszy w jednym executemany
+
+RESTORE_TABLES = {table.name: table for table in (Settings.__table__, SpeedResult.__table__)}
+
+# Instrukcja do średnika: zwykłe znaki, literały '...' / "..." (cudzysłów podwajany)
+# i komentarze. Niezamknięty literał lub komentarz zatrzymuje dopasowanie przed sobą,
+# więc na granicy fragmentu pliku czekamy na dalszą część zamiast ciąć w środku.
+STATEMENT_RE = re.compile(r"""(?:[^;'"/-]+|'[^']*(?:''[^']*)*'|"[^"]*(?:""[^"]*)*"|--[^\n]*\n|/\*.*?\*/|-(?!-)|/(?!\*))*""", re.S)
+# Białe znaki i komentarze (przed instrukcją i po niej)
+SKIP_RE = re.compile(r"(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.S)
+INSERT_RE = re.compile(r"INSERT\s+INTO\s+[`\"]?(\w+)[`\"]?\s*\(([^)]*)\)\s*VALUES\s*", re.I)
+# Jedna wartość z listy VALUES: literał tekstowy (grupa 1) albo "goła" liczba / NULL (grupa 2)
+VALUE = r"""\s*(?:'([^']*(?:''[^']*)*)'|([-+.\w]+))\s*"""
+WORDS = {"NULL": None, "TRUE": 1, "FALSE": 0}
+
+
+# --- PARSOWANIE ---
+
+def split_statements(chunks):
+    """Dzieli strumień tekstu (fragmenty) na instrukcje SQL, bez średnika na końcu."""
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+    while True:
+        end = STATEMENT_RE.match(buf, pos).end()
+        if end < len(buf) and buf[end] == ";":
+            yield buf[pos:end]
+            pos = end + 1
+            continue
+        if eof:
+            if end < len(buf):
+                raise ValueError("Niezamknięty literał lub komentarz w pliku SQL")
+            if buf[pos:].strip():
+                yield buf[pos:]  # ostatnia instrukcja bez średnika
+            return
+        chunk = next(chunks, None)
+        eof = chunk is None
+        # Na końcu pliku dokładamy "\n" - zamyka komentarz "--" w ostatniej linii
+        buf = buf[pos:] + ("\n" if eof else chunk)
+        pos = 0
+
+
+def parse_insert(stmt: str):
+    """
+    INSERT INTO tabela (kolumny) VALUES (...), (...) -> (tabela, kolumny, wiersze).
+    Instrukcja złożona z samych komentarzy daje None, inna niż INSERT - ValueError.
+    """
+    start = SKIP_RE.match(stmt).end()
+    if start == len(stmt):
+        return None
+    header = INSERT_RE.match(stmt, start)
+    if not header:
+        raise ValueError(f"Nieobsługiwana instrukcja: {stmt[start:start + 60]!r}")
+
+    table = RESTORE_TABLES.get(header.group(1).lower())
+    if table is None:
+        raise ValueError(f"Nieobsługiwana tabela: {header.group(1)}")
+    columns = tuple(name.strip().strip('`"') for name in header.group(2).split(","))
+    unknown = [name for name in columns if name not in table.c]
+    if unknown:
+        raise ValueError(f"Nieznane kolumny tabeli {table.name}: {', '.join(unknown)}")
+
+    # Wiersze dopasowujemy całe (jedno dopasowanie na wiersz, nie na wartość),
+    # a konwertujemy kolumnami - to najdroższa część przywracania
+    pattern = row_pattern(len(columns))
+    raw, pos = [], header.end()
+    for match in pattern.finditer(stmt, pos):
+        if match.start() != pos:
+            break
+        raw.append(match.groups())
+        pos = match.end()
+    if not raw or SKIP_RE.match(stmt, pos).end() != len(stmt):
+        raise ValueError(f"Niepoprawna lista VALUES w tabeli {table.name} (w pobliżu: {stmt[pos:pos + 60]!r})")
+
+    groups = list(zip(*raw))
+    values = [
+        fill_defaults(table.c[name], column_values(groups[2 * i], groups[2 * i + 1], int if isinstance(table.c[name].type, (Integer, Boolean)) else float))
+        for i, name in enumerate(columns)
+    ]
+    return table, columns, list(zip(*values))
+
+
+@functools.lru_cache(maxsize=8)
+def row_pattern(width: int):
+    return re.compile(r"\s*\(" + ",".join([VALUE] * width) + r"\)\s*(?:,|$)")
+
+
+def column_values(quoted, bare, number) -> list:
+    """Wartości jednej kolumny z grup VALUE - najpierw szybkie ścieżki (same teksty, same NULL, same liczby)."""
+    if not any(bare):
+        return [q.replace("''", "'") for q in quoted]
+    if bare.count("NULL") == len(bare):
+        return [None] * len(bare)
+    try:
+        return list(map(number, bare))
+    except ValueError:
+        return [parse_value(q, b, number) for q, b in zip(quoted, bare)]
+
+
+def fill_defaults(column, values: list) -> list:
+    """NULL w kolumnie NOT NULL (starsze zrzuty) -> wartość domyślna z modelu."""
+    if column.nullable or column.default is None or None not in values:
+        return values
+    return [column.default.arg if value is None else value for value in values]
+
+
+def parse_value(quoted: str, bare: str, number):
+    if not bare:
+        return quoted.replace("''", "'")
+    word = bare.upper()
+    if word in WORDS:
+        return WORDS[word]
+    try:
+        return number(bare)
+    except ValueError:
+        pass
+    try:
+        return float(bare)
+    except ValueError:
+        raise ValueError(f"Niepoprawna wartość: {bare!r}") from None
+
+
+def open_dump(fh):
+    """Plik binarny backupu -> strumień tekstu (gzip rozpoznajemy po nagłówku)."""
+    magic = fh.read(2)
+    fh.seek(0)
+    if magic == b"\x1f\x8b":
+        fh = gzip.GzipFile(fileobj=fh, mode="rb")
+    return io.TextIOWrapper(fh, encoding="utf-8", newline="")
+
+
+# --- PRZYWRACANIE ---
+
+def insert_rows(conn, table, columns, rows):
+    # Bez kompilacji wyrażenia SQLAlchemy i konwersji typów - wartości są już
+    # w postaci, w jakiej trzyma je baza (daty jako tekst, tak jak w zrzucie)
+    mark = "?" if conn.dialect.paramstyle == "qmark" else "%s"
+    quote = conn.dialect.identifier_preparer.quote
+    sql = (f"INSERT INTO {quote(table.name)} ({', '.join(quote(name) for name in columns)}) "
+           f"VALUES ({', '.join([mark] * len(columns))})")
+    conn.exec_driver_sql(sql, rows)
+
+
+def drop_indexes(conn, table_name: str) -> list:
+    """Usuwa indeksy tabeli SQLite (poza automatycznymi), zwraca ich CREATE INDEX."""
+    indexes = conn.exec_driver_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table_name,),
+    ).all()
+    quote = conn.dialect.identifier_preparer.quote
+    for name, _ in indexes:
+        conn.exec_driver_sql(f"DROP INDEX {quote(name)}")
+    return [sql for _, sql in indexes]
+
+
+def restore_dump(files: list, progress: JobProgress):
+    """
+    Wczytuje zrzuty SQL w jednej transakcji (wołane w wątku). Kilka plików to
+    łańcuch backupu: pełna kopia i kolejne segmenty przyrostowe, w tej kolejności.
+    """
+    with engine.begin() as conn:
+        conn.execute(delete(SpeedResult.__table__))
+        conn.execute(delete(Settings.__table__))
+        # SQLite: indeksy wyników zdejmujemy na czas wczytywania i zakładamy na końcu -
+        # jedno sortowanie zamiast aktualizacji każdego indeksu przy każdym wierszu.
+        # DDL w SQLite jest transakcyjne (błąd przywróci indeksy), MySQL zatwierdza DDL od razu
+        indexes = drop_indexes(conn, SpeedResult.__tablename__) if DB_TYPE == "sqlite" else []
+
+        pending, pending_key = [], None
+        statements = rows_total = results = bytes_done = 0
+        fh = None
+
+        def flush():
+            nonlocal rows_total, results
+            if pending:
+                table = pending_key[0]
+                if table is Settings.__table__:
+                    # Każdy segment łańcucha niesie ustawienia - obowiązują te z ostatniego
+                    conn.execute(delete(table))
+                insert_rows(conn, *pending_key, pending)
+                rows_total += len(pending)
+                if table is SpeedResult.__table__:
+                    results += len(pending)
+                pending.clear()
+            progress.update(bytes_read=bytes_done + fh.tell(), statements=statements, rows=rows_total, results=results)
+
+        for fh in files:
+            stream = open_dump(fh)
+            for stmt in split_statements(iter(lambda: stream.read(READ_CHUNK), "")):
+                parsed = parse_insert(stmt)
+                if parsed is None:
+                    continue
+                table, columns, rows = parsed
+                statements += 1
+                if (table, columns) != pending_key:
+                    flush()
+                    pending_key = (table, columns)
+                pending.extend(rows)
+                if len(pending) >= RESTORE_BATCH:
+                    flush()
+            flush()
+            pending_key = None
+            bytes_done += os.fstat(fh.fileno()).st_size
+
+        progress.update(force=True, phase="indexes")
+        for sql in indexes:
+            conn.exec_driver_sql(sql)
+        # Starsze zrzuty nie mają created_at - odtwarzamy je z kolumny date
+        progress.update(force=True, phase="created_at")
+        backfill_created_at(conn)
+        progress.update(force=True, phase="rollups")
+        rollups.rebuild(conn)
+    return statements, rows_total
+
+
+def run_restore(fetch, progress: JobProgress) -> dict:
+    started = time.perf_counter()
+    files = []
+    try:
+        files = fetch(progress)
+        progress.update(force=True, phase="import", bytes_read=0, bytes_total=sum(os.fstat(fh.fileno()).st_size for fh in files))
+        statements, rows = restore_dump(files, progress)
+    finally:
+        for fh in files:
+            fh.close()
+    settings_cache.invalidate()
+    results_version.bump()
+    logger.info(f"Przywrócono bazę danych ({len(files)} plików, {statements} instrukcji, {rows} wierszy) "
+                f"w {time.perf_counter() - started:.1f} s.")
+    return {"files": len(files), "statements": statements, "rows": rows, "results": progress.status["results"]}
+
+
+def start_restore(fetch, phase: str = "import") -> str:
+    """
+    Uruchamia przywracanie jako zadanie w tle. `fetch(progress)` (wołane już w wątku)
+    zwraca listę plików binarnych do wczytania po kolei - przewiniętych, zamykanych
+    po zakończeniu. Zwraca id zadania lub None, gdy trwa inne zadanie (backup / przywracanie).
+    """
+    return start_job("restore", functools.partial(run_restore, fetch), phase=phase,
+                     bytes_read=0, bytes_total=0, statements=0, rows=0, results=0)
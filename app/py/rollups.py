@@ -0,0 +1,313 @@
+# Moduł odpowiedzialny za agregaty historii (rollupy) w kubełkach godzinowych i dziennych.
+#
+# Dla każdej pary (kubełek, tryb) trzymamy liczbę wyników, min / max / sumę
+# oraz histogram logarytmiczny (histogram.LogHistogram) dla download, upload,
+# ping i jitter. Statystyki i percentyle dla dowolnego okna czasu liczymy
+# z kilkuset wierszy rollupu zamiast z surowej tabeli results.
+#
+# Aktualizacja:
+#   - zapis wyniku / partii: apply_result() / apply_batch() w tej samej transakcji
+#     co INSERT. Najpierw upsert (INSERT ... ON CONFLICT / ON DUPLICATE KEY) aktualizuje
+#     liczniki atomowo w SQL i blokuje wiersz, dopiero potem czytamy
+#     i zapisujemy histogramy - równoległe workery nie gubią aktualizacji.
+#   - usunięcie wyników: rebuild_days() przelicza dotknięte dni z surowych danych,
+#   - przywrócenie backupu / migracja: rebuild() przelicza wszystko.
+#
+# Wartości w histogramach są skalowane przez SKETCH_SCALE (LogHistogram liczy
+# na liczbach całkowitych): Mbps -> kbps, ms -> µs.
+
+import json
+import datetime
+import logging
+from sqlalchemy import select, delete, update, case, and_, or_
+from sqlalchemy.dialects import mysql, sqlite
+from .database import DB_TYPE, SpeedResult, ResultRollup
+from .histogram import LogHistogram
+
+logger = logging.getLogger("Rollups")
+
+METRICS = ("download", "upload", "ping", "jitter")
+BUCKETS = ("hour", "day")
+PERCENTILES = (50, 90, 95, 99)
+SKETCH_SCALE = 1000
+REBUILD_BATCH = 5000
+
+rollups = ResultRollup.__table__
+
+
+def bucket_start(ts: datetime.datetime, bucket: str) -> datetime.datetime:
+    if bucket == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def result_values(row) -> dict:
+    return {m: float(getattr(row, m) or 0.0) for m in METRICS}
+
+
+def load_sketches(raw) -> dict:
+    data = json.loads(raw) if raw else {}
+    return {m: LogHistogram.from_dict(data.get(m)) for m in METRICS}
+
+
+def dump_sketches(sketches: dict) -> str:
+    return json.dumps({m: sketches[m].to_dict() for m in METRICS}, separators=(",", ":"))
+
+
+# --- AGREGAT W PAMIĘCI ---
+
+class _Aggregate:
+    __slots__ = ("count", "low", "high", "total", "sketches")
+
+    def __init__(self):
+        self.count = 0
+        self.low = {}
+        self.high = {}
+        self.total = dict.fromkeys(METRICS, 0.0)
+        self.sketches = {m: LogHistogram() for m in METRICS}
+
+    def add(self, values: dict):
+        self.count += 1
+        for m, v in values.items():
+            if m not in self.low or v < self.low[m]:
+                self.low[m] = v
+            if m not in self.high or v > self.high[m]:
+                self.high[m] = v
+            self.total[m] += v
+            self.sketches[m].record(round(v * SKETCH_SCALE))
+
+    def merge(self, other: "_Aggregate"):
+        self.count += other.count
+        for m in METRICS:
+            if m not in self.low or other.low[m] < self.low[m]:
+                self.low[m] = other.low[m]
+            if m not in self.high or other.high[m] > self.high[m]:
+                self.high[m] = other.high[m]
+            self.total[m] += other.total[m]
+            self.sketches[m].merge(other.sketches[m])
+
+    def counters(self, bucket: str, start, mode: str) -> dict:
+        row = {"bucket": bucket, "bucket_start": start, "mode": mode, "count": self.count}
+        for m in METRICS:
+            row[f"{m}_min"] = self.low[m]
+            row[f"{m}_max"] = self.high[m]
+            row[f"{m}_sum"] = self.total[m]
+        return row
+
+    def to_row(self, bucket: str, start, mode: str) -> dict:
+        return {**self.counters(bucket, start, mode), "sketches": dump_sketches(self.sketches)}
+
+
+# --- AKTUALIZACJA PRZYROSTOWA ---
+
+def _upsert_counters(conn, bucket: str, start, mode: str, agg: _Aggregate):
+    stmt = (mysql.insert if DB_TYPE == "mysql" else sqlite.insert)(rollups).values(**agg.counters(bucket, start, mode))
+    new = stmt.inserted if DB_TYPE == "mysql" else stmt.excluded
+    c = rollups.c
+    changes = {"count": c.count + new.count}
+    for m in METRICS:
+        low, high = c[f"{m}_min"], c[f"{m}_max"]
+        changes[f"{m}_min"] = case((new[f"{m}_min"] < low, new[f"{m}_min"]), else_=low)
+        changes[f"{m}_max"] = case((new[f"{m}_max"] > high, new[f"{m}_max"]), else_=high)
+        changes[f"{m}_sum"] = c[f"{m}_sum"] + new[f"{m}_sum"]
+
+    if DB_TYPE == "mysql":
+        stmt = stmt.on_duplicate_key_update(**changes)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=["bucket", "bucket_start", "mode"], set_=changes)
+    conn.execute(stmt)
+
+
+def apply_batch(conn, rows):
+    """
+    Dolicza wyniki do rollupów. `rows` to słowniki z created_at, mode i metrykami
+    (np. wiersze wstawiane przez POST /api/history/batch). Partię najpierw agregujemy
+    w pamięci, więc na kubełek przypada jeden upsert i jeden zapis histogramów.
+    """
+    groups = {}
+    for row in rows:
+        if row.get("created_at") is None:
+            continue
+        mode = row.get("mode") or "Multi"
+        values = {m: float(row.get(m) or 0.0) for m in METRICS}
+        for bucket in BUCKETS:
+            key = (bucket, bucket_start(row["created_at"], bucket), mode)
+            if key not in groups:
+                groups[key] = _Aggregate()
+            groups[key].add(values)
+
+    # Stała kolejność kubełków - równoległe partie blokują wiersze w tej samej kolejności (bez zakleszczeń InnoDB)
+    for key in sorted(groups):
+        bucket, start, mode = key
+        agg = groups[key]
+        # Upsert blokuje wiersz (SQLite: blokada zapisu, InnoDB: blokada wiersza),
+        # więc odczyt-modyfikacja-zapis histogramów poniżej jest bezpieczny
+        _upsert_counters(conn, bucket, start, mode, agg)
+        where = and_(rollups.c.bucket == bucket, rollups.c.bucket_start == start, rollups.c.mode == mode)
+        row_id, raw = conn.execute(select(rollups.c.id, rollups.c.sketches).where(where)).one()
+        sketches = load_sketches(raw)
+        for m in METRICS:
+            sketches[m].merge(agg.sketches[m])
+        conn.execute(update(rollups).where(rollups.c.id == row_id).values(sketches=dump_sketches(sketches)))
+
+
+def apply_result(conn, result):
+    """Dolicza jeden wynik (SpeedResult z ustawionym created_at) do rollupów."""
+    apply_batch(conn, [{"created_at": result.created_at, "mode": result.mode, **result_values(result)}])
+
+
+# --- PRZELICZANIE Z SUROWYCH DANYCH ---
+
+def rebuild(conn, start: datetime.datetime = None, end: datetime.datetime = None) -> int:
+    """
+    Przelicza rollupy dla [start, end) (granice wyrównane do pełnych dni) lub całości.
+    Wyniki czytamy partiami w kolejności created_at, więc w pamięci trzymamy
+    tylko bieżącą godzinę i bieżący dzień. Zwraca liczbę przeliczonych wyników.
+    """
+    if start is not None:
+        start = bucket_start(start, "day")
+    if end is not None and end != bucket_start(end, "day"):
+        end = bucket_start(end, "day") + datetime.timedelta(days=1)
+
+    bounds = []
+    raw_bounds = [SpeedResult.created_at.isnot(None)]
+    if start is not None:
+        bounds.append(rollups.c.bucket_start >= start)
+        raw_bounds.append(SpeedResult.created_at >= start)
+    if end is not None:
+        bounds.append(rollups.c.bucket_start < end)
+        raw_bounds.append(SpeedResult.created_at < end)
+    conn.execute(delete(rollups).where(*bounds))
+
+    columns = (SpeedResult.id, SpeedResult.created_at, SpeedResult.mode, *[getattr(SpeedResult, m) for m in METRICS])
+
+    pending = []
+    # Wiersze liczymy tylko do kubełków godzinowych, a dzień składamy z jego godzin
+    # (merge) - połowa pracy na wiersz. Kubełek -> (początek, {tryb: _Aggregate})
+    current = {bucket: (None, {}) for bucket in BUCKETS}
+    processed = 0
+
+    def flush(bucket):
+        bucket_begin, groups = current[bucket]
+        for mode, agg in groups.items():
+            pending.append(agg.to_row(bucket, bucket_begin, mode))
+        if len(pending) >= REBUILD_BATCH:
+            conn.execute(rollups.insert(), pending)
+            pending.clear()
+
+    def flush_hour():
+        hour_begin, hours = current["hour"]
+        if hour_begin is None:
+            return
+        flush("hour")
+        day_begin = bucket_start(hour_begin, "day")
+        if current["day"][0] != day_begin:
+            flush("day")
+            current["day"] = (day_begin, {})
+        days = current["day"][1]
+        for mode, agg in hours.items():
+            if mode not in days:
+                days[mode] = _Aggregate()
+            days[mode].merge(agg)
+
+    # Partiami po indeksie (created_at, id) - bez otwartego kursora między zapisami
+    last = None
+    while True:
+        query = select(*columns).where(*raw_bounds)
+        if last is not None:
+            query = query.where(
+                SpeedResult.created_at >= last[0],
+                or_(SpeedResult.created_at > last[0], SpeedResult.id > last[1]),
+            )
+        rows = conn.execute(query.order_by(SpeedResult.created_at, SpeedResult.id).limit(REBUILD_BATCH)).all()
+        if not rows:
+            break
+        for row in rows:
+            begin = bucket_start(row.created_at, "hour")
+            if current["hour"][0] != begin:
+                flush_hour()
+                current["hour"] = (begin, {})
+            groups = current["hour"][1]
+            mode = row.mode or "Multi"
+            if mode not in groups:
+                groups[mode] = _Aggregate()
+            groups[mode].add(result_values(row))
+        last = (rows[-1].created_at, rows[-1].id)
+        processed += len(rows)
+
+    flush_hour()
+    flush("day")
+    if pending:
+        conn.execute(rollups.insert(), pending)
+    return processed
+
+
+def affected_days(conn, ids: list) -> list:
+    """Dni (początki), do których należą podane wyniki - liczone przed ich usunięciem."""
+    days = set()
+    for i in range(0, len(ids), REBUILD_BATCH):
+        rows = conn.execute(select(SpeedResult.created_at).where(SpeedResult.id.in_(ids[i:i + REBUILD_BATCH])))
+        days.update(bucket_start(ts, "day") for (ts,) in rows if ts is not None)
+    return sorted(days)
+
+
+def rebuild_days(conn, days: list):
+    for day in days:
+        rebuild(conn, day, day + datetime.timedelta(days=1))
+
+
+# --- ODCZYT ---
+
+def combine(entries: list) -> dict:
+    """
+    Łączy wiersze rollupu w jeden agregat. `entries` to lista par
+    (wiersz ResultRollup, histogramy z load_sketches) - histogramy parsujemy raz.
+    Zwraca {"count", metryka: (min, max, suma, LogHistogram)}.
+    """
+    out = {"count": sum(row.count for row, _ in entries)}
+    for m in METRICS:
+        if len(entries) == 1:
+            merged = entries[0][1][m]
+        else:
+            merged = LogHistogram()
+            for _, sketches in entries:
+                merged.merge(sketches[m])
+        out[m] = (
+            min(getattr(row, f"{m}_min") for row, _ in entries),
+            max(getattr(row, f"{m}_max") for row, _ in entries),
+            sum(getattr(row, f"{m}_sum") for row, _ in entries),
+            merged,
+        )
+    return out
+
+
+def merge_combined(parts: list) -> dict:
+    """Łączy wyniki combine() (np. kubełki w podsumowanie okna)."""
+    out = {"count": sum(part["count"] for part in parts)}
+    for m in METRICS:
+        merged = LogHistogram()
+        for part in parts:
+            merged.merge(part[m][3])
+        out[m] = (
+            min(part[m][0] for part in parts),
+            max(part[m][1] for part in parts),
+            sum(part[m][2] for part in parts),
+            merged,
+        )
+    return out
+
+
+def describe(combined: dict) -> dict:
+    """Agregat z combine() -> statystyki do JSON (min, max, średnia, percentyle)."""
+    count = combined["count"]
+    out = {"count": count}
+    for m in METRICS:
+        if not count:
+            out[m] = None
+            continue
+        low, high, total, sketch = combined[m]
+        stats = {"min": low, "max": high, "mean": round(total / count, 3)}
+        for p, value in zip(PERCENTILES, sketch.percentiles(PERCENTILES)):
+            stats[f"p{p}"] = round(value / SKETCH_SCALE, 3)
+        out[m] = stats
+    return out
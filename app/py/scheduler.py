@@ -3,9 +3,9 @@ import datetime
 import os
 import sys
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from sqlalchemy.orm import Session
-from .database import SessionLocal, Settings
-from .backup_service import perform_backup_logic
+from .settings_cache import settings_cache
+from .backup_service import start_backup, backup_enabled
+from .hub import HUB_URL, HUB_PUSH_INTERVAL, push_to_hub, prune_ingest_keys
 
 logger = logging.getLogger("Scheduler")
 
@@ -28,13 +28,12 @@ def check_and_run_backup():
     Funkcja uruchamiana cyklicznie (co 60 sekund).
     Sprawdza, czy nadszedł czas na backup.
     """
-    # Tworzymy nową sesję dla każdego wykonania zadania
-    db: Session = SessionLocal()
     try:
-        settings = db.query(Settings).filter(Settings.id == 1).first()
+        # Decyzję podejmujemy na migawce z cache - sesję bazy otwieramy tylko do backupu
+        settings = settings_cache.get()
         
-        # 1. Sprawdź czy backup włączony
-        if not settings or not settings.gdrive_enabled:
+        # 1. Sprawdź czy backup włączony (Google Drive połączony albo inny cel z BACKUP_DESTINATION)
+        if not settings or not backup_enabled(settings):
             return
 
         # 2. Pobierz konfigurację
@@ -85,13 +84,24 @@ def check_and_run_backup():
                 should_run = True
 
         if should_run:
-            logger.info(f"Uruchamianie zaplanowanego backupu (Ostatni: {last_backup_str})...")
-            perform_backup_logic(db)
+            # Backup w tle jako zadanie (jobs.py) - nie ruszy, gdy trwa przywracanie;
+            # wtedy spróbujemy przy następnym sprawdzeniu
+            job_id = start_backup()
+            if job_id is None:
+                logger.info("Zaplanowany backup odłożony - trwa inny backup lub przywracanie.")
+            else:
+                logger.info(f"Uruchomiono zaplanowany backup (Ostatni: {last_backup_str}, zadanie {job_id}).")
 
     except Exception as e:
         logger.error(f"Scheduler Error: {e}")
-    finally:
-        db.close()
+
+def add_jobs():
+    scheduler.add_job(check_and_run_backup, 'interval', seconds=60, jitter=5)
+    scheduler.add_job(prune_ingest_keys, 'interval', hours=1, jitter=60)
+    if HUB_URL:
+        # Tryb edge - wysyłka nowych wyników do huba (patrz hub.py)
+        scheduler.add_job(push_to_hub, 'interval', seconds=HUB_PUSH_INTERVAL, jitter=5, max_instances=1)
+        logger.info(f"Scheduler: Wysyłka wyników do huba {HUB_URL} co {HUB_PUSH_INTERVAL}s.")
 
 def start_scheduler():
     """
@@ -105,7 +115,7 @@ def start_scheduler():
     # W środowisku produkcyjnym (Linux/Docker) blokada zadziała.
     if not HAS_FCNTL:
         logger.info("Scheduler: Start bez blokady (Windows mode).")
-        scheduler.add_job(check_and_run_backup, 'interval', seconds=60, jitter=5)
+        add_jobs()
         scheduler.start()
         return
 
@@ -119,7 +129,7 @@ def start_scheduler():
         # --- JEŚLI DOTARLIŚMY TUTAJ, TO JESTEŚMY WYBRANYM PROCESEM ---
         logger.info("Scheduler: Uzyskano blokadę (MASTER). Uruchamianie zegara co 60s.")
         
-        scheduler.add_job(check_and_run_backup, 'interval', seconds=60, jitter=5)
+        add_jobs()
         scheduler.start()
         
     except (IOError, BlockingIOError):
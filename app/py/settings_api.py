@@ -1,114 +1,42 @@
 import logging
 from fastapi import APIRouter, Request, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import text, inspect
-from .database import get_db, Settings, engine
+from .database import get_db, Settings
+from .settings_cache import settings_cache
 
 logger = logging.getLogger("SettingsAPI")
 router = APIRouter()
 
-def ensure_columns():
-    """
-    Sprawdza i dodaje brakujące kolumny.
-    Zaktualizowane, aby działać zarówno na SQLite (PRAGMA) jak i MySQL (inspect).
-    """
-    try:
-        # Używamy SQLAlchemy Inspector, który jest niezależny od bazy danych
-        inspector = inspect(engine)
-        
-        # Jeśli tabela jeszcze nie istnieje (np. przy pierwszym starcie przed create_all), pomijamy
-        if not inspector.has_table("settings"):
-            return
-
-        columns_info = inspector.get_columns("settings")
-        existing_columns = [col['name'] for col in columns_info]
-        
-        # Helper do wykonywania ALTER TABLE
-        def add_if_missing(col_name, col_type, default):
-            if col_name not in existing_columns:
-                logger.info(f"Migracja: Dodawanie kolumny '{col_name}'...")
-                try:
-                    with engine.connect() as connection:
-                        # Składnia ADD COLUMN jest wspierana przez MySQL i SQLite
-                        # W MySQL ważne jest podanie długości dla VARCHAR (np. VARCHAR(255))
-                        connection.execute(text(f"ALTER TABLE settings ADD COLUMN {col_name} {col_type} DEFAULT {default}"))
-                        connection.commit()
-                except Exception as ex:
-                    logger.error(f"Błąd dodawania kolumny {col_name}: {ex}")
-
-        # Definicje kolumn z typami kompatybilnymi dla MySQL (długość VARCHAR)
-        add_if_missing("unit", "VARCHAR(10)", "'mbps'")
-        add_if_missing("primary_color", "VARCHAR(20)", "'#6200ea'")
-        add_if_missing("oidc_enabled", "BOOLEAN", "0")
-        add_if_missing("oidc_discovery_url", "VARCHAR(255)", "''")
-        add_if_missing("oidc_client_id", "VARCHAR(255)", "''")
-        add_if_missing("oidc_client_secret", "VARCHAR(255)", "''")
-        
-        # --- Nowe kolumny Google Drive ---
-        add_if_missing("gdrive_enabled", "BOOLEAN", "0")
-        add_if_missing("gdrive_client_id", "VARCHAR(255)", "''")
-        add_if_missing("gdrive_client_secret", "VARCHAR(255)", "''")
-        add_if_missing("gdrive_folder_name", "VARCHAR(255)", "'LocalSpeed_Backup'")
-        add_if_missing("gdrive_backup_frequency", "INTEGER", "1")
-        add_if_missing("gdrive_backup_time", "VARCHAR(10)", "'04:00'")
-        add_if_missing("gdrive_retention_days", "INTEGER", "7")
-        add_if_missing("gdrive_last_backup", "VARCHAR(50)", "''")
-        add_if_missing("gdrive_status", "VARCHAR(255)", "''")
-        # Zwiększamy limit dla tokena (TEXT byłby lepszy w MySQL, ale VARCHAR(4000) jest bezpieczny i prosty)
-        add_if_missing("gdrive_token_json", "VARCHAR(4000)", "''")
-
-    except Exception as e:
-        logger.error(f"Krytyczny błąd migracji (engine): {e}")
-
 @router.get("/api/settings")
-def get_settings(response: Response, db: Session = Depends(get_db)):
-    """Pobiera ustawienia."""
+def get_settings(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Pobiera ustawienia (z cache, z obsługą ETag / If-None-Match)."""
     
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
+    # no-cache (a nie no-store): przeglądarka trzyma kopię, ale zawsze ją rewaliduje
+    response.headers["Cache-Control"] = "no-cache"
 
-    ensure_columns()
-    
     try:
-        settings = db.query(Settings).filter(Settings.id == 1).first()
+        settings = settings_cache.get()
         if not settings:
-            settings = Settings(id=1, lang="en", theme="dark", unit="mbps", primary_color="#6200ea")
-            db.add(settings)
+            db.add(Settings(id=1, lang="en", theme="dark", unit="mbps", primary_color="#6200ea"))
             db.commit()
-            db.refresh(settings)
+            settings_cache.invalidate()
+            settings = settings_cache.get()
+
+        if request.headers.get("if-none-match") == settings.etag:
+            return Response(status_code=304, headers={"ETag": settings.etag, "Cache-Control": "no-cache"})
 
-        return {
-            "id": settings.id,
-            "lang": settings.lang,
-            "theme": settings.theme,
-            "unit": settings.unit,
-            "primary_color": settings.primary_color,
-            "oidc_enabled": settings.oidc_enabled,
-            "oidc_discovery_url": settings.oidc_discovery_url,
-            "oidc_client_id": settings.oidc_client_id,
-            "oidc_client_secret": settings.oidc_client_secret,
-            
-            # Google Drive fields
-            "gdrive_enabled": settings.gdrive_enabled,
-            "gdrive_client_id": settings.gdrive_client_id,
-            "gdrive_client_secret": settings.gdrive_client_secret,
-            "gdrive_folder_name": settings.gdrive_folder_name,
-            "gdrive_backup_frequency": settings.gdrive_backup_frequency,
-            "gdrive_backup_time": settings.gdrive_backup_time,
-            "gdrive_retention_days": settings.gdrive_retention_days
-        }
+        response.headers["ETag"] = settings.etag
+        return settings.public()
 
     except Exception as e:
         logger.error(f"Błąd pobierania ustawień: {e}")
         # Fallback w przypadku błędu
+        response.headers["Cache-Control"] = "no-store"
         return { "id": 1, "lang": "en", "theme": "dark" }
 
 @router.post("/api/settings")
 async def update_settings(request: Request, db: Session = Depends(get_db)):
     """Aktualizuje ustawienia."""
-    ensure_columns()
-
     try:
         data = await request.json()
         
@@ -138,7 +66,7 @@ async def update_settings(request: Request, db: Session = Depends(get_db)):
         if 'gdrive_retention_days' in data: settings.gdrive_retention_days = int(data['gdrive_retention_days'])
 
         db.commit()
-        db.refresh(settings)
+        settings_cache.invalidate()
         return {"status": "updated"}
         
     except Exception as e:
@@ -0,0 +1,79 @@
+# Moduł pomocniczy: wspólny cache wiersza ustawień (Settings, id=1).
+#
+# Ustawienia czyta prawie każda ścieżka (auth_status co 30 s z healthchecka,
+# OIDC, /api/settings, status backupu, scheduler co 60 s), a zmieniają się
+# rzadko. Każdy worker trzyma więc niezmienną migawkę wiersza, a unieważnianie
+# między workerami zapewnia licznik wersji w pamięci współdzielonej
+# (shared_state.VersionCounter). Zapis ustawień = commit + settings_cache.invalidate(),
+# czyli atomowe zwiększenie licznika. Odczyt to porównanie jednego słowa 64-bit.
+#
+# MAX_AGE ogranicza nieaktualność przy zmianach spoza procesów tego hosta
+# (np. drugi kontener na wspólnej bazie MySQL albo ręczna edycja bazy).
+
+import json
+import time
+import hashlib
+import logging
+from types import SimpleNamespace
+from .database import SessionLocal, Settings
+from .shared_state import VersionCounter
+
+logger = logging.getLogger("SettingsCache")
+
+MAX_AGE = 300  # sekundy
+
+# Pola zwracane przez GET /api/settings
+PUBLIC_FIELDS = (
+    "id", "lang", "theme", "unit", "primary_color",
+    "oidc_enabled", "oidc_discovery_url", "oidc_client_id", "oidc_client_secret",
+    "gdrive_enabled", "gdrive_client_id", "gdrive_client_secret", "gdrive_folder_name",
+    "gdrive_backup_frequency", "gdrive_backup_time", "gdrive_retention_days",
+)
+
+
+class SettingsSnapshot(SimpleNamespace):
+    """Odłączona od sesji kopia wiersza Settings (tylko do odczytu)."""
+
+    def public(self) -> dict:
+        return {name: getattr(self, name) for name in PUBLIC_FIELDS}
+
+
+def load_snapshot():
+    db = SessionLocal()
+    try:
+        row = db.query(Settings).filter(Settings.id == 1).first()
+        if row is None:
+            return None
+        snapshot = SettingsSnapshot(**{col.name: getattr(row, col.name) for col in Settings.__table__.columns})
+    finally:
+        db.close()
+    digest = hashlib.sha1(json.dumps(snapshot.public(), sort_keys=True, default=str).encode()).hexdigest()
+    snapshot.etag = f'"{digest[:16]}"'
+    return snapshot
+
+
+class SettingsCache:
+    def __init__(self):
+        self.version = VersionCounter("settings_version")
+        # (wersja, czas załadowania, migawka) - podmieniane jednym przypisaniem,
+        # więc równoległe przeładowania z puli wątków nie pomieszają stanu
+        self._entry = None
+
+    def get(self):
+        """Zwraca migawkę ustawień (SettingsSnapshot) lub None, gdy wiersz nie istnieje."""
+        version = self.version.value
+        entry = self._entry
+        if entry is not None and entry[0] == version and time.monotonic() - entry[1] < MAX_AGE:
+            return entry[2]
+        # Wersję czytamy przed zapytaniem - zapis w trakcie odczytu wymusi kolejne przeładowanie
+        snapshot = load_snapshot()
+        self._entry = (version, time.monotonic(), snapshot)
+        return snapshot
+
+    def invalidate(self):
+        """Wołane po zapisie ustawień - unieważnia migawki we wszystkich workerach."""
+        self.version.bump()
+        self._entry = None
+
+
+settings_cache = SettingsCache()
@@ -0,0 +1,110 @@
+# Moduł pomocniczy: pamięć współdzielona między workerami uvicorna.
+#
+# Tablica liczb 64-bit (unsigned) w pliku zmapowanym w pamięci (mmap).
+# Plik leży w /dev/shm (tmpfs), więc nie dotyka dysku. Zwykłe odczyty i zapisy
+# słów 8-bajtowych są atomowe, a każdy wiersz liczników ma jednego "właściciela"
+# (worker), więc aktualizacje nie wymagają blokad. Blokada pliku (flock)
+# służy tylko do rzadkich operacji strukturalnych (np. rezerwacja slotu).
+
+import os
+import mmap
+import tempfile
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("SharedState")
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+WORD = 8
+
+
+class SharedArray:
+    """
+    Tablica słów uint64 współdzielona przez procesy.
+    Słowo 0 przechowuje "layout" - przy zmianie struktury plik jest zerowany.
+    """
+
+    def __init__(self, name: str, length: int, layout: int = 1):
+        self.path = os.path.join(SHARED_DIR, f"localspeed_{name}.shm")
+        self.length = length + 1
+        self.layout = layout
+        self._lock_handle = None
+        self._mmap = None
+        self._words = None
+
+    @property
+    def words(self) -> memoryview:
+        if self._words is None:
+            self.open()
+        return self._words
+
+    def open(self):
+        if self._words is not None:
+            return
+        size = self.length * WORD
+        self._lock_handle = open(self.path + ".lock", "w")
+        with self.locked():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self._mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self._words = memoryview(self._mmap).cast("Q")
+            if self._words[0] != self.layout:
+                # Nowy plik lub inna wersja struktury - zaczynamy od zera
+                self._mmap[:] = bytes(size)
+                self._words[0] = self.layout
+        logger.info(f"Pamięć współdzielona gotowa: {self.path} ({size} B)")
+
+    @contextmanager
+    def locked(self):
+        """Blokada międzyprocesowa dla operacji strukturalnych."""
+        if self._lock_handle is None:
+            self.open()
+        if HAS_FCNTL:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if HAS_FCNTL:
+                fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+
+
+class VersionCounter:
+    """
+    Licznik wersji danych współdzielony przez workery (unieważnianie cache).
+    Odczyt to jedno słowo 64-bit, bump() zwiększa je pod blokadą.
+    """
+
+    def __init__(self, name: str):
+        self.shm = SharedArray(name, 1, layout=1)
+
+    @property
+    def value(self) -> int:
+        return self.shm.words[1]
+
+    def bump(self):
+        words = self.shm.words
+        with self.shm.locked():
+            words[1] += 1
+
+
+def pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,22 +1,23 @@
-import time
 import os
+import math
+import zlib
 import logging
-import subprocess
-import platform
-import re
-import asyncio
+import ipaddress
 from fastapi import APIRouter, Request, HTTPException, Response, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from .database import STATIC_DIR
+from .payload_pool import PayloadResponse, clamp_chunk_size, parse_size, parse_duration, parse_range
+from .upload_sink import upload_sink, get_timeline
+from .test_sessions import session_store
+from .latency import run_latency_session
+from .ws_throughput import run_throughput_session
+from .icmp_prober import icmp_prober, IPAddress
 
 router = APIRouter()
+DOCKER_NETWORK = ipaddress.ip_network("172.16.0.0/12")
 logger = logging.getLogger("ClientLogger")
 
-# --- KONFIGURACJA GENERATORA DANYCH ---
-CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB
-RANDOM_DATA = os.urandom(CHUNK_SIZE)
-
 # Model danych dla logu
 class LogMessage(BaseModel):
     text: str
@@ -39,6 +40,23 @@ def get_real_client_ip(request: Request) -> str:
 
     return request.client.host
 
+def get_probe_target(request: Request) -> IPAddress:
+    """
+    Adres klienta jako cel sondy ICMP. Nagłówki proxy uznajemy tylko, gdy
+    połączenie przyszło z sieci prywatnej (nasze proxy), inaczej każdy mógłby
+    kazać nam pingować dowolny host. ValueError, gdy to nie jest adres IP.
+    """
+    peer = ipaddress.ip_address(request.client.host)
+    if peer.version == 6 and peer.ipv4_mapped:
+        peer = peer.ipv4_mapped
+    if not (peer.is_private or peer.is_loopback):
+        return peer
+
+    addr = ipaddress.ip_address(get_real_client_ip(request).strip())
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    return addr
+
 # --- ENDPOINTY ---
 
 @router.post("/api/log_client")
@@ -68,55 +86,112 @@ async def websocket_ping(websocket: WebSocket):
     except Exception as e:
         logger.error(f"WebSocket Error: {e}")
 
-@router.post("/api/upload")
-async def upload_stream(request: Request):
+@router.websocket("/api/ws/latency")
+async def websocket_latency(websocket: WebSocket, interval: float = 100, count: int = 0, warmup: int = 0, phase: str = "idle"):
     """
-    Odbiera strumień danych i zlicza bajty (Test Uploadu).
+    Binarny pomiar opóźnień: serwer wysyła sondy ze znacznikiem czasu (ns),
+    klient je odbija, a statystyki (p50/p90/p99/max, jitter) liczy serwer.
+    Szczegóły protokołu w latency.py.
     """
-    total_bytes = 0
-    start_time = time.time()
-    try:
-        async for chunk in request.stream():
-            total_bytes += len(chunk)
-    except Exception as e:
-        pass
-        
-    duration = time.time() - start_time
-    if duration <= 0: duration = 0.001
-    
-    return JSONResponse({"received": total_bytes, "time": duration})
+    await run_latency_session(websocket, interval, count, warmup, phase)
+
+@router.websocket("/api/ws/throughput")
+async def websocket_throughput(websocket: WebSocket, direction: str = "download", duration: float = 12, frame: int = None, session: str = None):
+    """
+    Test przepustowości po jednym połączeniu WebSocket (tryb "WS").
+    'frame' to rozmiar ramki w KB, wynik (bajty w slotach czasu) wysyłany jest na końcu.
+    """
+    await run_throughput_session(websocket, direction, duration, frame, session)
+
+# Odbiór danych testu Uploadu - czysta aplikacja ASGI (patrz upload_sink.py)
+router.add_route("/api/upload", upload_sink, methods=["POST"])
+
+@router.get("/api/upload/timeline/{test_id}")
+async def upload_timeline(test_id: str):
+    """
+    Zwraca serwerową oś czasu Uploadu (bajty w slotach czasowych) dla danego testu,
+    zsumowaną ze wszystkich workerów.
+    """
+    timeline = get_timeline(test_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Unknown test_id")
+    return timeline
 
 @router.get("/api/download")
-async def download_stream(size: int = 100):
+async def download_stream(request: Request, size: str = "100", duration: str = None, chunk: int = None, session: str = None):
     """
-    Generuje strumień danych z pamięci RAM (Test Downloadu).
+    Wysyła strumień danych ze współdzielonej puli mmap (Test Downloadu).
+    - 'size': liczba = MB (jak dotychczas) lub dokładny rozmiar z sufiksem (b, k, m, g),
+      obsługuje nagłówek Range (206 Partial Content),
+    - 'duration' (np. "12s"): strumień bez Content-Length (chunked) aż do upływu czasu,
+      dzięki czemu jeden request wystarcza na cały test,
+    - 'chunk' (KB) pozwala dobrać rozmiar fragmentu do szybkości łącza,
+    - 'session' dolicza wysłane bajty do współdzielonej sesji testu.
     """
-    if size > 1000: size = 1000
-    if size < 1: size = 1
-    
-    total_bytes = size * 1024 * 1024
-
-    def iterfile():
-        bytes_sent = 0
-        while bytes_sent < total_bytes:
-            remaining = total_bytes - bytes_sent
-            to_send = min(remaining, CHUNK_SIZE)
-            
-            if to_send == CHUNK_SIZE:
-                yield RANDOM_DATA
-            else:
-                yield RANDOM_DATA[:to_send]
-                
-            bytes_sent += to_send
+    try:
+        stream_duration = parse_duration(duration) if duration else None
+        total_bytes = parse_size(size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     headers = {
-        "Content-Disposition": f'attachment; filename="random_{size}MB.bin"',
-        "Content-Length": str(total_bytes),
         "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
         "Pragma": "no-cache",
     }
-
-    return StreamingResponse(iterfile(), media_type="application/octet-stream", headers=headers)
+    counter = session_store.counter(session, "download")
+    chunk_size = clamp_chunk_size(chunk)
+
+    if stream_duration is not None:
+        headers["Content-Disposition"] = 'attachment; filename="random_stream.bin"'
+        return PayloadResponse(chunk_size=chunk_size, headers=headers, counter=counter, duration=stream_duration)
+
+    headers["Content-Disposition"] = f'attachment; filename="random_{total_bytes}.bin"'
+    headers["Accept-Ranges"] = "bytes"
+
+    # Treść zależy tylko od adresu (łącznie z parametrem 't'), więc zakresy
+    # kolejnych żądań o ten sam zasób do siebie pasują.
+    offset = zlib.crc32(request.url.query.encode())
+    status_code = 200
+    range_header = request.headers.get("range")
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, total_bytes)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{total_bytes}"})
+        if byte_range is not None:
+            first, last = byte_range
+            headers["Content-Range"] = f"bytes {first}-{last}/{total_bytes}"
+            offset += first
+            total_bytes = last - first + 1
+            status_code = 206
+
+    headers["Content-Length"] = str(total_bytes)
+    return PayloadResponse(total_bytes, chunk_size=chunk_size, status_code=status_code, headers=headers, counter=counter, offset=offset)
+
+# --- SESJE TESTÓW (wspólne dla wszystkich workerów) ---
+
+@router.post("/api/test")
+async def create_test_session():
+    """Tworzy sesję testu. Jej id przekazujemy jako ?session= do /api/download i /api/upload."""
+    try:
+        return {"id": session_store.create()}
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/api/test/{session_id}")
+async def get_test_session(session_id: str):
+    """Zwraca łączną (ze wszystkich workerów) prędkość sesji - także w trakcie testu."""
+    stats = session_store.stats(session_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return stats
+
+@router.post("/api/test/{session_id}/finish")
+async def finish_test_session(session_id: str):
+    stats = session_store.finish(session_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return stats
 
 @router.get("/api/ping")
 async def ping():
@@ -128,37 +203,38 @@ async def ping():
 # Pozostawiamy endpointy ICMP jako legacy/fallback (opcjonalnie), 
 # ale JS będzie teraz korzystał z WebSocketa.
 @router.get("/api/ping_icmp")
-async def ping_icmp(request: Request):
+async def ping_icmp(request: Request, count: int = 5, interval: float = 50, timeout: float = 1000):
+    """Seria sond ICMP do klienta (interval/timeout w ms). Pole 'ping' = średnia."""
     try:
-        client_ip = get_real_client_ip(request)
+        target = get_probe_target(request)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Client address is not an IP address")
+    if not (math.isfinite(interval) and math.isfinite(timeout)):
+        raise HTTPException(status_code=400, detail="interval and timeout must be finite numbers")
+
+    try:
+        client_ip = str(target)
         logger.info(f"ICMP Test requested for IP: {client_ip}")
 
-        if client_ip in ["127.0.0.1", "localhost", "::1"]:
+        if target.is_loopback:
              return {"ping": 0, "error": "Skipping localhost ping", "method": "skipped"}
 
-        if client_ip.startswith("172."):
+        if target in DOCKER_NETWORK:
             logger.warning(f"ICMP target {client_ip} looks like Docker internal IP.")
 
-        if platform.system().lower() == "windows":
-            cmd = ["ping", "-n", "1", "-w", "1000", client_ip]
-        else:
-            cmd = ["ping", "-c", "1", "-W", "1", client_ip]
-
-        process = await asyncio.to_thread(
-            subprocess.run, 
-            cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-
-        if process.returncode == 0:
-            match = re.search(r'(?:time|czas|Cza)[=<]([\d\.]+)', process.stdout, re.IGNORECASE)
-            if match:
-                return {"ping": float(match.group(1)), "method": "icmp", "ip": client_ip}
-                
-        return {"ping": 0, "error": "ICMP unreachable", "ip": client_ip}
+        stats = await icmp_prober.probe(target, count, interval / 1000.0, timeout / 1000.0)
+        if stats["received"]:
+            return {
+                "ping": stats["avg"], "method": "icmp", "ip": client_ip,
+                "min": stats["min"], "avg": stats["avg"], "max": stats["max"], "stddev": stats["stddev"],
+                "loss": stats["loss"], "sent": stats["sent"], "received": stats["received"],
+                "socket": stats["method"],
+            }
+
+        return {"ping": 0, "error": "ICMP unreachable", "ip": client_ip, "loss": stats["loss"]}
 
+    except PermissionError:
+        return {"ping": 0, "error": "ICMP not permitted (needs ping_group_range or CAP_NET_RAW)", "method": "unavailable"}
     except Exception as e:
         logger.error(f"ICMP Error: {e}")
         return {"ping": 0, "error": str(e)}
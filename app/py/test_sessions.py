@@ -0,0 +1,214 @@
+# Moduł odpowiedzialny za sesje testów widoczne dla wszystkich workerów.
+#
+# Przeglądarka uruchamia do 16 strumieni, które trafiają do dowolnych procesów
+# uvicorna (--workers 4). Każdy worker zlicza bajty sesji we własnym wierszu
+# tablicy współdzielonej (shared_state.SharedArray), a odczyt sumuje wiersze
+# wszystkich workerów - dzięki temu serwer zna łączną prędkość testu.
+
+import os
+import time
+import secrets
+import logging
+from .shared_state import SharedArray, pid_alive
+
+logger = logging.getLogger("TestSessions")
+
+# --- KONFIGURACJA ---
+MAX_WORKERS = 32
+MAX_SESSIONS = 64
+SESSION_TTL = 600  # s - po tym czasie slot sesji może zostać ponownie użyty
+
+DIRECTIONS = {"download": 0, "upload": 1}
+
+# --- UKŁAD PAMIĘCI (słowa uint64) ---
+# [1 .. MAX_WORKERS]             PID workera zajmującego dany wiersz
+# [SESSIONS_BASE + n * STRIDE]   sesja n: id, created_ns, finished_ns,
+#                                potem dla każdego workera i kierunku: bytes, first_ns, last_ns
+WORKERS_BASE = 1
+SESSIONS_BASE = WORKERS_BASE + MAX_WORKERS
+S_ID, S_CREATED, S_FINISHED = 0, 1, 2
+S_HEADER = 3
+COUNTER_WORDS = 3
+WORKER_STRIDE = len(DIRECTIONS) * COUNTER_WORDS
+STRIDE = S_HEADER + MAX_WORKERS * WORKER_STRIDE
+
+
+class SessionCounter:
+    """Licznik bajtów jednej sesji/kierunku w wierszu bieżącego workera (bez blokad)."""
+    __slots__ = ("words", "base")
+
+    def __init__(self, words, base: int):
+        self.words = words
+        self.base = base
+
+    def add(self, n: int):
+        words = self.words
+        base = self.base
+        now = time.monotonic_ns()
+        if words[base + 1] == 0:
+            words[base + 1] = now
+        words[base] += n
+        words[base + 2] = now
+
+
+class TestSessionStore:
+    def __init__(self):
+        self.shm = SharedArray("test_sessions", SESSIONS_BASE + MAX_SESSIONS * STRIDE, layout=1)
+        self._worker_index = None
+        self._worker_pid = None
+        self._slot_cache = {}
+
+    # --- Worker ---
+
+    def worker_index(self) -> int:
+        """Rezerwuje (raz na proces) wiersz workera w tablicy współdzielonej."""
+        pid = os.getpid()
+        if self._worker_index is not None and self._worker_pid == pid:
+            return self._worker_index
+
+        words = self.shm.words
+        with self.shm.locked():
+            free = None
+            for i in range(MAX_WORKERS):
+                owner = words[WORKERS_BASE + i]
+                if owner == pid:
+                    free = i
+                    break
+                if free is None and (owner == 0 or not pid_alive(owner)):
+                    free = i
+            if free is None:
+                raise RuntimeError("Brak wolnych slotów workerów w pamięci współdzielonej")
+            words[WORKERS_BASE + free] = pid
+
+        self._worker_index = free
+        self._worker_pid = pid
+        return free
+
+    # --- Sesje ---
+
+    def _slot(self, session_id: str):
+        try:
+            sid = int(session_id, 16)
+        except (TypeError, ValueError):
+            return None
+        if sid == 0:
+            return None
+
+        words = self.shm.words
+        slot = self._slot_cache.get(sid)
+        if slot is not None and words[SESSIONS_BASE + slot * STRIDE + S_ID] == sid:
+            return slot
+
+        for n in range(MAX_SESSIONS):
+            if words[SESSIONS_BASE + n * STRIDE + S_ID] == sid:
+                self._remember(sid, n)
+                return n
+        self._slot_cache.pop(sid, None)
+        return None
+
+    def _remember(self, sid: int, slot: int):
+        cache = self._slot_cache
+        if len(cache) >= MAX_SESSIONS:
+            # Usuwamy sesje, których slot przejęła już inna sesja - aktualnych
+            # jest najwyżej MAX_SESSIONS, więc słownik nie rośnie bez końca
+            words = self.shm.words
+            for old, n in list(cache.items()):
+                if words[SESSIONS_BASE + n * STRIDE + S_ID] != old:
+                    del cache[old]
+        cache[sid] = slot
+
+    def create(self) -> str:
+        words = self.shm.words
+        now = time.monotonic_ns()
+        ttl_ns = SESSION_TTL * 1_000_000_000
+
+        with self.shm.locked():
+            chosen, oldest = None, None
+            for n in range(MAX_SESSIONS):
+                base = SESSIONS_BASE + n * STRIDE
+                if words[base + S_ID] == 0:
+                    chosen = n
+                    break
+                finished = words[base + S_FINISHED]
+                created = words[base + S_CREATED]
+                if now - max(created, finished) > ttl_ns or finished:
+                    if oldest is None or max(created, finished) < oldest[1]:
+                        oldest = (n, max(created, finished))
+            if chosen is None:
+                if oldest is None:
+                    raise RuntimeError("Zbyt wiele aktywnych sesji testów")
+                chosen = oldest[0]
+
+            base = SESSIONS_BASE + chosen * STRIDE
+            words[base + S_ID] = 0
+            for i in range(1, STRIDE):
+                words[base + i] = 0
+            words[base + S_CREATED] = now
+            sid = 0
+            while sid == 0:
+                sid = secrets.randbits(64)
+            # Publikujemy identyfikator na końcu - slot jest już wyzerowany
+            words[base + S_ID] = sid
+
+        self._remember(sid, chosen)
+        return f"{sid:016x}"
+
+    def counter(self, session_id: str, direction: str):
+        """Zwraca licznik dla bieżącego workera lub None, jeśli sesja nie istnieje."""
+        if not session_id:
+            return None
+        slot = self._slot(session_id)
+        if slot is None:
+            return None
+        base = (SESSIONS_BASE + slot * STRIDE + S_HEADER
+                + self.worker_index() * WORKER_STRIDE + DIRECTIONS[direction] * COUNTER_WORDS)
+        return SessionCounter(self.shm.words, base)
+
+    def finish(self, session_id: str):
+        slot = self._slot(session_id)
+        if slot is None:
+            return None
+        base = SESSIONS_BASE + slot * STRIDE
+        if self.shm.words[base + S_FINISHED] == 0:
+            self.shm.words[base + S_FINISHED] = time.monotonic_ns()
+        return self.stats(session_id)
+
+    def stats(self, session_id: str):
+        """Sumuje liczniki wszystkich workerów i wylicza łączną prędkość sesji."""
+        slot = self._slot(session_id)
+        if slot is None:
+            return None
+        words = self.shm.words
+        base = SESSIONS_BASE + slot * STRIDE
+        finished = words[base + S_FINISHED]
+        now = time.monotonic_ns()
+
+        result = {
+            "id": session_id,
+            "running": finished == 0,
+            "age": (now - words[base + S_CREATED]) / 1e9,
+        }
+        for name, d in DIRECTIONS.items():
+            total, first, last, workers = 0, 0, 0, 0
+            for w in range(MAX_WORKERS):
+                c = base + S_HEADER + w * WORKER_STRIDE + d * COUNTER_WORDS
+                b = words[c]
+                if b == 0:
+                    continue
+                workers += 1
+                total += b
+                first = words[c + 1] if first == 0 else min(first, words[c + 1])
+                last = max(last, words[c + 2])
+
+            end = now if finished == 0 else last
+            duration = (end - first) / 1e9 if first else 0.0
+            result[name] = {
+                "bytes": total,
+                "duration": duration,
+                "mbps": (total * 8 / duration / 1e6) if duration > 0 else 0.0,
+                "workers": workers,
+            }
+        return result
+
+
+session_store = TestSessionStore()
@@ -0,0 +1,255 @@
+# Moduł odpowiedzialny za odbiór danych testu Uploadu.
+#
+# Endpoint /api/upload jest czystą aplikacją ASGI: czytamy wiadomości
+# 'http.request' bezpośrednio z receive(), bez Request/stream() Starlette
+# i bez kopiowania treści. Opcjonalnie (parametr ?test_id=) odebrane bajty
+# są sumowane w stałych przedziałach czasu, co daje serwerową oś czasu
+# przepustowości niezależną od buforowania xhr.upload.onprogress w przeglądarce.
+# Parametr ?session= dolicza bajty do współdzielonej sesji testu (test_sessions.py).
+#
+# Strumienie jednego testu trafiają do różnych workerów uvicorna, więc oś czasu
+# leży w pamięci współdzielonej (shared_state.SharedArray): jeden start (zegar
+# ścienny) na test_id i wspólne sloty, do których dopisują wszystkie procesy.
+# Żądanie zbiera bajty bieżącego slotu lokalnie i dopisuje je pod blokadą dopiero
+# przy zmianie slotu i na końcu - kilka blokad na sekundę, nie na każdy fragment.
+
+import os
+import json
+import time
+import zlib
+import logging
+from urllib.parse import parse_qs
+from .shared_state import SharedArray
+from .test_sessions import session_store
+
+logger = logging.getLogger("UploadSink")
+
+# --- KONFIGURACJA OSI CZASU ---
+SLOT_MS = max(10, int(os.getenv("UPLOAD_SLOT_MS", "50")))
+MAX_SLOTS = 1200           # 60 s przy slotach 50 ms
+TIMELINE_TTL = 300         # Po tylu sekundach bez danych oś czasu jest usuwana
+MAX_TIMELINES = 64
+
+# --- UKŁAD PAMIĘCI (słowa uint64) ---
+# [1 + n * STRIDE]  oś czasu n: id (hash test_id), start_ns, last_ns, total, liczba slotów,
+#                   potem MAX_SLOTS liczników bajtów
+TIMELINES_BASE = 1
+T_ID, T_START, T_LAST, T_TOTAL, T_LEN = 0, 1, 2, 3, 4
+T_HEADER = 5
+STRIDE = T_HEADER + MAX_SLOTS
+
+
+class UploadTimeline:
+    """Licznik bajtów w przedziałach czasu (slotach) jednego połączenia w jednym procesie (WebSocket)."""
+    __slots__ = ("test_id", "slot_ns", "start_ns", "last_ns", "total", "buckets")
+
+    def __init__(self, test_id: str, slot_ms: int = SLOT_MS):
+        self.test_id = test_id
+        self.slot_ns = slot_ms * 1_000_000
+        self.start_ns = time.monotonic_ns()
+        self.last_ns = self.start_ns
+        self.total = 0
+        self.buckets = []
+
+    def add(self, now_ns: int, n: int):
+        idx = (now_ns - self.start_ns) // self.slot_ns
+        if idx >= MAX_SLOTS:
+            idx = MAX_SLOTS - 1
+        buckets = self.buckets
+        if idx >= len(buckets):
+            buckets.extend([0] * (idx + 1 - len(buckets)))
+        buckets[idx] += n
+        self.total += n
+        self.last_ns = now_ns
+
+    def to_dict(self) -> dict:
+        duration = (self.last_ns - self.start_ns) / 1e9
+        slot_s = self.slot_ns / 1e9
+        return {
+            "test_id": self.test_id,
+            "slot_ms": self.slot_ns // 1_000_000,
+            "total": self.total,
+            "duration": duration,
+            "mbps": (self.total * 8 / duration / 1e6) if duration > 0 else 0,
+            "buckets": self.buckets,
+            "buckets_mbps": [round(b * 8 / slot_s / 1e6, 3) for b in self.buckets],
+        }
+
+
+def timeline_key(test_id: str) -> int:
+    # Niezerowy identyfikator 64-bit (0 oznacza wolny slot)
+    return (zlib.crc32(test_id.encode()) << 32 | zlib.adler32(test_id.encode())) or 1
+
+
+class SharedTimelineStore:
+    """Osie czasu Uploadu wspólne dla wszystkich workerów."""
+
+    def __init__(self):
+        self.shm = SharedArray("upload_timelines", TIMELINES_BASE + MAX_TIMELINES * STRIDE, layout=1)
+        self.slot_ns = SLOT_MS * 1_000_000
+        self._slot_cache = {}
+
+    def _find(self, key: int):
+        words = self.shm.words
+        slot = self._slot_cache.get(key)
+        if slot is not None and words[TIMELINES_BASE + slot * STRIDE + T_ID] == key:
+            return slot
+        for n in range(MAX_TIMELINES):
+            if words[TIMELINES_BASE + n * STRIDE + T_ID] == key:
+                self._slot_cache[key] = n
+                return n
+        self._slot_cache.pop(key, None)
+        return None
+
+    def open(self, test_id: str):
+        """Oś czasu testu (istniejąca lub nowa - start to pierwsze dane w dowolnym workerze)."""
+        key = timeline_key(test_id)
+        slot = self._find(key)
+        if slot is not None:
+            return key, slot, self.shm.words[TIMELINES_BASE + slot * STRIDE + T_START]
+
+        words = self.shm.words
+        now = time.time_ns()
+        with self.shm.locked():
+            # Pod blokadą jeszcze raz - inny worker mógł właśnie utworzyć tę oś
+            for n in range(MAX_TIMELINES):
+                if words[TIMELINES_BASE + n * STRIDE + T_ID] == key:
+                    self._slot_cache[key] = n
+                    return key, n, words[TIMELINES_BASE + n * STRIDE + T_START]
+
+            # Wolny slot, a jeśli brak - najdawniej używana oś (wygasłe w pierwszej kolejności)
+            chosen, oldest = None, None
+            for n in range(MAX_TIMELINES):
+                base = TIMELINES_BASE + n * STRIDE
+                if words[base + T_ID] == 0:
+                    chosen = n
+                    break
+                if oldest is None or words[base + T_LAST] < oldest[1]:
+                    oldest = (n, words[base + T_LAST])
+            if chosen is None:
+                chosen = oldest[0]
+
+            base = TIMELINES_BASE + chosen * STRIDE
+            words[base + T_ID] = 0
+            for i in range(1, STRIDE):
+                words[base + i] = 0
+            words[base + T_START] = now
+            words[base + T_LAST] = now
+            words[base + T_ID] = key
+
+        self._slot_cache[key] = chosen
+        return key, chosen, now
+
+    def add(self, key: int, slot: int, idx: int, n: int, now_ns: int):
+        """Dopisuje bajty do slotu `idx` (pod blokadą - piszą wszystkie workery)."""
+        words = self.shm.words
+        base = TIMELINES_BASE + slot * STRIDE
+        idx = min(max(idx, 0), MAX_SLOTS - 1)
+        with self.shm.locked():
+            if words[base + T_ID] != key:
+                return  # oś czasu wyparta przez nowszy test
+            words[base + T_HEADER + idx] += n
+            words[base + T_TOTAL] += n
+            if now_ns > words[base + T_LAST]:
+                words[base + T_LAST] = now_ns
+            if idx + 1 > words[base + T_LEN]:
+                words[base + T_LEN] = idx + 1
+
+    def to_dict(self, test_id: str):
+        """Zsumowana oś czasu testu lub None (nieznany / wygasły test_id)."""
+        key = timeline_key(test_id)
+        slot = self._find(key)
+        if slot is None:
+            return None
+        words = self.shm.words
+        base = TIMELINES_BASE + slot * STRIDE
+        if time.time_ns() - words[base + T_LAST] > TIMELINE_TTL * 1_000_000_000:
+            return None
+        start, last, total = words[base + T_START], words[base + T_LAST], words[base + T_TOTAL]
+        buckets = list(words[base + T_HEADER:base + T_HEADER + words[base + T_LEN]])
+        duration = (last - start) / 1e9
+        slot_s = self.slot_ns / 1e9
+        return {
+            "test_id": test_id,
+            "slot_ms": SLOT_MS,
+            "total": total,
+            "duration": duration,
+            "mbps": (total * 8 / duration / 1e6) if duration > 0 else 0,
+            "buckets": buckets,
+            "buckets_mbps": [round(b * 8 / slot_s / 1e6, 3) for b in buckets],
+        }
+
+
+timeline_store = SharedTimelineStore()
+
+
+def get_timeline(test_id: str):
+    return timeline_store.to_dict(test_id)
+
+
+def query_params(scope) -> dict:
+    qs = scope.get("query_string")
+    if not qs:
+        return {}
+    return {k: v[0][:64] for k, v in parse_qs(qs.decode("latin-1")).items()}
+
+
+class UploadSink:
+    """
+    Aplikacja ASGI dla POST /api/upload.
+    Zwraca {"received": bajty, "time": sekundy} jak dotychczasowy endpoint.
+    """
+
+    async def __call__(self, scope, receive, send):
+        params = query_params(scope)
+        test_id = params.get("test_id")
+        timeline = timeline_store.open(test_id) if test_id else None
+        counter = session_store.counter(params.get("session"), "upload")
+
+        total_bytes = 0
+        start = time.perf_counter()
+        if timeline is not None:
+            key, slot, start_ns = timeline
+            slot_ns = timeline_store.slot_ns
+            pending, pending_idx, pending_ns = 0, 0, 0
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                n = len(message.get("body", b""))
+                if n:
+                    total_bytes += n
+                    if timeline is not None:
+                        now_ns = time.time_ns()
+                        idx = (now_ns - start_ns) // slot_ns
+                        if idx != pending_idx and pending:
+                            timeline_store.add(key, slot, pending_idx, pending, pending_ns)
+                            pending = 0
+                        pending_idx, pending_ns = idx, now_ns
+                        pending += n
+                    if counter is not None:
+                        counter.add(n)
+                if not message.get("more_body", False):
+                    break
+        finally:
+            if timeline is not None and pending:
+                timeline_store.add(key, slot, pending_idx, pending, pending_ns)
+
+        duration = time.perf_counter() - start
+        if duration <= 0: duration = 0.001
+
+        body = json.dumps({"received": total_bytes, "time": duration}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", b"no-store"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+upload_sink = UploadSink()
@@ -0,0 +1,124 @@
+# Moduł odpowiedzialny za test przepustowości po jednym połączeniu WebSocket.
+#
+# Alternatywa dla wielokrotnych żądań HTTP (/api/download, /api/upload):
+# jedno długotrwałe połączenie, po którym przez zadany czas płyną binarne
+# ramki w wybranym kierunku. Dzięki temu reverse proxy buforujące lub
+# limitujące ciała żądań HTTP nie zniekształcają wyniku.
+#
+#   /api/ws/throughput?direction=download|upload&duration=12&frame=1024 (KB)
+#
+# Serwer zlicza bajty w slotach czasowych (jak UploadSink) i na końcu wysyła
+# wynik jako JSON: {"type": "result", ...}. Przy Uploadzie dodatkowo co 200 ms
+# wysyła {"type": "progress", "bytes": n}, aby UI pokazywało bajty faktycznie
+# odebrane przez serwer. Przy Downloadzie liczony jest też czas oczekiwania
+# na opróżnienie bufora gniazda (send_wait) - miara kontroli przepływu.
+
+import time
+import json
+import random
+import asyncio
+import logging
+from fastapi import WebSocket, WebSocketDisconnect
+from .payload_pool import payload_pool, MIN_CHUNK_SIZE, clamp_chunk_size
+from .upload_sink import UploadTimeline
+from .test_sessions import session_store
+
+logger = logging.getLogger("WsThroughput")
+
+MIN_DURATION = 1.0
+MAX_DURATION = 60.0
+PROGRESS_INTERVAL = 0.2
+
+
+def _result(direction: str, timeline: UploadTimeline, frames: int, frame_size: int, send_wait: float = 0.0) -> dict:
+    data = timeline.to_dict()
+    data.pop("test_id", None)
+    data.update({
+        "type": "result",
+        "direction": direction,
+        "frames": frames,
+        "frame_size": frame_size,
+        "send_wait": round(send_wait, 4),
+    })
+    return data
+
+
+async def _run_download(websocket: WebSocket, duration: float, frame_size: int, counter) -> dict:
+    timeline = UploadTimeline("ws-download")
+    view = payload_pool.view
+    size = payload_pool.size
+    offset = random.randrange(0, size, MIN_CHUNK_SIZE)
+    deadline = time.monotonic_ns() + int(duration * 1e9)
+    frames = 0
+    send_wait_ns = 0
+
+    while True:
+        now = time.monotonic_ns()
+        if now >= deadline:
+            break
+        if offset + frame_size > size:
+            offset = 0
+        chunk = view[offset:offset + frame_size]
+        offset += frame_size
+
+        await websocket.send({"type": "websocket.send", "bytes": chunk})
+        after = time.monotonic_ns()
+        send_wait_ns += after - now
+        timeline.add(after, frame_size)
+        frames += 1
+        if counter is not None:
+            counter.add(frame_size)
+
+    return _result("download", timeline, frames, frame_size, send_wait_ns / 1e9)
+
+
+async def _run_upload(websocket: WebSocket, duration: float, frame_size: int, counter) -> dict:
+    timeline = UploadTimeline("ws-upload")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    next_progress = loop.time() + PROGRESS_INTERVAL
+    frames = 0
+
+    while True:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            message = await asyncio.wait_for(websocket.receive(), timeout=min(timeout, PROGRESS_INTERVAL))
+        except asyncio.TimeoutError:
+            message = None
+
+        if message is not None:
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("bytes")
+            if data:
+                n = len(data)
+                timeline.add(time.monotonic_ns(), n)
+                frames += 1
+                if counter is not None:
+                    counter.add(n)
+
+        if loop.time() >= next_progress:
+            next_progress = loop.time() + PROGRESS_INTERVAL
+            await websocket.send_text(json.dumps({"type": "progress", "bytes": timeline.total}))
+
+    return _result("upload", timeline, frames, frame_size)
+
+
+async def run_throughput_session(websocket: WebSocket, direction: str, duration: float, frame: int, session: str = None):
+    await websocket.accept()
+    duration = min(max(duration, MIN_DURATION), MAX_DURATION)
+    frame_size = clamp_chunk_size(frame)
+    try:
+        if direction == "upload":
+            result = await _run_upload(websocket, duration, frame_size, session_store.counter(session, "upload"))
+        else:
+            result = await _run_download(websocket, duration, frame_size, session_store.counter(session, "download"))
+        await websocket.send_text(json.dumps(result))
+        await websocket.close()
+    except (WebSocketDisconnect, OSError):
+        # Klient zamknął połączenie przed końcem testu
+        pass
+    except Exception as e:
+        logger.error(f"Throughput WebSocket Error: {e}")